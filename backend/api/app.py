@@ -3,18 +3,44 @@ FastAPI-приложение для Mini App.
 Раздаёт REST API (/api/...) и статические файлы фронтенда (/).
 """
 
+import asyncio
 import logging
 import os
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 
-from backend.api.routes import admin, analytics, balance, debts, export, expenses, me, operations, reports, summary, users
+from backend.api.routes import admin, analytics, balance, debts, export, expenses, me, operations, reports, summary, users, webhook
+from backend.database import notify
+from backend.services.executor import cpu_executor, loop_lag
+from backend.services.export_jobs import export_jobs
 
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Accounting Bot API", docs_url="/api/docs")
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    """
+    Фоновые задачи процесса API: замер задержки loop, (в RUN_MODE=api) подписка
+    на оповещения и воркеры выгрузок — забрать задания, оставшиеся в очереди.
+    """
+    tasks = [asyncio.create_task(loop_lag.run())]
+    if notify.enabled():
+        tasks.append(asyncio.create_task(notify.listen_forever()))
+    export_jobs.wake()
+    try:
+        yield
+    finally:
+        await webhook.shutdown()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        cpu_executor.shutdown()
+
+
+app = FastAPI(title="Accounting Bot API", docs_url="/api/docs", lifespan=lifespan)
 
 # CORS — разрешаем Telegram-домены и localhost для разработки
 app.add_middleware(
@@ -23,6 +49,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # Подключаем роутеры API
@@ -37,6 +64,7 @@ app.include_router(export.router, prefix="/api", tags=["export"])
 app.include_router(expenses.router, prefix="/api", tags=["expenses"])
 app.include_router(summary.router, prefix="/api", tags=["summary"])
 app.include_router(analytics.router, prefix="/api", tags=["analytics"])
+app.include_router(webhook.router, prefix="/api", tags=["telegram"])
 
 # Раздача статических файлов фронтенда (монтируем ПОСЛЕ всех API-роутеров)
 _static_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "static")
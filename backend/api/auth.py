@@ -7,17 +7,26 @@ import hashlib
 import hmac
 import json
 import time
+from collections import OrderedDict
+from functools import lru_cache
 from urllib.parse import parse_qs, unquote_plus
 
+# Сколько initData считается свежим (секунды от auth_date)
+_MAX_AGE = 86400
+# Сколько проверенных initData держится в памяти
+_CACHE_SIZE = 1024
 
-def validate_init_data(init_data: str, bot_token: str) -> dict:
-    """
-    Проверяет подпись initData от Telegram и возвращает словарь с данными пользователя.
-    Бросает ValueError при невалидных данных.
-    """
-    if not init_data:
-        raise ValueError("Пустой initData")
+# (bot_token, initData) → (данные пользователя, момент устаревания)
+_verified: OrderedDict[tuple[str, str], tuple[dict, float]] = OrderedDict()
+
+
+@lru_cache(maxsize=4)
+def _secret_key(bot_token: str) -> bytes:
+    """Ключ = HMAC("WebAppData", bot_token); для процесса он постоянен."""
+    return hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
 
+
+def _verify(init_data: str, bot_token: str) -> tuple[dict, float]:
     # Парсим строку вида key=value&key2=value2...
     parsed = parse_qs(init_data, keep_blank_values=True)
     params = {k: v[0] for k, v in parsed.items()}
@@ -29,18 +38,45 @@ def validate_init_data(init_data: str, bot_token: str) -> dict:
     # Строим data-check-string: отсортированные пары key=value через \n
     data_check = "\n".join(f"{k}={v}" for k, v in sorted(params.items()))
 
-    # HMAC-SHA256: ключ = HMAC("WebAppData", bot_token)
-    secret_key = hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
-    computed = hmac.new(secret_key, data_check.encode(), hashlib.sha256).hexdigest()
+    # HMAC-SHA256 с ключом, производным от токена бота
+    computed = hmac.new(_secret_key(bot_token), data_check.encode(), hashlib.sha256).hexdigest()
 
     if not hmac.compare_digest(computed, hash_val):
         raise ValueError("Неверная подпись initData")
 
     # Проверяем свежесть данных (не старше 24 часов)
-    auth_date = int(params.get("auth_date", 0))
-    if time.time() - auth_date > 86400:
+    expires_at = int(params.get("auth_date", 0)) + _MAX_AGE
+    if time.time() > expires_at:
         raise ValueError("initData устарел")
 
     # Декодируем JSON с данными пользователя
     user_raw = unquote_plus(params.get("user", "{}"))
-    return json.loads(user_raw)
+    return json.loads(user_raw), expires_at
+
+
+def validate_init_data(init_data: str, bot_token: str) -> dict:
+    """
+    Проверяет подпись initData от Telegram и возвращает словарь с данными пользователя.
+    Бросает ValueError при невалидных данных.
+
+    Mini App присылает один и тот же initData всю сессию, поэтому успешно
+    проверенные строки кэшируются (LRU) до истечения их auth_date.
+    """
+    if not init_data:
+        raise ValueError("Пустой initData")
+
+    key = (bot_token, init_data)
+    cached = _verified.get(key)
+    if cached is not None:
+        user, expires_at = cached
+        if time.time() <= expires_at:
+            _verified.move_to_end(key)
+            return dict(user)
+        del _verified[key]
+        raise ValueError("initData устарел")
+
+    user, expires_at = _verify(init_data, bot_token)
+    _verified[key] = (user, expires_at)
+    if len(_verified) > _CACHE_SIZE:
+        _verified.popitem(last=False)
+    return dict(user)
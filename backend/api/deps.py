@@ -7,9 +7,9 @@ from sqlalchemy.ext.asyncio import AsyncSession
 
 from backend.api.auth import validate_init_data
 from backend.config import settings
-from backend.database import crud
 from backend.database.models import User
 from backend.database.session import async_session_factory
+from backend.services import user_cache
 
 
 async def get_session() -> AsyncSession:
@@ -24,15 +24,16 @@ async def get_current_user(
     session: AsyncSession = Depends(get_session),
 ) -> User:
     """
-    Dependency: валидирует Telegram initData и возвращает пользователя из БД.
-    Автоматически регистрирует нового пользователя при первом обращении.
+    Dependency: валидирует Telegram initData и возвращает пользователя.
+    Автоматически регистрирует нового пользователя при первом обращении,
+    дальше пользователь и роль берутся из кэша (services/user_cache).
     """
     try:
         tg_user = validate_init_data(x_init_data, settings.telegram_bot_token)
     except ValueError as e:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=str(e))
 
-    db_user = await crud.get_or_create_user(
+    db_user = await user_cache.get_user(
         session,
         user_id=tg_user["id"],
         username=tg_user.get("username"),
@@ -1,11 +1,18 @@
+from datetime import datetime
+from typing import Optional
+
 from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
 from sqlalchemy.ext.asyncio import AsyncSession
 from backend.api.deps import get_admin_user, get_session
 from backend.database import crud
 from backend.database.models import User
+from backend.services import read_cache
+from backend.services.executor import cpu_executor, loop_lag
 from backend.services.ip_manager import create_ip as svc_create_ip
 from backend.services.ip_manager import update_ip_balances as svc_update_ip_balances
+from backend.services.reconciliation import reconcile, report_to_dict, run_to_dict
+from backend.services.reports import get_ips_at
 
 router = APIRouter()
 
@@ -34,8 +41,16 @@ async def set_role(user_id: int, body: RoleRequest, admin: User = Depends(get_ad
 
 
 @router.get("/ips")
-async def list_ips(_admin: User = Depends(get_admin_user), session: AsyncSession = Depends(get_session)) -> list:
-    ips = await crud.get_all_ips(session)
+async def list_ips(
+    at: Optional[datetime] = None,
+    _admin: User = Depends(get_admin_user),
+    session: AsyncSession = Depends(get_session),
+) -> list:
+    """ИП с балансами; at — балансы на момент времени (не раньше переноса старой истории — иначе 422)."""
+    try:
+        ips = await read_cache.get_ips(session) if at is None else await get_ips_at(session, at)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
     return [
         {"id": ip.id, "name": ip.name, "bank_balance": ip.bank_balance, "debit_balance": ip.debit_balance, "cash_balance": ip.cash_balance, "initial_capital": ip.initial_capital}
         for ip in ips
@@ -75,3 +90,29 @@ async def update_ip_balances(ip_id: int, body: IpBalancesRequest, _admin: User =
 async def reset_all_data(_admin: User = Depends(get_admin_user), session: AsyncSession = Depends(get_session)) -> dict:
     await crud.reset_all_data(session)
     return {"success": True}
+
+
+@router.get("/runtime")
+async def runtime_stats(_admin: User = Depends(get_admin_user)) -> dict:
+    return {"loop_lag": loop_lag.stats(), "executor": cpu_executor.stats()}
+
+
+@router.post("/reconcile")
+async def run_reconcile(
+    full: bool = False,
+    _admin: User = Depends(get_admin_user),
+    session: AsyncSession = Depends(get_session),
+) -> dict:
+    """
+    Сверка балансов ИП с проводками: досчёт новых проводок и ручные корректировки
+    после прошлого прогона. full=true — сверка со всеми проводками и пересчёт
+    по операциям одним запросом, без блокировки записи; итоги досчёта она не меняет.
+    """
+    report = await reconcile(session, full=full)
+    return report_to_dict(report)
+
+
+@router.get("/reconcile")
+async def last_reconcile(_admin: User = Depends(get_admin_user), session: AsyncSession = Depends(get_session)) -> dict:
+    run = await crud.get_last_reconciliation(session)
+    return {"last_run": run_to_dict(run)}
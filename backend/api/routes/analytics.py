@@ -1,17 +1,17 @@
 """
 Эндпоинт аналитики оборота по типам операций.
-Поддерживает фильтрацию по ИП и периоду.
+Поддерживает фильтрацию по ИП, пользователю, периоду или диапазону дат.
 """
 
+from datetime import date, datetime, time, timedelta
 from typing import Optional
 
 from fastapi import APIRouter, Depends
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from backend.api.deps import get_current_user, get_session
-from backend.database import crud
 from backend.database.models import TxType, User
-from backend.services.reports import _period_start
+from backend.services.reports import _period_start, get_type_totals, sum_types
 
 router = APIRouter()
 
@@ -23,23 +23,30 @@ _EXPENSE_TYPES = {TxType.ZAKUP, TxType.STORONNIE, TxType.EXPENSE_WRITEOFF}
 async def get_analytics(
     period: str = "all",
     ip_id: Optional[int] = None,
+    user_id: Optional[int] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    include_cancelled: bool = False,
     _user: User = Depends(get_current_user),
     session: AsyncSession = Depends(get_session),
 ) -> dict:
-    since = _period_start(period)
-    txs = await crud.get_transactions(session, ip_id=ip_id, since=since, limit=10000)
-
-    by_type: dict[str, int] = {}
-    for tx in txs:
-        by_type[tx.type] = by_type.get(tx.type, 0) + tx.amount
-
-    total_income = sum(by_type.get(t, 0) for t in _INCOME_TYPES)
-    total_expense = sum(by_type.get(t, 0) for t in _EXPENSE_TYPES)
+    """date_from/date_to (включительно) имеют приоритет над period."""
+    if date_from is not None or date_to is not None:
+        since = datetime.combine(date_from, time.min) if date_from else None
+        until = datetime.combine(date_to + timedelta(days=1), time.min) if date_to else None
+    else:
+        since, until = _period_start(period), None
+
+    totals = await get_type_totals(
+        session, since, until,
+        ip_id=ip_id, user_id=user_id, include_cancelled=include_cancelled,
+    )
 
     return {
         "period": period,
         "ip_id": ip_id,
-        "by_type": by_type,
-        "total_income": total_income,
-        "total_expense": total_expense,
+        "by_type": {t: amount for t, (amount, _) in totals.items()},
+        "count_by_type": {t: count for t, (_, count) in totals.items()},
+        "total_income": sum_types(totals, _INCOME_TYPES),
+        "total_expense": sum_types(totals, _EXPENSE_TYPES),
     }
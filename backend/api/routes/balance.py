@@ -1,7 +1,11 @@
-from fastapi import APIRouter, Depends
+from datetime import datetime
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 from backend.api.deps import get_current_user, get_session
-from backend.database import crud
+from backend.services import read_cache
+from backend.services.reports import get_ips_at
 from backend.database.models import User
 
 router = APIRouter()
@@ -9,10 +13,27 @@ router = APIRouter()
 
 @router.get("/balance")
 async def get_balance(
+    at: Optional[datetime] = None,
     current_user: User = Depends(get_current_user),
     session: AsyncSession = Depends(get_session),
 ) -> dict:
-    ips = await crud.get_all_ips(session)
+    """
+    Балансы ИП сейчас или (at) на момент времени — до операций в этот момент и позже.
+    at раньше переноса старой истории в проводки — 422.
+    """
+    if at is None:
+        ips = await read_cache.get_ips(session)
+        totals = await read_cache.get_balance_totals(session)
+    else:
+        try:
+            ips = await get_ips_at(session, at)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        totals = read_cache.BalanceTotals(
+            bank=sum(ip.bank_balance for ip in ips),
+            debit=sum(ip.debit_balance for ip in ips),
+            cash=sum(ip.cash_balance for ip in ips),
+        )
     ip_list = [
         {
             "id": ip.id,
@@ -23,12 +44,9 @@ async def get_balance(
         }
         for ip in ips
     ]
-    total_bank = sum(ip.bank_balance for ip in ips)
-    total_debit = sum(ip.debit_balance for ip in ips)
-    total_cash = sum(ip.cash_balance for ip in ips)
     return {
-        "total_bank": total_bank,
-        "total_debit": total_debit,
-        "total_cash": total_cash,
+        "total_bank": totals.bank,
+        "total_debit": totals.debit,
+        "total_cash": totals.cash,
         "ips": ip_list,
     }
@@ -2,8 +2,8 @@ from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
 from sqlalchemy.ext.asyncio import AsyncSession
 from backend.api.deps import get_current_user, get_session
-from backend.database import crud
 from backend.database.models import User
+from backend.services import read_cache
 from backend.services.transaction import InsufficientFundsError, repay_ip_debt_operation
 
 router = APIRouter()
@@ -14,14 +14,14 @@ async def get_ip_debts(
     _current_user: User = Depends(get_current_user),
     session: AsyncSession = Depends(get_session),
 ) -> list:
-    debts = await crud.get_active_ip_debts(session)
+    debts = await read_cache.get_active_debts(session)
     return [
         {
             "id": d.id,
             "creditor_ip_id": d.creditor_ip_id,
-            "creditor_ip_name": d.creditor_ip.name,
+            "creditor_ip_name": d.creditor_ip_name,
             "debtor_ip_id": d.debtor_ip_id,
-            "debtor_ip_name": d.debtor_ip.name,
+            "debtor_ip_name": d.debtor_ip_name,
             "amount": d.amount,
             "created_at": d.created_at.isoformat(),
         }
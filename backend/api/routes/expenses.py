@@ -33,9 +33,10 @@ async def list_expenses(
     session: AsyncSession = Depends(get_session),
 ) -> list:
     expenses = await crud.get_expenses(session, limit=limit)
+    writeoffs_by_expense = await crud.get_writeoffs_for_expenses(session, [exp.id for exp in expenses])
     result = []
     for exp in expenses:
-        writeoffs = await crud.get_writeoffs_for_expense(session, exp.id)
+        writeoffs = writeoffs_by_expense[exp.id]
         result.append({
             "id": exp.id,
             "description": exp.description,
@@ -1,49 +1,231 @@
 """
-Эндпоинт выгрузки Excel-отчёта по операциям ИП.
-Доступен только пользователям с ролью user или admin.
+Эндпоинты выгрузки отчёта по операциям ИП.
+Доступны только пользователям с ролью user или admin.
+
+GET  /export                    — xlsx: собрать (или взять из кэша) и отдать файл;
+                                  csv/jsonl: отдать потоком, без ip_id — по всем ИП
+GET  /export/consolidated       — ZIP: книга на каждое ИП (все или ip_ids) + «Итого»
+POST /export/jobs               — поставить выгрузку в фоновую очередь
+GET  /export/jobs/{id}          — статус задания
+GET  /export/jobs/{id}/file     — готовый файл
 """
 
-import io
+import tempfile
 from datetime import date
 from typing import Optional
 from urllib.parse import quote
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from backend.api.deps import get_regular_user, get_session
 from backend.database import crud
 from backend.database.models import User
-from backend.services.export import generate_excel
+from backend.database.session import async_session_factory
+from backend.services.consolidated_export import write_consolidated
+from backend.services.executor import ExecutorBusyError
+from backend.services.export import iter_csv, iter_jsonl, iter_rows_many
+from backend.services.export_jobs import FORMATS, export_cache, export_jobs, make_key, render
 
 router = APIRouter()
 
+_CHUNK_SIZE = 64 * 1024
+# До этого размера архив держится в памяти, дальше — во временном файле
+_SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
+# Форматы, которые отдаются потоком прямо из БД, без файла
+_TEXT_ENCODERS = {"csv": iter_csv, "jsonl": iter_jsonl}
+
+
+class ExportJobRequest(BaseModel):
+    ip_id: int
+    date_from: Optional[date] = None
+    date_to: Optional[date] = None
+    format: str = "xlsx"
+
+
+def _iter_file(fileobj):
+    """Отдаёт файл кусками и закрывает его по окончании (или при обрыве клиента)."""
+    try:
+        while chunk := fileobj.read(_CHUNK_SIZE):
+            yield chunk
+    finally:
+        fileobj.close()
+
+
+def _file_response(path: str, filename: str, fmt: str) -> StreamingResponse:
+    # Файл открывается сразу: даже если кэш его вытеснит, открытый дескриптор дочитается
+    try:
+        fileobj = open(path, "rb")
+    except FileNotFoundError:
+        raise HTTPException(status_code=410, detail="Файл выгрузки устарел, сформируйте его заново")
+
+    # RFC 5987 encoding — поддерживает любые Unicode-символы в имени файла
+    encoded_filename = quote(filename)
+    return StreamingResponse(
+        _iter_file(fileobj),
+        media_type=FORMATS[fmt][1],
+        headers={"Content-Disposition": f"attachment; filename*=UTF-8''{encoded_filename}"},
+    )
+
+
+def _export_filename(ip, fmt: str) -> str:
+    today = date.today().strftime("%Y-%m-%d")
+    return f"{ip.name}_{today}{FORMATS[fmt][0]}"
+
+
+def _job_to_dict(job) -> dict:
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "error": job.error,
+        "download_url": f"/api/export/jobs/{job.id}/file" if job.status == "done" else None,
+    }
+
+
+async def _stream_text(fmt: str, ip_ids: list[int], date_from, date_to):
+    """
+    CSV / JSON Lines прямо из серверного курсора. Сессия своя: сессия
+    запроса закрывается до отправки тела, а здесь строки читаются по ходу ответа.
+    """
+    encode = _TEXT_ENCODERS[fmt]
+    async with async_session_factory() as session:
+        ips = [await crud.get_ip(session, ip_id) for ip_id in ip_ids]
+        # ИП проверены до ответа (404), но здесь своя сессия и тело уже отправляется
+        if any(ip is None for ip in ips):
+            raise ValueError("ИП не найдено")
+        async for chunk in encode(iter_rows_many(session, ips, date_from, date_to)):
+            yield chunk
+
 
 @router.get("/export")
-async def export_excel(
-    ip_id: int,
+async def export_history(
+    ip_id: Optional[int] = None,
     date_from: Optional[date] = None,
     date_to: Optional[date] = None,
+    format: str = "xlsx",
     _user: User = Depends(get_regular_user),
     session: AsyncSession = Depends(get_session),
 ) -> StreamingResponse:
-    ip = await crud.get_ip(session, ip_id)
-    if ip is None:
-        raise HTTPException(status_code=404, detail="ИП не найдено")
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"Неизвестный формат выгрузки: {format}")
 
-    # Загружаем ВСЕ транзакции ИП для корректного вычисления running balance
-    all_txs = await crud.get_transactions(session, ip_id=ip_id, limit=10000)
+    if ip_id is None:
+        if format not in _TEXT_ENCODERS:
+            raise HTTPException(status_code=400, detail="Выгрузка по всем ИП доступна в форматах csv и jsonl")
+        ips = await crud.get_all_ips(session)
+        filename = f"all_{date.today().strftime('%Y-%m-%d')}{FORMATS[format][0]}"
+    else:
+        ip = await crud.get_ip(session, ip_id)
+        if ip is None:
+            raise HTTPException(status_code=404, detail="ИП не найдено")
+        ips = [ip]
+        filename = _export_filename(ip, format)
 
-    excel_bytes = generate_excel(ip, all_txs, date_from=date_from, date_to=date_to)
+    if format in _TEXT_ENCODERS:
+        return StreamingResponse(
+            _stream_text(format, [ip.id for ip in ips], date_from, date_to),
+            media_type=FORMATS[format][1],
+            headers={"Content-Disposition": f"attachment; filename*=UTF-8''{quote(filename)}"},
+        )
 
-    today = date.today().strftime("%Y-%m-%d")
-    filename = f"{ip.name}_{today}.xlsx"
-    # RFC 5987 encoding — поддерживает любые Unicode-символы в имени файла
-    encoded_filename = quote(filename)
+    key = await make_key(session, ip_id, date_from, date_to, format)
+    path = export_cache.get(key)
+    if path is None:
+        # Файл собирается целиком до ответа: сессия БД закрывается
+        # раньше, чем начинается отправка тела
+        try:
+            path = await render(session, export_cache, key)
+        except ExecutorBusyError as e:
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+        except ValueError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+
+    return _file_response(path, filename, format)
 
+
+@router.get("/export/consolidated")
+async def export_consolidated(
+    ip_ids: Optional[list[int]] = Query(None),
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    _user: User = Depends(get_regular_user),
+    session: AsyncSession = Depends(get_session),
+) -> StreamingResponse:
+    if ip_ids:
+        ips = [await crud.get_ip(session, ip_id) for ip_id in dict.fromkeys(ip_ids)]
+        if any(ip is None for ip in ips):
+            raise HTTPException(status_code=404, detail="ИП не найдено")
+    else:
+        ips = await crud.get_all_ips(session)
+    if not ips:
+        raise HTTPException(status_code=404, detail="Нет ИП для выгрузки")
+
+    fileobj = tempfile.SpooledTemporaryFile(max_size=_SPOOL_MAX_SIZE)
+    try:
+        await write_consolidated([ip.id for ip in ips], fileobj, date_from, date_to)
+    except ExecutorBusyError as e:
+        fileobj.close()
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    except ValueError as e:
+        fileobj.close()
+        raise HTTPException(status_code=404, detail=str(e))
+    except BaseException:
+        fileobj.close()
+        raise
+    fileobj.seek(0)
+
+    filename = f"ИП_{date.today().strftime('%Y-%m-%d')}.zip"
     return StreamingResponse(
-        io.BytesIO(excel_bytes),
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": f"attachment; filename*=UTF-8''{encoded_filename}"},
+        _iter_file(fileobj),
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename*=UTF-8''{quote(filename)}"},
     )
+
+
+@router.post("/export/jobs")
+async def create_export_job(
+    body: ExportJobRequest,
+    current_user: User = Depends(get_regular_user),
+    session: AsyncSession = Depends(get_session),
+):
+    ip = await crud.get_ip(session, body.ip_id)
+    if ip is None:
+        raise HTTPException(status_code=404, detail="ИП не найдено")
+    try:
+        key = await make_key(session, ip.id, body.date_from, body.date_to, body.format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    job = await export_jobs.submit(session, current_user.id, key, _export_filename(ip, body.format))
+    return _job_to_dict(job)
+
+
+async def _get_own_job(session, job_id: str, user: User):
+    job = await export_jobs.get(session, job_id)
+    if job is None or job.user_id != user.id:
+        raise HTTPException(status_code=404, detail="Задание не найдено")
+    return job
+
+
+@router.get("/export/jobs/{job_id}")
+async def get_export_job(
+    job_id: str,
+    current_user: User = Depends(get_regular_user),
+    session: AsyncSession = Depends(get_session),
+):
+    return _job_to_dict(await _get_own_job(session, job_id, current_user))
+
+
+@router.get("/export/jobs/{job_id}/file")
+async def download_export_job(
+    job_id: str,
+    current_user: User = Depends(get_regular_user),
+    session: AsyncSession = Depends(get_session),
+) -> StreamingResponse:
+    job = await _get_own_job(session, job_id, current_user)
+    if job.status != "done":
+        raise HTTPException(status_code=409, detail="Выгрузка ещё не готова")
+    return _file_response(export_jobs.file_path(job), job.filename, job.fmt)
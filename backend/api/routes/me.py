@@ -16,4 +16,5 @@ async def get_me(current_user: User = Depends(get_current_user)) -> dict:
         "display_name": current_user.display_name,
         "role": current_user.role,
         "cash_balance": current_user.cash_balance,
+        "digest_enabled": current_user.digest_enabled,
     }
@@ -1,11 +1,19 @@
+import base64
+from datetime import datetime
 from typing import Optional
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from pydantic import BaseModel, field_validator
 from sqlalchemy.ext.asyncio import AsyncSession
 from backend.api.deps import get_admin_user, get_current_user, get_regular_user, get_session
 from backend.database import crud
 from backend.database.models import TX_LABELS, User
-from backend.services.transaction import InsufficientFundsError, cancel_operation, edit_operation, process_operation
+from backend.services.transaction import (
+    InsufficientFundsError,
+    cancel_operation,
+    edit_operation,
+    process_operation,
+    process_operations_batch,
+)
 
 router = APIRouter()
 
@@ -26,6 +34,20 @@ class OperationRequest(BaseModel):
         return v
 
 
+class BatchOperationRequest(BaseModel):
+    items: list[OperationRequest]
+    atomic: bool = True  # False — провести успешные позиции, вернуть ошибки по остальным
+
+    @field_validator("items")
+    @classmethod
+    def items_limit(cls, v):
+        if not v:
+            raise ValueError("Список операций пуст")
+        if len(v) > 500:
+            raise ValueError("Не больше 500 операций за раз")
+        return v
+
+
 class EditOperationRequest(BaseModel):
     amount: Optional[int] = None
     comment: Optional[str] = None
@@ -55,6 +77,26 @@ async def create_operation(
     return {"success": True, "transaction_id": tx.id}
 
 
+@router.post("/operations/batch")
+async def create_operations_batch(
+    body: BatchOperationRequest,
+    current_user: User = Depends(get_regular_user),
+    session: AsyncSession = Depends(get_session),
+) -> dict:
+    try:
+        results = await process_operations_batch(
+            session,
+            user_id=current_user.id,
+            items=[item.model_dump() for item in body.items],
+            atomic=body.atomic,
+        )
+    except InsufficientFundsError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return {"success": all(r["success"] for r in results), "results": results}
+
+
 @router.post("/operations/{tx_id}/cancel")
 async def cancel_operation_route(
     tx_id: int,
@@ -90,15 +132,48 @@ async def edit_operation_route(
     return {"success": True, "transaction_id": tx.id, "amount": tx.amount, "comment": tx.comment}
 
 
+def _encode_cursor(created_at: datetime, tx_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{tx_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, tx_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(created_at), int(tx_id)
+    except ValueError:
+        raise HTTPException(status_code=422, detail="Неверный курсор")
+
+
 @router.get("/transactions")
 async def get_transactions(
-    limit: int = 100,
+    response: Response,
+    limit: int = Query(100, ge=1, le=500),
     ip_id: Optional[int] = None,
+    user_id: Optional[int] = None,
     include_cancelled: bool = False,
+    cursor: Optional[str] = None,
     _current_user: User = Depends(get_current_user),
     session: AsyncSession = Depends(get_session),
 ) -> list:
-    txs = await crud.get_transactions(session, ip_id=ip_id, limit=limit, include_cancelled=include_cancelled)
+    """
+    Лента операций. Следующая страница — тот же запрос с cursor из
+    заголовка X-Next-Cursor (заголовка нет — страниц больше нет).
+    """
+    before = _decode_cursor(cursor) if cursor else None
+    # Берём на одну строку больше, чтобы понять, есть ли следующая страница
+    txs = await crud.get_transactions(
+        session,
+        ip_id=ip_id,
+        user_id=user_id,
+        limit=limit + 1,
+        include_cancelled=include_cancelled,
+        before=before,
+    )
+    if len(txs) > limit:
+        txs = txs[:limit]
+        response.headers["X-Next-Cursor"] = _encode_cursor(txs[-1].created_at, txs[-1].id)
     return [
         {
             "id": tx.id,
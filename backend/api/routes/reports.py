@@ -2,9 +2,9 @@ from fastapi import APIRouter, Depends
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from backend.api.deps import get_current_user, get_session
-from backend.database import crud
 from backend.database.models import EXPENSE_TYPES, INCOME_TYPES, User
-from backend.services.reports import _period_start
+from backend.services import read_cache
+from backend.services.reports import _period_start, get_type_totals, sum_types
 
 router = APIRouter()
 
@@ -16,13 +16,13 @@ async def get_report(
     session: AsyncSession = Depends(get_session),
 ) -> dict:
     since = _period_start(period)
-    txs = await crud.get_transactions(session, since=since)
+    totals = await get_type_totals(session, since)
 
-    income = sum(t.amount for t in txs if t.type in INCOME_TYPES)
-    expense = sum(t.amount for t in txs if t.type in EXPENSE_TYPES)
+    income = sum_types(totals, INCOME_TYPES)
+    expense = sum_types(totals, EXPENSE_TYPES)
 
-    ips = await crud.get_all_ips(session)
-    ip_debts = await crud.get_active_ip_debts(session)
+    ips = await read_cache.get_ips(session)
+    ip_debts = await read_cache.get_active_debts(session)
 
     return {
         "period": period,
@@ -40,8 +40,8 @@ async def get_report(
         ],
         "ip_debts": [
             {
-                "debtor_ip_name": d.debtor_ip.name,
-                "creditor_ip_name": d.creditor_ip.name,
+                "debtor_ip_name": d.debtor_ip_name,
+                "creditor_ip_name": d.creditor_ip_name,
                 "amount": d.amount,
             }
             for d in ip_debts
@@ -1,57 +1,49 @@
 """
-Эндпоинт отправки мини-сводки в Telegram.
-Отправляет текущее состояние балансов ИП и долгов пользователю в личку.
+Эндпоинты мини-сводки в Telegram.
+Отправляет текущее состояние балансов ИП и долгов пользователю в личку:
+сообщение ставится в очередь, отправляет его процесс бота (bot/outbox.py).
 """
 
-from fastapi import APIRouter, Depends, Request
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from backend.api.deps import get_current_user, get_session
 from backend.database import crud
 from backend.database.models import User
+from backend.services.executor import ExecutorBusyError
+from backend.services.summary import render_summary
 
 router = APIRouter()
 
 
-def _fmt(n: int) -> str:
-    return f"{n:,}".replace(",", "\u202f") + "\u00a0\u20bd"
-
-
-def _build_summary_text(ips, debts) -> str:
-    lines = ["📊 <b>Сводка балансов</b>", ""]
-    if ips:
-        for ip in ips:
-            lines.append(f"🏢 <b>{ip.name}</b>")
-            lines.append(f"  Р/С:    {_fmt(ip.bank_balance)}")
-            lines.append(f"  Дебет:  {_fmt(ip.debit_balance)}")
-            lines.append(f"  Нал:    {_fmt(ip.cash_balance)}")
-            lines.append("")
-    else:
-        lines += ["Нет ИП", ""]
-
-    if debts:
-        lines.append("🔴 <b>Долги между ИП:</b>")
-        for d in debts:
-            lines.append(f"  • {d.debtor_ip.name} → {d.creditor_ip.name}: {_fmt(d.amount)}")
-    else:
-        lines.append("✅ Долгов между ИП нет")
-
-    return "\n".join(lines)
+class DigestSubscriptionRequest(BaseModel):
+    enabled: bool
 
 
 @router.post("/summary/send")
 async def send_summary(
-    request: Request,
     current_user: User = Depends(get_current_user),
     session: AsyncSession = Depends(get_session),
 ) -> dict:
-    ips = await crud.get_all_ips(session)
-    debts = await crud.get_active_ip_debts(session)
-    text = _build_summary_text(ips, debts)
-
-    bot = getattr(request.app.state, "bot", None)
-    if bot is None:
-        return {"ok": False, "error": "Бот недоступен"}
+    try:
+        text = await render_summary(session)
+    except ExecutorBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e))
 
-    await bot.send_message(current_user.id, text, parse_mode="HTML")
+    await crud.enqueue_message(session, current_user.id, text)
     return {"ok": True}
+
+
+@router.put("/summary/subscription")
+async def set_digest_subscription(
+    body: DigestSubscriptionRequest,
+    current_user: User = Depends(get_current_user),
+    session: AsyncSession = Depends(get_session),
+) -> dict:
+    """Подписка на ежедневную сводку (время рассылки — DIGEST_TIME)."""
+    try:
+        user = await crud.set_digest_enabled(session, current_user.id, body.enabled)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return {"ok": True, "digest_enabled": user.digest_enabled}
@@ -0,0 +1,57 @@
+"""
+Приём апдейтов Telegram в режиме webhook (BOT_UPDATE_MODE=webhook).
+
+Апдейт передаётся в тот же Dispatcher с теми же middleware, что и при polling.
+Ответ 200 уходит сразу, а сам апдейт обрабатывается отдельной задачей:
+иначе Telegram ждал бы окончания хэндлера и не присылал следующие апдейты.
+"""
+
+import asyncio
+import hmac
+import logging
+
+from aiogram.types import Update
+from fastapi import APIRouter, Header, HTTPException, Request
+
+from backend.config import settings
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+WEBHOOK_PATH = "/telegram/webhook"
+
+# Ссылки на задачи, чтобы их не собрал сборщик мусора до завершения
+_tasks: set[asyncio.Task] = set()
+
+
+async def _process(dispatcher, bot, update: Update) -> None:
+    try:
+        await dispatcher.feed_update(bot, update)
+    except Exception:
+        logger.exception("Ошибка обработки апдейта %s", update.update_id)
+
+
+@router.post(WEBHOOK_PATH)
+async def telegram_webhook(
+    request: Request,
+    secret_token: str = Header("", alias="X-Telegram-Bot-Api-Secret-Token"),
+) -> dict:
+    dispatcher = getattr(request.app.state, "dispatcher", None)
+    bot = getattr(request.app.state, "bot", None)
+    if dispatcher is None or bot is None:
+        raise HTTPException(status_code=404, detail="Webhook не настроен")
+    if not hmac.compare_digest(secret_token, settings.webhook_secret_token):
+        raise HTTPException(status_code=403, detail="Неверный секрет webhook")
+
+    update = Update.model_validate(await request.json(), context={"bot": bot})
+    task = asyncio.create_task(_process(dispatcher, bot, update))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return {"ok": True}
+
+
+async def shutdown() -> None:
+    """Дожидается апдейтов, которые ещё обрабатываются."""
+    if _tasks:
+        await asyncio.gather(*_tasks, return_exceptions=True)
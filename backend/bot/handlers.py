@@ -5,6 +5,7 @@
 """
 
 import logging
+from collections import OrderedDict
 
 from aiogram import Bot, F, Router
 from aiogram.filters import Command
@@ -24,6 +25,11 @@ from backend.database.models import User
 logger = logging.getLogger(__name__)
 router = Router()
 
+# Чаты, где кнопка меню уже установлена (повторно не вызываем set_chat_menu_button).
+# LRU на _MENU_BUTTON_CACHE_SIZE чатов: вытесненный чат получит кнопку ещё раз — это безвредно
+_MENU_BUTTON_CACHE_SIZE = 4096
+_menu_button_chats: OrderedDict[int, None] = OrderedDict()
+
 
 # ── Вспомогательная функция ───────────────────────────────────────────────────
 
@@ -57,8 +63,7 @@ async def cmd_start(message: Message, db_user: User, bot: Bot, session: AsyncSes
         if code == settings.admin_invite_code:
             if db_user.role != "admin":
                 async with session.begin():
-                    await crud.set_user_role(session, db_user.id, "admin")
-                db_user.role = "admin"
+                    db_user = await crud.set_user_role(session, db_user.id, "admin")
                 admin_note = "\n\n👑 <b>Вы стали администратором!</b>"
             else:
                 admin_note = "\n\n👑 Вы уже администратор."
@@ -75,17 +80,23 @@ async def cmd_start(message: Message, db_user: User, bot: Bot, session: AsyncSes
         f"Все операции выполняются через приложение ниже.{admin_note}"
     )
 
-    # Устанавливаем кнопку меню (постоянная кнопка снизу в Telegram)
-    try:
-        await bot.set_chat_menu_button(
-            chat_id=message.chat.id,
-            menu_button=MenuButtonWebApp(
-                text="📱 Бухгалтерия",
-                web_app=WebAppInfo(url=settings.webapp_url),
-            ),
-        )
-    except Exception as e:
-        logger.warning("Не удалось установить menu button: %s", e)
+    # Устанавливаем кнопку меню (постоянная кнопка снизу в Telegram) — один раз на чат
+    if message.chat.id in _menu_button_chats:
+        _menu_button_chats.move_to_end(message.chat.id)
+    else:
+        try:
+            await bot.set_chat_menu_button(
+                chat_id=message.chat.id,
+                menu_button=MenuButtonWebApp(
+                    text="📱 Бухгалтерия",
+                    web_app=WebAppInfo(url=settings.webapp_url),
+                ),
+            )
+            _menu_button_chats[message.chat.id] = None
+            if len(_menu_button_chats) > _MENU_BUTTON_CACHE_SIZE:
+                _menu_button_chats.popitem(last=False)
+        except Exception as e:
+            logger.warning("Не удалось установить menu button: %s", e)
 
     await message.answer(text, reply_markup=_webapp_keyboard())
 
@@ -2,6 +2,11 @@
 Middleware для:
 1. DbSessionMiddleware — прокидывает AsyncSession во все хэндлеры
 2. UserMiddleware — авторегистрация пользователя и передача db_user
+
+Соединение из пула берётся только при первом запросе к БД: сама AsyncSession
+и пустая транзакция соединения не занимают. Пользователь берётся из общего
+с API кэша (services/user_cache), поэтому апдейты, хэндлеры которых не ходят
+в БД, пул не трогают вовсе.
 """
 
 from __future__ import annotations
@@ -13,15 +18,15 @@ from aiogram import BaseMiddleware
 from aiogram.types import TelegramObject
 
 from backend.config import settings
-from backend.database import crud
 from backend.database.session import async_session_factory
+from backend.services import user_cache
 
 logger = logging.getLogger(__name__)
 
 
 class DbSessionMiddleware(BaseMiddleware):
     """
-    Открывает AsyncSession перед каждым апдейтом и закрывает после.
+    Создаёт AsyncSession на время апдейта (соединение — лениво, при первом запросе).
     Сессия доступна в хэндлерах как параметр `session: AsyncSession`.
     """
 
@@ -39,7 +44,7 @@ class DbSessionMiddleware(BaseMiddleware):
 class UserMiddleware(BaseMiddleware):
     """
     Авторегистрация пользователя при первом обращении.
-    db_user (объект User из БД) доступен в хэндлерах как параметр.
+    db_user (копия User из кэша, не привязанная к сессии) доступен в хэндлерах как параметр.
     """
 
     async def __call__(
@@ -54,7 +59,7 @@ class UserMiddleware(BaseMiddleware):
         if tg_user and session:
             try:
                 async with session.begin():
-                    db_user = await crud.get_or_create_user(
+                    db_user = await user_cache.get_user(
                         session,
                         user_id=tg_user.id,
                         username=tg_user.username,
@@ -0,0 +1,225 @@
+"""
+Отправка сообщений из очереди outbound_messages.
+
+API не держит объект Bot: маршруты кладут сообщение в таблицу в своей
+транзакции (crud.enqueue_message), а отправляет его процесс бота. Так API
+может работать в нескольких процессах, а бот остаётся единственным.
+
+Скорость отправки ограничена, чтобы не упираться в лимиты Telegram:
+общий token bucket (OUTBOX_RATE сообщений в секунду) и отдельный на каждый
+чат (OUTBOX_CHAT_RATE). Сообщения разным чатам уходят параллельно.
+На RetryAfter отправка приостанавливается целиком на указанное время,
+при других ошибках сообщение откладывается с растущей паузой, а следующие
+сообщения того же чата ждут его.
+
+Сообщения берутся из таблицы с арендой (next_attempt_at) в короткой
+транзакции, отправляются вне транзакции, и каждое отмечается отправленным
+сразу после отправки. При падении процесса повторно уйдёт не больше
+сообщений, чем отправлялось в этот момент.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from backend.config import settings
+from backend.database import crud
+from backend.database.models import OutboundMessage
+from backend.database.session import async_session_factory
+
+logger = logging.getLogger(__name__)
+
+_POLL_INTERVAL = 1.0
+_BATCH_SIZE = 50
+_MAX_ATTEMPTS = 5
+# Пауза перед повтором после ошибки: 10 с, 20 с, 40 с… но не больше часа
+_BACKOFF_BASE = 10
+_BACKOFF_MAX = 3600
+# Аренда взятого сообщения: если процесс упал, не дождавшись отправки,
+# сообщение снова попадёт в выборку через столько секунд
+_LEASE_SECONDS = 300
+# Сколько бакетов чатов держать, прежде чем выбросить простаивающие
+_MAX_CHAT_BUCKETS = 1000
+
+# Будит отправителя сразу после коммита сообщения в этом же процессе
+_wakeup = asyncio.Event()
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session) -> None:
+    if session.info.pop("outbox_pending", False):
+        _wakeup.set()
+
+
+@event.listens_for(Session, "after_flush")
+def _after_flush(session, flush_context) -> None:
+    if any(isinstance(obj, OutboundMessage) for obj in session.new):
+        session.info["outbox_pending"] = True
+
+
+# ── Ограничение скорости ──────────────────────────────────────────────────────
+
+class TokenBucket:
+    """rate токенов в секунду, подряд — не больше capacity."""
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self) -> float:
+        """
+        Забирает токен и возвращает, сколько секунд ждать до его появления.
+        Токены уходят «в долг», поэтому ожидающие обслуживаются по очереди.
+        """
+        self._refill()
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def restart(self) -> None:
+        """Токен взят только что: следующий — не раньше чем через 1 / rate."""
+        self.tokens = min(self.tokens, 0.0)
+        self.updated = time.monotonic()
+
+    def idle(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+class RateLimiter:
+    """Общий лимит и лимит на чат; pause() — для RetryAfter от Telegram."""
+
+    def __init__(self, rate: float, chat_rate: float):
+        self._global = TokenBucket(rate)
+        self._chat_rate = chat_rate
+        self._chats: dict[int, TokenBucket] = {}
+        self._paused_until = 0.0
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= _MAX_CHAT_BUCKETS:
+                self._chats = {cid: b for cid, b in self._chats.items() if not b.idle()}
+            bucket = self._chats[chat_id] = TokenBucket(self._chat_rate)
+        return bucket
+
+    async def wait(self, chat_id: int) -> None:
+        chat = self._chat_bucket(chat_id)
+        delay = chat.reserve()
+        if delay:
+            await asyncio.sleep(delay)
+        while True:
+            delay = self._global.reserve()
+            if delay:
+                await asyncio.sleep(delay)
+            if time.monotonic() >= self._paused_until:
+                # Пока ждали общий лимит, ведро чата копило токены: интервал
+                # в чате отсчитывается от фактической отправки
+                chat.restart()
+                return
+            # Пока ждали, Telegram попросил паузу: токен взят до неё, встаём в очередь заново
+            await asyncio.sleep(self._paused_until - time.monotonic())
+
+    def pause(self, seconds: float) -> None:
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        # Первый токен после паузы — не раньше её конца; прежние резервы сгорают
+        self._global.tokens = 0.0
+        self._global.updated = self._paused_until
+
+
+# ── Отправка ──────────────────────────────────────────────────────────────────
+
+async def _record(fn, *args) -> None:
+    """Результат отправки — отдельной короткой транзакцией, сразу после сообщения."""
+    async with async_session_factory() as session, session.begin():
+        await fn(session, *args)
+
+
+async def _send_one(bot: Bot, limiter: RateLimiter, message: OutboundMessage) -> bool:
+    """Отправляет сообщение и записывает результат. False — не отправлено."""
+    while True:
+        await limiter.wait(message.chat_id)
+        try:
+            await bot.send_message(message.chat_id, message.body, parse_mode=message.parse_mode)
+        except TelegramRetryAfter as e:
+            # Не ошибка сообщения: ждём сколько сказано и пробуем снова
+            logger.warning("Telegram просит подождать %s с", e.retry_after)
+            limiter.pause(e.retry_after)
+            continue
+        except TelegramForbiddenError as e:
+            # Пользователь заблокировал бота — повторять бессмысленно
+            await _record(crud.mark_outbound_failed, message.id, _MAX_ATTEMPTS, str(e))
+        except Exception as e:
+            attempts = message.attempts + 1
+            backoff = min(_BACKOFF_BASE * 2 ** (attempts - 1), _BACKOFF_MAX)
+            next_attempt_at = datetime.utcnow() + timedelta(seconds=backoff)
+            logger.warning("Не удалось отправить сообщение #%d: %s", message.id, e)
+            await _record(crud.mark_outbound_failed, message.id, attempts, str(e), next_attempt_at)
+        else:
+            await _record(crud.mark_outbound_sent, message.id)
+            return True
+        return False
+
+
+async def _send_chat(bot: Bot, limiter: RateLimiter, messages: list[OutboundMessage]) -> None:
+    # Сообщения одному чату — по порядку: после неудачи остальные ждут,
+    # пока не уйдёт предыдущее (claim_outbound_messages не возьмёт их раньше)
+    for index, message in enumerate(messages):
+        if not await _send_one(bot, limiter, message):
+            await _record(crud.release_outbound_messages, [m.id for m in messages[index + 1:]])
+            return
+
+
+async def _send_batch(bot: Bot, limiter: RateLimiter) -> int:
+    # Транзакция выборки только ставит аренду и сразу коммитится:
+    # отправка (с паузами лимитов) идёт без открытой транзакции
+    async with async_session_factory() as session, session.begin():
+        messages = await crud.claim_outbound_messages(
+            session, limit=_BATCH_SIZE, max_attempts=_MAX_ATTEMPTS, lease_seconds=_LEASE_SECONDS,
+        )
+    by_chat: dict[int, list[OutboundMessage]] = {}
+    for message in messages:
+        by_chat.setdefault(message.chat_id, []).append(message)
+    results = await asyncio.gather(
+        *(_send_chat(bot, limiter, chat_messages) for chat_messages in by_chat.values()),
+        return_exceptions=True,
+    )
+    for result in results:
+        if isinstance(result, Exception):
+            # Например, БД недоступна при записи результата: сообщение
+            # вернётся в очередь по окончании аренды
+            logger.error("Ошибка отправки сообщений чата", exc_info=result)
+    return len(messages)
+
+
+async def run_outbox(bot: Bot) -> None:
+    """Бесконечно отправляет сообщения из очереди."""
+    limiter = RateLimiter(settings.outbox_rate, settings.outbox_chat_rate)
+    while True:
+        try:
+            sent = await _send_batch(bot, limiter)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Ошибка отправки очереди сообщений")
+            sent = 0
+        if sent < _BATCH_SIZE:
+            try:
+                await asyncio.wait_for(_wakeup.wait(), timeout=_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            _wakeup.clear()
@@ -5,6 +5,7 @@
 
 from __future__ import annotations
 
+import hashlib
 from typing import List
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -19,6 +20,17 @@ class Settings(BaseSettings):
 
     # ── Telegram ──────────────────────────────────────────────────────────────
     telegram_bot_token: str
+    # Получение апдейтов: polling (по умолчанию) или webhook — Telegram сам
+    # присылает их на эндпоинт API (WEBAPP_URL/api/telegram/webhook)
+    bot_update_mode: str = "polling"
+    # Секрет заголовка X-Telegram-Bot-Api-Secret-Token (пусто — выводится из токена бота)
+    webhook_secret: str = ""
+
+    @property
+    def webhook_secret_token(self) -> str:
+        if self.webhook_secret:
+            return self.webhook_secret
+        return hashlib.sha256(self.telegram_bot_token.encode()).hexdigest()
 
     # ── База данных ───────────────────────────────────────────────────────────
     database_url: str = (
@@ -44,6 +56,39 @@ class Settings(BaseSettings):
     # Порт FastAPI-сервера (Railway использует PORT из окружения)
     port: int = 8000
 
+    # ── Режим запуска ─────────────────────────────────────────────────────────
+    # single — бот и API в одном процессе; api — только API (API_WORKERS
+    # процессов uvicorn); bot — только бот и отправка исходящих сообщений
+    run_mode: str = "single"
+    api_workers: int = 1
+
+    # ── Исходящие сообщения ───────────────────────────────────────────────────
+    # Лимиты Telegram: около 30 сообщений в секунду всего и 1 в секунду в один чат
+    outbox_rate: float = 25
+    outbox_chat_rate: float = 1
+    # Ежедневная сводка подписчикам: время ЧЧ:ММ по UTC (пусто — не отправляется)
+    digest_time: str = ""
+    # Ночная сверка балансов ИП с проводками, ЧЧ:ММ по UTC (пусто — только вручную)
+    reconcile_time: str = "03:00"
+
+    # ── Выгрузки ──────────────────────────────────────────────────────────────
+    # Каталог кэша готовых файлов (пусто — во временном каталоге системы).
+    # Общий для всех процессов API: файл задания отдаёт любой из них
+    export_cache_dir: str = ""
+    # Предельный размер кэша; при превышении удаляются давно не запрошенные файлы
+    export_cache_max_mb: int = 500
+    # Сколько выгрузок собирается одновременно
+    export_workers: int = 2
+
+    # ── CPU-нагрузка ──────────────────────────────────────────────────────────
+    # Пул для тяжёлой синхронной работы: thread или process
+    cpu_executor: str = "thread"
+    cpu_workers: int = 2
+    # Сколько задач может ждать свободного воркера; сверх этого — отказ (503)
+    cpu_queue_size: int = 8
+    # Задержка event loop, о которой пишется предупреждение в лог
+    loop_lag_warn_ms: float = 200
+
     # ── Безопасность ──────────────────────────────────────────────────────────
     # Код для получения прав администратора (/start ADMIN_CODE)
     admin_invite_code: str = "ACC-ADMIN-2025"
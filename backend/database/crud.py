@@ -1,10 +1,28 @@
 from __future__ import annotations
 import logging
-from datetime import datetime
-from sqlalchemy import select, and_, delete, or_
+from datetime import datetime, time, timedelta
+from sqlalchemy import select, and_, case, delete, func, insert, literal, or_, text, tuple_, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import selectinload
-from backend.database.models import Expense, IpDebt, Transaction, User, IP
+from sqlalchemy.orm import aliased, contains_eager, joinedload, selectinload
+from backend.database.models import (
+    BUCKETS,
+    TX_POSTINGS,
+    Expense,
+    ExportCacheGeneration,
+    ExportJob,
+    IP,
+    IpBalanceCheckpoint,
+    IpDebt,
+    LedgerEntry,
+    LedgerKind,
+    LedgerTotal,
+    OutboundMessage,
+    ReconciliationRun,
+    Transaction,
+    TransactionDailyAggregate,
+    User,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -43,18 +61,46 @@ async def set_user_role(session, user_id, role):
     user.role = role
     return user
 
+async def set_digest_enabled(session, user_id, enabled):
+    user = await get_user(session, user_id)
+    if user is None:
+        raise ValueError(f"Пользователь {user_id} не найден")
+    user.digest_enabled = enabled
+    return user
+
+async def get_digest_subscribers(session):
+    result = await session.execute(select(User.id).where(User.digest_enabled.is_(True)).order_by(User.id))
+    return list(result.scalars().all())
+
 async def create_ip(session, name, bank_balance=0, cash_balance=0):
     ip = IP(name=name, bank_balance=bank_balance, debit_balance=0, cash_balance=cash_balance, initial_capital=bank_balance + cash_balance)
     session.add(ip)
     await session.flush()
+    # Начальные остатки — проводками без операции
+    await create_ledger_entries(session, [
+        {"tx_id": None, "ip_id": ip.id, "bucket": bucket, "delta": amount, "kind": LedgerKind.OPENING}
+        for bucket, amount in (("cash", cash_balance), ("bank", bank_balance))
+        if amount
+    ])
+    await create_checkpoint(session, ip, tx_id=0)
     return ip
 
 async def set_ip_balances(session, ip_id, bank_balance, cash_balance):
-    ip = await get_ip(session, ip_id)
+    # Под блокировкой: параллельная операция не должна попасть между чтением
+    # старых балансов и записью новых (и в контрольную точку)
+    ip = (await lock_ips(session, [ip_id])).get(ip_id)
     if ip is None:
         raise ValueError(f"ИП {ip_id} не найдено")
+    # Корректировка — проводками без операции на разницу с текущими балансами
+    await create_ledger_entries(session, [
+        {"tx_id": None, "ip_id": ip.id, "bucket": bucket, "delta": new - old, "kind": LedgerKind.ADJUSTMENT}
+        for bucket, old, new in (("cash", ip.cash_balance, cash_balance), ("bank", ip.bank_balance, bank_balance))
+        if new != old
+    ])
     ip.bank_balance = bank_balance
     ip.cash_balance = cash_balance
+    # Ручная правка не проходит через транзакции — от неё история считается заново
+    await create_checkpoint(session, ip)
     return ip
 
 async def get_ip(session, ip_id):
@@ -69,26 +115,22 @@ async def get_all_ips(session):
     result = await session.execute(select(IP).order_by(IP.name))
     return list(result.scalars().all())
 
-async def update_ip_bank(session, ip_id, delta):
-    ip = await get_ip(session, ip_id)
-    if ip is None:
-        raise ValueError(f"ИП {ip_id} не найдено")
-    ip.bank_balance += delta
-    return ip
-
-async def update_ip_debit(session, ip_id, delta):
-    ip = await get_ip(session, ip_id)
-    if ip is None:
-        raise ValueError(f"ИП {ip_id} не найдено")
-    ip.debit_balance += delta
-    return ip
-
-async def update_ip_cash(session, ip_id, delta):
-    ip = await get_ip(session, ip_id)
-    if ip is None:
-        raise ValueError(f"ИП {ip_id} не найдено")
-    ip.cash_balance += delta
-    return ip
+async def lock_ips(session, ip_ids):
+    """
+    Загружает ИП с блокировкой строк (SELECT ... FOR UPDATE) одним запросом.
+    Порядок по id — чтобы параллельные пачки не ловили взаимную блокировку.
+    Возвращает {ip_id: IP}; отсутствующих id в словаре нет.
+    """
+    if not ip_ids:
+        return {}
+    result = await session.execute(
+        select(IP)
+        .where(IP.id.in_(ip_ids))
+        .order_by(IP.id)
+        .with_for_update()
+        .execution_options(populate_existing=True)
+    )
+    return {ip.id: ip for ip in result.scalars().all()}
 
 async def create_transaction(session, user_id, tx_type, amount, ip_id=None, comment=None, destination=None):
     tx = Transaction(user_id=user_id, ip_id=ip_id, type=tx_type, amount=amount, comment=comment, destination=destination)
@@ -96,11 +138,30 @@ async def create_transaction(session, user_id, tx_type, amount, ip_id=None, comm
     await session.flush()
     return tx
 
-async def get_transactions(session, *, user_id=None, ip_id=None, since=None, limit=100, include_cancelled=False):
+async def create_transactions_bulk(session, rows):
+    """
+    Массовая вставка транзакций одним INSERT ... RETURNING.
+    rows — словари с полями Transaction. Возвращает [(id, created_at)] в порядке rows.
+    """
+    if not rows:
+        return []
+    table = Transaction.__table__
+    result = await session.execute(
+        insert(table).returning(table.c.id, table.c.created_at, sort_by_parameter_order=True),
+        rows,
+    )
+    return [tuple(row) for row in result.all()]
+
+async def get_transactions(session, *, user_id=None, ip_id=None, since=None, limit=100, include_cancelled=False, before=None):
+    """
+    Транзакции от новых к старым (created_at desc, id desc).
+    before=(created_at, id) — keyset-курсор: вернуть только строки строго старше
+    указанной. Глубокие страницы стоят столько же, сколько первая, без OFFSET.
+    """
     query = (
         select(Transaction)
         .options(selectinload(Transaction.user), selectinload(Transaction.ip))
-        .order_by(Transaction.created_at.desc())
+        .order_by(Transaction.created_at.desc(), Transaction.id.desc())
     )
     conditions = []
     if user_id is not None:
@@ -109,6 +170,8 @@ async def get_transactions(session, *, user_id=None, ip_id=None, since=None, lim
         conditions.append(Transaction.ip_id == ip_id)
     if since is not None:
         conditions.append(Transaction.created_at >= since)
+    if before is not None:
+        conditions.append(tuple_(Transaction.created_at, Transaction.id) < tuple_(*before))
     if not include_cancelled:
         conditions.append(Transaction.is_cancelled.is_(False))
     if conditions:
@@ -118,6 +181,497 @@ async def get_transactions(session, *, user_id=None, ip_id=None, since=None, lim
     return list(result.scalars().all())
 
 
+# ── Дневные агрегаты ──────────────────────────────────────────────────────────
+
+async def add_to_daily_aggregates(session, rows):
+    """
+    Прибавляет к дневным агрегатам одним INSERT ... ON CONFLICT DO UPDATE.
+    rows — словари day/ip_id/user_id/type/destination/amount/count;
+    amount и count могут быть отрицательными (отмена, редактирование).
+    """
+    merged: dict[tuple, list[int]] = {}
+    for r in rows:
+        key = (r["day"], r["ip_id"] or 0, r["user_id"], r["type"], r["destination"] or "")
+        acc = merged.setdefault(key, [0, 0])
+        acc[0] += r["amount"]
+        acc[1] += r["count"]
+    if not merged:
+        return
+    stmt = pg_insert(TransactionDailyAggregate).values([
+        {
+            "day": day, "ip_id": ip_id, "user_id": user_id, "type": tx_type,
+            "destination": destination, "amount_sum": amount, "tx_count": count,
+        }
+        for (day, ip_id, user_id, tx_type, destination), (amount, count) in merged.items()
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["day", "ip_id", "user_id", "type", "destination"],
+        set_={
+            "amount_sum": TransactionDailyAggregate.amount_sum + stmt.excluded.amount_sum,
+            "tx_count": TransactionDailyAggregate.tx_count + stmt.excluded.tx_count,
+        },
+    )
+    await session.execute(stmt)
+
+def _totals(rows):
+    return {tx_type: (int(total), int(count)) for tx_type, total, count in rows if count}
+
+async def get_daily_totals_by_type(session, *, day_from=None, day_to=None, ip_id=None, user_id=None):
+    """
+    Суммы и количество операций по типам из дневных агрегатов
+    (day_from <= day < day_to). Возвращает {type: (sum, count)}.
+    """
+    agg = TransactionDailyAggregate
+    query = select(agg.type, func.sum(agg.amount_sum), func.sum(agg.tx_count)).group_by(agg.type)
+    if day_from is not None:
+        query = query.where(agg.day >= day_from)
+    if day_to is not None:
+        query = query.where(agg.day < day_to)
+    if ip_id is not None:
+        query = query.where(agg.ip_id == ip_id)
+    if user_id is not None:
+        query = query.where(agg.user_id == user_id)
+    result = await session.execute(query)
+    return _totals(result.all())
+
+async def get_totals_by_type(session, *, since=None, until=None, ip_id=None, user_id=None, include_cancelled=False):
+    """
+    SELECT type, SUM(amount), COUNT(*) ... GROUP BY type прямо по transactions
+    (since <= created_at < until). Возвращает {type: (sum, count)} —
+    память не зависит от длины истории, ORM-объекты не создаются.
+    """
+    query = (
+        select(Transaction.type, func.sum(Transaction.amount), func.count())
+        .group_by(Transaction.type)
+    )
+    if not include_cancelled:
+        query = query.where(Transaction.is_cancelled.is_(False))
+    if since is not None:
+        query = query.where(Transaction.created_at >= since)
+    if until is not None:
+        query = query.where(Transaction.created_at < until)
+    if ip_id is not None:
+        query = query.where(Transaction.ip_id == ip_id)
+    if user_id is not None:
+        query = query.where(Transaction.user_id == user_id)
+    result = await session.execute(query)
+    return _totals(result.all())
+
+
+def _ip_transactions_filter(ip_id, *, since=None, until=None, after=None, upto=None):
+    """
+    Условия на неотменённые транзакции ИП: его собственные и займы / погашения,
+    где он заёмщик (по связи с долгом, transactions.debt_id).
+    since/until — границы по времени [since, until);
+    after/upto — границы по позиции (created_at, id): (after, upto].
+    """
+    position = tuple_(Transaction.created_at, Transaction.id)
+    borrowed = select(IpDebt.id).where(IpDebt.debtor_ip_id == ip_id)
+    conditions = [
+        or_(Transaction.ip_id == ip_id, Transaction.debt_id.in_(borrowed)),
+        Transaction.is_cancelled.is_(False),
+    ]
+    if since is not None:
+        conditions.append(Transaction.created_at >= since)
+    if until is not None:
+        conditions.append(Transaction.created_at < until)
+    if after is not None:
+        conditions.append(position > tuple_(*after))
+    if upto is not None:
+        conditions.append(position <= tuple_(*upto))
+    return conditions
+
+async def stream_ip_transactions(session, ip_id, **bounds):
+    """
+    Транзакции ИП от старых к новым через серверный курсор (yield_per):
+    в памяти держится только текущая порция, сколько бы строк ни было.
+    Границы — как в _ip_transactions_filter.
+    """
+    result = await session.stream_scalars(
+        select(Transaction)
+        .options(joinedload(Transaction.user))
+        .where(*_ip_transactions_filter(ip_id, **bounds))
+        .order_by(Transaction.created_at.asc(), Transaction.id.asc())
+        .execution_options(yield_per=500)
+    )
+    async for tx in result:
+        yield tx
+
+async def get_ip_amounts_by_kind(session, ip_id, **bounds):
+    """
+    Суммы транзакций ИП в разрезе (type, destination, сторона) —
+    [(type, destination, counterparty, sum)]; counterparty — ИП в операции заёмщик.
+    """
+    counterparty = (Transaction.ip_id != ip_id).label("counterparty")
+    result = await session.execute(
+        select(Transaction.type, Transaction.destination, counterparty, func.sum(Transaction.amount))
+        .where(*_ip_transactions_filter(ip_id, **bounds))
+        .group_by(Transaction.type, Transaction.destination, counterparty)
+    )
+    return [
+        (tx_type, destination, bool(is_counterparty), int(total))
+        for tx_type, destination, is_counterparty, total in result.all()
+    ]
+
+async def get_latest_ip_transaction_id(session, ip_id):
+    """id последней неотменённой транзакции ИП (0, если операций нет)."""
+    result = await session.execute(
+        select(func.max(Transaction.id)).where(*_ip_transactions_filter(ip_id))
+    )
+    return result.scalar_one() or 0
+
+
+# ── Проводки ──────────────────────────────────────────────────────────────────
+
+async def create_ledger_entries(session, rows):
+    """Вставка проводок одним INSERT (словари tx_id/ip_id/bucket/delta[/kind])."""
+    if rows:
+        await session.execute(insert(LedgerEntry.__table__), rows)
+
+async def get_ledger_entries(session, tx_id):
+    """Все проводки операции (включая сторно) — [(ip_id, bucket, delta)] в порядке записи."""
+    result = await session.execute(
+        select(LedgerEntry.ip_id, LedgerEntry.bucket, LedgerEntry.delta)
+        .where(LedgerEntry.tx_id == tx_id)
+        .order_by(LedgerEntry.id)
+    )
+    return [tuple(row) for row in result.all()]
+
+async def get_ledger_balances(session, ip_ids=None, *, until=None):
+    """
+    Суммы проводок по ИП и корзинам: {ip_id: {bucket: sum}}.
+    until — только проводки строго раньше этого момента (балансы на момент).
+    """
+    query = (
+        select(LedgerEntry.ip_id, LedgerEntry.bucket, func.sum(LedgerEntry.delta))
+        .group_by(LedgerEntry.ip_id, LedgerEntry.bucket)
+    )
+    if ip_ids is not None:
+        query = query.where(LedgerEntry.ip_id.in_(ip_ids))
+    if until is not None:
+        query = query.where(LedgerEntry.created_at < until)
+    balances: dict[int, dict[str, int]] = {}
+    for ip_id, bucket, total in (await session.execute(query)).all():
+        balances.setdefault(ip_id, {})[bucket] = int(total)
+    return balances
+
+async def get_ledger_start(session):
+    """
+    Момент, с которого проводки полные: последняя проводка переноса истории
+    (заполнение ledger_entries по операциям до его появления). None — история
+    переносом не заполнялась, проводки полные с начала.
+    """
+    result = await session.execute(
+        select(func.max(LedgerEntry.created_at)).where(LedgerEntry.kind == LedgerKind.BACKFILL)
+    )
+    return result.scalar_one()
+
+def _ledger_bucket_sum(bucket, *conditions):
+    return func.coalesce(func.sum(case((and_(LedgerEntry.bucket == bucket, *conditions), LedgerEntry.delta), else_=0)), 0)
+
+async def get_ip_balances_at(session, at):
+    """
+    Балансы всех ИП на момент at (проводки строго раньше at) одним запросом:
+    текущие балансы минус проводки с created_at >= at. Читается только хвост
+    ledger_entries после at (индекс по created_at), а не вся история.
+    ИП, заведённые не раньше at, не возвращаются. Момент раньше
+    get_ledger_start проверяет вызывающий: там проводки неполные.
+    Строки с полями id, name, bank_balance, debit_balance, cash_balance, initial_capital.
+    """
+    later = (
+        select(
+            LedgerEntry.ip_id,
+            _ledger_bucket_sum("bank").label("bank"),
+            _ledger_bucket_sum("debit").label("debit"),
+            _ledger_bucket_sum("cash").label("cash"),
+        )
+        .where(LedgerEntry.created_at >= at)
+        .group_by(LedgerEntry.ip_id)
+        .subquery()
+    )
+    result = await session.execute(
+        select(
+            IP.id,
+            IP.name,
+            (IP.bank_balance - func.coalesce(later.c.bank, 0)).label("bank_balance"),
+            (IP.debit_balance - func.coalesce(later.c.debit, 0)).label("debit_balance"),
+            (IP.cash_balance - func.coalesce(later.c.cash, 0)).label("cash_balance"),
+            IP.initial_capital,
+        )
+        .outerjoin(later, later.c.ip_id == IP.id)
+        .where(IP.created_at < at)
+        .order_by(IP.name)
+    )
+    return result.all()
+
+
+# ── Сверка балансов ───────────────────────────────────────────────────────────
+
+async def get_last_reconciliation(session, *, incremental=False):
+    """Последний прогон; incremental=True — последний досчёт (его отметка — начало следующего)."""
+    query = select(ReconciliationRun).order_by(ReconciliationRun.id.desc()).limit(1)
+    if incremental:
+        query = query.where(ReconciliationRun.is_full.is_(False))
+    result = await session.execute(query)
+    return result.scalar_one_or_none()
+
+async def lock_ledger(session):
+    """
+    Ждёт завершения транзакций, которые пишут проводки, и не пускает новые
+    до конца транзакции сверки: иначе проводка с меньшим id, закоммиченная
+    позже, оказалась бы ниже отметки и не попала бы в итоги.
+    """
+    await session.execute(text("LOCK TABLE ledger_entries IN SHARE MODE"))
+
+async def get_ledger_sums_after(session, after_id):
+    """
+    Суммы проводок с id > after_id по (ИП, корзина) одним GROUP BY.
+    Возвращает ([(ip_id, bucket, sum)], число проводок, последний id).
+    """
+    result = await session.execute(
+        select(LedgerEntry.ip_id, LedgerEntry.bucket, func.sum(LedgerEntry.delta), func.count(), func.max(LedgerEntry.id))
+        .where(LedgerEntry.id > after_id)
+        .group_by(LedgerEntry.ip_id, LedgerEntry.bucket)
+    )
+    sums, count, last_id = [], 0, after_id
+    for ip_id, bucket, total, n, max_id in result.all():
+        sums.append((ip_id, bucket, int(total)))
+        count += n
+        last_id = max(last_id, max_id)
+    return sums, count, last_id
+
+async def get_unlinked_entries_after(session, after_id):
+    """
+    Проводки без операции с id > after_id, кроме начальных остатков ИП
+    и переноса истории: ручные корректировки балансов.
+    [(LedgerEntry, имя ИП)] по порядку id.
+    """
+    result = await session.execute(
+        select(LedgerEntry, IP.name)
+        .join(IP, IP.id == LedgerEntry.ip_id)
+        .where(
+            LedgerEntry.id > after_id,
+            LedgerEntry.tx_id.is_(None),
+            func.coalesce(LedgerEntry.kind, "").notin_((LedgerKind.OPENING, LedgerKind.BACKFILL)),
+        )
+        .order_by(LedgerEntry.id)
+    )
+    return [tuple(row) for row in result.all()]
+
+def _tx_bucket_delta(side, bucket):
+    """
+    Изменение корзины bucket стороной side операции (TX_POSTINGS) — выражение
+    по строке transactions, для пересчёта балансов по операциям без проводок.
+    """
+    destination = case(
+        (Transaction.destination.in_([b for b in BUCKETS if b != "cash"]), Transaction.destination),
+        else_="cash",
+    )
+    whens = []
+    for tx_type, rules in TX_POSTINGS.items():
+        for rule_side, rule_bucket, sign in rules:
+            if rule_side != side:
+                continue
+            if rule_bucket == "dest":
+                whens.append((and_(Transaction.type == tx_type, destination == bucket), sign * Transaction.amount))
+            elif rule_bucket == bucket:
+                whens.append((Transaction.type == tx_type, sign * Transaction.amount))
+    return func.coalesce(func.sum(case(*whens, else_=0)), 0) if whens else literal(0)
+
+async def compare_ips_with_ledger(session):
+    """
+    Балансы всех ИП рядом с тем, что о них говорят проводки и операции, —
+    одним запросом, то есть по одному снимку данных: балансы, проводки и
+    операции пишутся в одних транзакциях, поэтому сверка согласована без
+    блокировки ledger_entries. Строки с полями:
+    id, name, initial_capital, {bucket}_balance — ИП;
+    {bucket} — сумма всех проводок, entries — их число;
+    {bucket}_ops — пересчёт по неотменённым операциям (TX_POSTINGS; заёмщик —
+    по долгу операции), без проводок операций;
+    {bucket}_opening — начальные остатки, {bucket}_manual — прочие проводки
+    без операции (корректировки), {bucket}_residual — остаток переноса истории.
+    """
+    unlinked = LedgerEntry.tx_id.is_(None)
+    kind = func.coalesce(LedgerEntry.kind, "")
+    entries = (
+        select(
+            LedgerEntry.ip_id,
+            func.count().label("entries"),
+            *(_ledger_bucket_sum(b).label(b) for b in BUCKETS),
+            *(_ledger_bucket_sum(b, unlinked, kind == LedgerKind.OPENING).label(f"{b}_opening") for b in BUCKETS),
+            *(_ledger_bucket_sum(b, unlinked, kind == LedgerKind.BACKFILL).label(f"{b}_residual") for b in BUCKETS),
+            *(
+                _ledger_bucket_sum(b, unlinked, kind.notin_((LedgerKind.OPENING, LedgerKind.BACKFILL))).label(f"{b}_manual")
+                for b in BUCKETS
+            ),
+        )
+        .group_by(LedgerEntry.ip_id)
+        .subquery()
+    )
+    active = Transaction.is_cancelled.is_(False)
+    own = (
+        select(Transaction.ip_id.label("ip_id"), *(_tx_bucket_delta("ip", b).label(b) for b in BUCKETS))
+        .where(active, Transaction.ip_id.is_not(None))
+        .group_by(Transaction.ip_id)
+        .subquery()
+    )
+    counterparty = (
+        select(IpDebt.debtor_ip_id.label("ip_id"), *(_tx_bucket_delta("counterparty", b).label(b) for b in BUCKETS))
+        .join(IpDebt, IpDebt.id == Transaction.debt_id)
+        .where(active)
+        .group_by(IpDebt.debtor_ip_id)
+        .subquery()
+    )
+
+    def column(sub, name):
+        return func.coalesce(getattr(sub.c, name), 0)
+
+    result = await session.execute(
+        select(
+            IP.id,
+            IP.name,
+            IP.initial_capital,
+            *(getattr(IP, f"{b}_balance") for b in BUCKETS),
+            column(entries, "entries").label("entries"),
+            *(column(entries, b).label(b) for b in BUCKETS),
+            *(column(entries, f"{b}_{part}").label(f"{b}_{part}") for part in ("opening", "manual", "residual") for b in BUCKETS),
+            *((column(own, b) + column(counterparty, b)).label(f"{b}_ops") for b in BUCKETS),
+        )
+        .outerjoin(entries, entries.c.ip_id == IP.id)
+        .outerjoin(own, own.c.ip_id == IP.id)
+        .outerjoin(counterparty, counterparty.c.ip_id == IP.id)
+        .order_by(IP.id)
+    )
+    return result.all()
+
+async def add_to_ledger_totals(session, sums):
+    """Прибавляет [(ip_id, bucket, sum)] к ledger_totals одним INSERT ... ON CONFLICT."""
+    if not sums:
+        return
+    stmt = pg_insert(LedgerTotal).values([
+        {"ip_id": ip_id, "bucket": bucket, "amount": total} for ip_id, bucket, total in sums
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["ip_id", "bucket"],
+        set_={"amount": LedgerTotal.amount + stmt.excluded.amount},
+    )
+    await session.execute(stmt)
+
+async def get_ledger_totals(session):
+    """{ip_id: {bucket: amount}} из ledger_totals."""
+    totals: dict[int, dict[str, int]] = {}
+    for total in (await session.execute(select(LedgerTotal))).scalars().all():
+        totals.setdefault(total.ip_id, {})[total.bucket] = total.amount
+    return totals
+
+async def clear_ledger_totals(session):
+    await session.execute(delete(LedgerTotal))
+
+async def create_reconciliation_run(session, last_entry_id, entries_count, mismatch_count, report, full=False):
+    run = ReconciliationRun(
+        is_full=full,
+        last_entry_id=last_entry_id,
+        entries_count=entries_count,
+        mismatch_count=mismatch_count,
+        report=report,
+    )
+    session.add(run)
+    await session.flush()
+    return run
+
+
+# ── Контрольные точки балансов ────────────────────────────────────────────────
+
+async def create_checkpoint(session, ip, *, tx_id=None):
+    """
+    Записывает текущие балансы ИП как контрольную точку на момент
+    clock_timestamp() — строка ИП должна быть уже заблокирована (или только создана).
+    tx_id=None — последняя транзакция ИП (все существующие операции учтены).
+    """
+    if tx_id is None:
+        tx_id = (
+            select(func.coalesce(func.max(Transaction.id), 0))
+            .where(Transaction.ip_id == ip.id)
+            .scalar_subquery()
+        )
+    await session.execute(insert(IpBalanceCheckpoint).values(
+        ip_id=ip.id,
+        tx_id=tx_id,
+        as_of=func.clock_timestamp(),
+        cash_balance=ip.cash_balance,
+        bank_balance=ip.bank_balance,
+        debit_balance=ip.debit_balance,
+    ))
+
+async def create_day_checkpoint(session, ip_id, tx_id, as_of, balances=None):
+    """
+    Контрольная точка после транзакции tx_id, если за этот день у ИП её ещё нет.
+    Один INSERT ... SELECT: балансы берутся из ips (уже с учётом операции)
+    или из balances = (cash, bank, debit) — остатков сразу после tx_id,
+    если в ips уже записаны и более поздние операции (пачка).
+    """
+    columns = (
+        [IP.cash_balance, IP.bank_balance, IP.debit_balance]
+        if balances is None else [literal(b) for b in balances]
+    )
+    day_start = datetime.combine(as_of.date(), time.min)
+    has_today = (
+        select(IpBalanceCheckpoint.id)
+        .where(IpBalanceCheckpoint.ip_id == ip_id, IpBalanceCheckpoint.as_of >= day_start)
+        .exists()
+    )
+    await session.execute(
+        insert(IpBalanceCheckpoint).from_select(
+            ["ip_id", "tx_id", "as_of", "cash_balance", "bank_balance", "debit_balance"],
+            select(
+                literal(ip_id), literal(tx_id), literal(as_of), *columns,
+            ).where(IP.id == ip_id, ~has_today),
+        )
+    )
+
+async def shift_checkpoints(session, ip_id, since_key, delta):
+    """
+    Сдвигает на delta=(cash, bank, debit) все точки ИП с позицией >= since_key —
+    исправление после отмены/редактирования операции в прошлом.
+    """
+    dc, db, dd = delta
+    if not (dc or db or dd):
+        return
+    cp = IpBalanceCheckpoint
+    await session.execute(
+        update(cp)
+        .where(cp.ip_id == ip_id, tuple_(cp.as_of, cp.tx_id) >= tuple_(*since_key))
+        .values(
+            cash_balance=cp.cash_balance + dc,
+            bank_balance=cp.bank_balance + db,
+            debit_balance=cp.debit_balance + dd,
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+async def get_checkpoint_before(session, ip_id, moment):
+    """Последняя точка ИП строго раньше moment."""
+    cp = IpBalanceCheckpoint
+    result = await session.execute(
+        select(cp)
+        .where(cp.ip_id == ip_id, cp.as_of < moment)
+        .order_by(cp.as_of.desc(), cp.tx_id.desc())
+        .limit(1)
+    )
+    return result.scalar_one_or_none()
+
+async def get_checkpoint_after(session, ip_id, moment):
+    """Первая точка ИП не раньше moment."""
+    cp = IpBalanceCheckpoint
+    result = await session.execute(
+        select(cp)
+        .where(cp.ip_id == ip_id, cp.as_of >= moment)
+        .order_by(cp.as_of.asc(), cp.tx_id.asc())
+        .limit(1)
+    )
+    return result.scalar_one_or_none()
+
+
 async def get_transaction(session, tx_id: int):
     result = await session.execute(
         select(Transaction)
@@ -132,6 +686,17 @@ async def create_ip_debt(session, creditor_ip_id, debtor_ip_id, amount):
     await session.flush()
     return debt
 
+async def create_ip_debts_bulk(session, rows):
+    """
+    Массовая вставка долгов между ИП (словари creditor_ip_id/debtor_ip_id/amount).
+    Возвращает id долгов в порядке rows.
+    """
+    if not rows:
+        return []
+    table = IpDebt.__table__
+    result = await session.execute(insert(table).returning(table.c.id, sort_by_parameter_order=True), rows)
+    return list(result.scalars().all())
+
 async def get_active_ip_debts(session):
     result = await session.execute(
         select(IpDebt)
@@ -141,12 +706,15 @@ async def get_active_ip_debts(session):
     )
     return list(result.scalars().all())
 
-async def get_ip_debt_by_id(session, debt_id):
-    result = await session.execute(
+async def get_ip_debt_by_id(session, debt_id, *, for_update=False):
+    query = (
         select(IpDebt)
         .options(selectinload(IpDebt.creditor_ip), selectinload(IpDebt.debtor_ip))
         .where(IpDebt.id == debt_id)
     )
+    if for_update:
+        query = query.with_for_update(of=IpDebt)
+    result = await session.execute(query)
     return result.scalar_one_or_none()
 
 async def repay_ip_debt(session, debt_id, amount):
@@ -190,6 +758,26 @@ async def get_writeoffs_for_expense(session, expense_id: int) -> list[Transactio
     return list(result.scalars().all())
 
 
+async def get_writeoffs_for_expenses(session, expense_ids) -> dict[int, list[Transaction]]:
+    """
+    Списания сразу для нескольких расходов одним запросом (JOIN на ИП для имён).
+    Возвращает {expense_id: [Transaction]}; у расходов без списаний — пустой список.
+    """
+    writeoffs: dict[int, list[Transaction]] = {expense_id: [] for expense_id in expense_ids}
+    if not writeoffs:
+        return writeoffs
+    result = await session.execute(
+        select(Transaction)
+        .outerjoin(Transaction.ip)
+        .options(contains_eager(Transaction.ip))
+        .where(Transaction.expense_id.in_(writeoffs), Transaction.is_cancelled.is_(False))
+        .order_by(Transaction.created_at.asc(), Transaction.id.asc())
+    )
+    for tx in result.scalars().all():
+        writeoffs[tx.expense_id].append(tx)
+    return writeoffs
+
+
 async def delete_expense(session, expense_id: int) -> None:
     expense = await get_expense(session, expense_id)
     if expense is None:
@@ -197,12 +785,207 @@ async def delete_expense(session, expense_id: int) -> None:
     await session.delete(expense)
 
 
+# ── Исходящие сообщения ───────────────────────────────────────────────────────
+
+async def enqueue_message(session, chat_id, body, parse_mode="HTML"):
+    """Ставит сообщение в очередь; отправит его процесс бота (bot/outbox.py)."""
+    message = OutboundMessage(chat_id=chat_id, body=body, parse_mode=parse_mode)
+    session.add(message)
+    await session.flush()
+    return message
+
+
+async def enqueue_messages(session, chat_ids, body, parse_mode="HTML"):
+    """Одно и то же сообщение нескольким получателям (одна пачка INSERT)."""
+    messages = [OutboundMessage(chat_id=chat_id, body=body, parse_mode=parse_mode) for chat_id in chat_ids]
+    session.add_all(messages)
+    await session.flush()
+    return messages
+
+
+async def claim_outbound_messages(session, limit=50, max_attempts=5, lease_seconds=300):
+    """
+    Забирает до limit сообщений к отправке: ставит им аренду
+    (next_attempt_at = сейчас + lease_seconds). Вызывающий сразу коммитит
+    и отправляет вне транзакции; если процесс упадёт, после конца аренды
+    сообщение будет взято снова.
+    Сообщение не берётся, пока в его чате ждёт (аренда или пауза после ошибки)
+    более раннее неотправленное — так сообщения одному чату уходят по порядку.
+    SKIP LOCKED — чтобы несколько отправителей не взяли одно и то же.
+    """
+    now = datetime.utcnow()
+    earlier = aliased(OutboundMessage)
+    waiting_earlier = (
+        select(earlier.id)
+        .where(
+            earlier.chat_id == OutboundMessage.chat_id,
+            earlier.id < OutboundMessage.id,
+            earlier.sent_at.is_(None),
+            earlier.attempts < max_attempts,
+            earlier.next_attempt_at > now,
+        )
+        .exists()
+    )
+    result = await session.execute(
+        select(OutboundMessage)
+        .where(
+            OutboundMessage.sent_at.is_(None),
+            OutboundMessage.attempts < max_attempts,
+            or_(OutboundMessage.next_attempt_at.is_(None), OutboundMessage.next_attempt_at <= now),
+            ~waiting_earlier,
+        )
+        .order_by(OutboundMessage.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    messages = list(result.scalars().all())
+    for message in messages:
+        message.next_attempt_at = now + timedelta(seconds=lease_seconds)
+    await session.flush()
+    return messages
+
+
+async def mark_outbound_sent(session, message_id):
+    await session.execute(
+        update(OutboundMessage)
+        .where(OutboundMessage.id == message_id)
+        .values(sent_at=datetime.utcnow(), next_attempt_at=None)
+    )
+
+
+async def mark_outbound_failed(session, message_id, attempts, error, next_attempt_at=None):
+    await session.execute(
+        update(OutboundMessage)
+        .where(OutboundMessage.id == message_id)
+        .values(attempts=attempts, last_error=error, next_attempt_at=next_attempt_at)
+    )
+
+
+async def release_outbound_messages(session, message_ids):
+    """Снимает аренду с взятых, но не отправленных сообщений."""
+    if message_ids:
+        await session.execute(
+            update(OutboundMessage)
+            .where(OutboundMessage.id.in_(message_ids))
+            .values(next_attempt_at=None)
+        )
+
+
+# ── Фоновые выгрузки ──────────────────────────────────────────────────────────
+
+async def create_export_job(session, **values):
+    job = ExportJob(**values)
+    session.add(job)
+    await session.flush()
+    return job
+
+
+async def get_export_job(session, job_id):
+    return await session.get(ExportJob, job_id)
+
+
+async def claim_export_jobs(session, lease_seconds=600):
+    """
+    Забирает самое старое ждущее задание и все ждущие задания того же файла
+    (тот же ключ выгрузки): ставит им status = running и аренду
+    (locked_until = сейчас + lease_seconds). Вызывающий сразу коммитит и
+    собирает файл вне транзакции; если процесс упадёт, после конца аренды
+    задания возьмёт другой. SKIP LOCKED — чтобы процессы не взяли одно и то же.
+    Пустой список — брать нечего.
+    """
+    now = datetime.utcnow()
+    claimable = (
+        ExportJob.finished_at.is_(None),
+        or_(ExportJob.locked_until.is_(None), ExportJob.locked_until <= now),
+    )
+    result = await session.execute(
+        select(ExportJob)
+        .where(*claimable)
+        .order_by(ExportJob.created_at, ExportJob.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+    )
+    first = result.scalar_one_or_none()
+    if first is None:
+        return []
+    result = await session.execute(
+        select(ExportJob)
+        .where(
+            *claimable,
+            ExportJob.id != first.id,
+            ExportJob.ip_id == first.ip_id,
+            ExportJob.date_from.is_not_distinct_from(first.date_from),
+            ExportJob.date_to.is_not_distinct_from(first.date_to),
+            ExportJob.fmt == first.fmt,
+            ExportJob.last_tx_id == first.last_tx_id,
+        )
+        .with_for_update(skip_locked=True)
+    )
+    jobs = [first, *result.scalars().all()]
+    for job in jobs:
+        job.status = "running"
+        job.locked_until = now + timedelta(seconds=lease_seconds)
+    await session.flush()
+    return jobs
+
+
+async def finish_export_jobs(session, job_ids, *, file_name=None, error=None):
+    await session.execute(
+        update(ExportJob)
+        .where(ExportJob.id.in_(job_ids))
+        .values(
+            status="failed" if error else "done",
+            file_name=file_name,
+            error=error,
+            locked_until=None,
+            finished_at=datetime.utcnow(),
+        )
+    )
+
+
+async def release_export_jobs(session, job_ids, delay_seconds):
+    """Возвращает взятые задания в очередь: их снова можно взять через delay_seconds."""
+    await session.execute(
+        update(ExportJob)
+        .where(ExportJob.id.in_(job_ids))
+        .values(status="queued", locked_until=datetime.utcnow() + timedelta(seconds=delay_seconds))
+    )
+
+
+async def delete_finished_export_jobs(session, before):
+    await session.execute(delete(ExportJob).where(ExportJob.finished_at < before))
+
+
+async def get_export_generation(session, ip_id):
+    result = await session.execute(
+        select(ExportCacheGeneration.generation).where(ExportCacheGeneration.ip_id == ip_id)
+    )
+    return result.scalar_one_or_none() or 0
+
+
+async def bump_export_generations(session, ip_ids):
+    """Поколение кэша выгрузок +1 для каждого ИП (строка создаётся при первом сбросе)."""
+    stmt = pg_insert(ExportCacheGeneration).values([{"ip_id": ip_id, "generation": 1} for ip_id in sorted(ip_ids)])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["ip_id"],
+        set_={"generation": ExportCacheGeneration.generation + 1},
+    )
+    await session.execute(stmt)
+
+
 async def reset_all_data(session: AsyncSession) -> None:
     """Удаляет все ИП, транзакции, долги, расходы. Пользователи остаются."""
-    await session.execute(delete(IpDebt))
+    await session.execute(delete(LedgerEntry))
+    await session.execute(delete(LedgerTotal))
+    await session.execute(delete(IpBalanceCheckpoint))
+    await session.execute(delete(TransactionDailyAggregate))
+    # Транзакции ссылаются на долги (debt_id) — удаляются раньше них
     await session.execute(delete(Transaction))
+    await session.execute(delete(IpDebt))
     await session.execute(delete(Expense))
     await session.execute(delete(IP))
+    await session.execute(delete(ExportJob))
+    await session.execute(delete(ExportCacheGeneration))
     # Обнуляем cash_balance у пользователей
     users = await get_all_users(session)
     for u in users:
@@ -0,0 +1,114 @@
+"""
+Проверка, что горячие запросы используют свои индексы.
+
+Запуск: python -m backend.database.explain
+
+Для каждого запроса выполняется EXPLAIN (FORMAT JSON) и в плане ищется
+ожидаемый индекс. Последовательное сканирование отключается на время проверки
+(SET LOCAL enable_seqscan = off): на маленькой базе планировщик честно выберет
+Seq Scan, а нам важно, что индекс вообще применим к запросу.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from backend.database.models import IpDebt, Transaction
+
+logger = logging.getLogger(__name__)
+
+
+def _hot_queries() -> list[tuple[str, str, object]]:
+    """(название, ожидаемый индекс, запрос) — повторяют фильтры из crud."""
+    since = datetime.utcnow() - timedelta(days=30)
+    active = Transaction.is_cancelled.is_(False)
+    return [
+        (
+            "История ИП (get_transactions ip_id=…)",
+            "ix_transactions_ip_created",
+            select(Transaction)
+            .where(Transaction.ip_id == 1, active)
+            .order_by(Transaction.created_at.desc())
+            .limit(100),
+        ),
+        (
+            "Операции пользователя за период (get_personal_report)",
+            "ix_transactions_user_created",
+            select(Transaction)
+            .where(Transaction.user_id == 1, Transaction.created_at >= since, active)
+            .order_by(Transaction.created_at.desc())
+            .limit(100),
+        ),
+        (
+            "Все операции за период (/api/report, /api/analytics)",
+            "ix_transactions_active_created",
+            select(Transaction)
+            .where(Transaction.created_at >= since, active)
+            .order_by(Transaction.created_at.desc())
+            .limit(100),
+        ),
+        (
+            "Списания по расходу (get_writeoffs_for_expense)",
+            "ix_transactions_expense_id",
+            select(Transaction)
+            .where(Transaction.expense_id == 1, active)
+            .order_by(Transaction.created_at.asc()),
+        ),
+        (
+            "Активные долги (get_active_ip_debts)",
+            "ix_ip_debts_unpaid_created",
+            select(IpDebt)
+            .where(IpDebt.is_paid.is_(False))
+            .order_by(IpDebt.created_at.desc()),
+        ),
+    ]
+
+
+def _index_names(plan: dict) -> set[str]:
+    """Рекурсивно собирает все "Index Name" из JSON-плана."""
+    names = set()
+    if "Index Name" in plan:
+        names.add(plan["Index Name"])
+    for child in plan.get("Plans", []):
+        names |= _index_names(child)
+    return names
+
+
+async def check_index_usage(session: AsyncSession) -> list[tuple[str, str, bool]]:
+    """Возвращает [(название запроса, ожидаемый индекс, используется ли он)]."""
+    dialect = postgresql.dialect()
+    results = []
+    async with session.begin():
+        await session.execute(text("SET LOCAL enable_seqscan = off"))
+        for title, index_name, query in _hot_queries():
+            sql = str(query.compile(dialect=dialect, compile_kwargs={"literal_binds": True}))
+            raw = (await session.execute(text(f"EXPLAIN (FORMAT JSON) {sql}"))).scalar_one()
+            plan = (json.loads(raw) if isinstance(raw, str) else raw)[0]["Plan"]
+            results.append((title, index_name, index_name in _index_names(plan)))
+    return results
+
+
+async def main() -> int:
+    from backend.database.session import async_session_factory, init_db
+
+    await init_db()
+    async with async_session_factory() as session:
+        results = await check_index_usage(session)
+
+    failed = 0
+    for title, index_name, used in results:
+        mark = "OK " if used else "НЕТ"
+        print(f"[{mark}] {title}: {index_name}")
+        failed += not used
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(asyncio.run(main()))
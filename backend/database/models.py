@@ -5,17 +5,20 @@ SQLAlchemy ORM-модели для базы данных бота-бухгалт
 
 from __future__ import annotations
 
-from datetime import datetime
+from datetime import date, datetime
 
 from sqlalchemy import (
     BigInteger,
     Boolean,
+    Date,
     DateTime,
     ForeignKey,
+    Index,
     Integer,
     String,
     Text,
     func,
+    text,
 )
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
@@ -36,6 +39,13 @@ class TxType:
     EXPENSE_WRITEOFF = "expense_writeoff" # Расход (списание с ИП)
 
 
+# Происхождение проводок (ledger_entries.kind); у проводок новых операций — NULL
+class LedgerKind:
+    OPENING    = "opening"     # Начальный остаток ИП
+    ADJUSTMENT = "adjustment"  # Ручная корректировка балансов администратором
+    BACKFILL   = "backfill"    # Перенос истории, накопленной до появления проводок
+
+
 # Группы типов для отчётов
 INCOME_TYPES: frozenset[str] = frozenset({
     TxType.PRIHOD_MES,
@@ -47,6 +57,28 @@ EXPENSE_TYPES: frozenset[str] = frozenset({
     TxType.STORONNIE,
 })
 
+# Проводки операций — единственное место, где описан эффект операции на балансы.
+# Тип → [(сторона, корзина, знак)], изменение корзины = знак × сумма:
+#   сторона "ip" — ИП операции (transactions.ip_id),
+#           "counterparty" — второе ИП (заёмщик у «Одолжить» и «Погашение»);
+#   корзина cash / bank / debit или "dest" — назначение (источник) операции
+#           из transactions.destination, по умолчанию cash.
+# Пишутся в ledger_entries через services/ledger.
+TX_POSTINGS: dict[str, tuple[tuple[str, str, int], ...]] = {
+    TxType.ZAKUP:            (("ip", "cash", -1),),
+    TxType.STORONNIE:        (("ip", "cash", -1),),
+    TxType.PRIHOD_MES:       (("ip", "dest", 1),),
+    TxType.PRIHOD_FAST:      (("ip", "dest", 1),),
+    TxType.PRIHOD_STO:       (("ip", "dest", 1),),
+    TxType.SNYAT_RS:         (("ip", "bank", -1), ("ip", "debit", 1)),
+    TxType.SNYAT_DEBIT:      (("ip", "debit", -1), ("ip", "cash", 1)),
+    TxType.VNESTI_RS:        (("ip", "cash", -1), ("ip", "bank", 1)),
+    TxType.ODOLZHIT:         (("ip", "cash", -1), ("counterparty", "cash", 1)),
+    TxType.POGASIT:          (("counterparty", "cash", -1), ("ip", "cash", 1)),
+    TxType.EXPENSE_WRITEOFF: (("ip", "dest", -1),),
+}
+BUCKETS: tuple[str, ...] = ("cash", "bank", "debit")
+
 # Человекочитаемые названия операций
 TX_LABELS: dict[str, str] = {
     TxType.ZAKUP:            "🛒 Закуп",
@@ -78,6 +110,7 @@ class User(Base):
     username: Mapped[str | None] = mapped_column(String(255), nullable=True)
     role: Mapped[str] = mapped_column(String(20), default="junior")  # admin / user / junior
     cash_balance: Mapped[int] = mapped_column(Integer, default=0)  # личные наличные (для долгов)
+    digest_enabled: Mapped[bool] = mapped_column(Boolean, default=False)  # ежедневная сводка в личку
     created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
 
     transactions: Mapped[list["Transaction"]] = relationship(back_populates="user")
@@ -107,6 +140,30 @@ class IP(Base):
 
 class Transaction(Base):
     __tablename__ = "transactions"
+    __table_args__ = (
+        # Лента и выгрузка по ИП / пользователю, отсортированные по дате
+        Index("ix_transactions_ip_created", "ip_id", "created_at"),
+        Index("ix_transactions_user_created", "user_id", "created_at"),
+        # Отчёты и аналитика по всем ИП: только неотменённые операции.
+        # Предикат совпадает с тем, что генерирует crud (is_cancelled IS false)
+        Index(
+            "ix_transactions_active_created",
+            "created_at",
+            postgresql_where=text("is_cancelled IS false"),
+        ),
+        # Списания по расходу
+        Index(
+            "ix_transactions_expense_id",
+            "expense_id",
+            postgresql_where=text("expense_id IS NOT NULL"),
+        ),
+        # Займы и погашения по долгу — в выписке заёмщика
+        Index(
+            "ix_transactions_debt_id",
+            "debt_id",
+            postgresql_where=text("debt_id IS NOT NULL"),
+        ),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     user_id: Mapped[int] = mapped_column(BigInteger, ForeignKey("users.id"))
@@ -118,15 +175,149 @@ class Transaction(Base):
     comment: Mapped[str | None] = mapped_column(Text, nullable=True)
     destination: Mapped[str | None] = mapped_column(String(20), nullable=True)  # cash / bank / debit (для приходов)
     expense_id: Mapped[int | None] = mapped_column(Integer, ForeignKey("expenses.id"), nullable=True)
+    # Долг операции: для «Одолжить» — выданный, для «Погасить» — погашаемый
+    debt_id: Mapped[int | None] = mapped_column(Integer, ForeignKey("ip_debts.id"), nullable=True)
     is_cancelled: Mapped[bool] = mapped_column(Boolean, default=False)
     cancelled_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
     cancelled_by_id: Mapped[int | None] = mapped_column(BigInteger, nullable=True)
-    created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
+    # clock_timestamp(), а не now() (начало транзакции БД): операция вставляется
+    # после блокировки строк ИП, поэтому у одного ИП порядок (created_at, id)
+    # совпадает с порядком, в котором операции меняли баланс
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=func.clock_timestamp(), server_default=func.now())
 
     user: Mapped["User"] = relationship(back_populates="transactions")
     ip: Mapped["IP | None"] = relationship(back_populates="transactions")
 
 
+# ── Дневные агрегаты операций ─────────────────────────────────────────────────
+
+class TransactionDailyAggregate(Base):
+    """
+    Сумма и количество неотменённых операций за день в разрезе
+    (ИП, пользователь, тип, назначение). Обновляется в той же транзакции,
+    что и сама операция (services/transaction), — аналитика и сводки
+    читают сотни строк агрегатов вместо всей истории.
+    """
+    __tablename__ = "transaction_daily_aggregates"
+
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    ip_id: Mapped[int] = mapped_column(Integer, primary_key=True)  # 0 — операция без ИП
+    user_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    type: Mapped[str] = mapped_column(String(30), primary_key=True)
+    destination: Mapped[str] = mapped_column(String(20), primary_key=True)  # "" — не указано
+    amount_sum: Mapped[int] = mapped_column(BigInteger, default=0)
+    tx_count: Mapped[int] = mapped_column(Integer, default=0)
+
+
+# ── Контрольные точки балансов ИП ─────────────────────────────────────────────
+
+class IpBalanceCheckpoint(Base):
+    """
+    Балансы ИП после транзакции tx_id (момент as_of): учтены все неотменённые
+    операции с (created_at, id) <= (as_of, tx_id). Точка пишется в той же
+    транзакции БД, что и операция, пока строка ИП заблокирована, а
+    created_at операций — clock_timestamp() после блокировки, поэтому
+    параллельная операция не может попасть в точку «раньше» своей позиции. Пишется при первой операции
+    ИП за день, при создании ИП и при ручной правке балансов; отмена и
+    редактирование старых операций сдвигают более поздние точки.
+    Выгрузка за период стартует от ближайшей точки, а не от всей истории.
+    """
+    __tablename__ = "ip_balance_checkpoints"
+    __table_args__ = (
+        Index("ix_ip_balance_checkpoints_ip_as_of", "ip_id", "as_of", "tx_id"),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    ip_id: Mapped[int] = mapped_column(Integer, ForeignKey("ips.id"))
+    tx_id: Mapped[int] = mapped_column(Integer, default=0)  # 0 — до первой операции
+    as_of: Mapped[datetime] = mapped_column(DateTime)
+    cash_balance: Mapped[int] = mapped_column(Integer)
+    bank_balance: Mapped[int] = mapped_column(Integer)
+    debit_balance: Mapped[int] = mapped_column(Integer)
+
+    @property
+    def key(self) -> tuple[datetime, int]:
+        """Позиция в истории — для сравнения с (created_at, id) транзакций."""
+        return (self.as_of, self.tx_id)
+
+    @property
+    def balances(self) -> tuple[int, int, int]:
+        return (self.cash_balance, self.bank_balance, self.debit_balance)
+
+
+# ── Проводки ──────────────────────────────────────────────────────────────────
+
+class LedgerEntry(Base):
+    """
+    Проводка: изменение одной корзины (cash / bank / debit) одного ИП.
+    Записи только добавляются: отмена и правка операции — новые проводки
+    с тем же tx_id (сторно). Балансы в ips — кэш сумм проводок по ИП,
+    который ведётся в той же транзакции (services/transaction).
+    tx_id = NULL — начальный остаток ИП, ручная корректировка балансов или
+    перенос остатка истории (kind, см. LedgerKind).
+    """
+    __tablename__ = "ledger_entries"
+    __table_args__ = (
+        # История и суммы по корзине ИП на момент времени
+        Index("ix_ledger_entries_ip_bucket_created", "ip_id", "bucket", "created_at"),
+        # Балансы всех ИП на момент времени: проводки после него (crud.get_ip_balances_at)
+        Index("ix_ledger_entries_created_at", "created_at"),
+        # Момент, с которого история проводок полная (crud.get_ledger_start)
+        Index(
+            "ix_ledger_entries_backfill_created",
+            "created_at",
+            postgresql_where=text("kind = 'backfill'"),
+        ),
+        # Проводки операции (для отмены и правки)
+        Index(
+            "ix_ledger_entries_tx_id",
+            "tx_id",
+            postgresql_where=text("tx_id IS NOT NULL"),
+        ),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    tx_id: Mapped[int | None] = mapped_column(Integer, ForeignKey("transactions.id"), nullable=True)
+    ip_id: Mapped[int] = mapped_column(Integer, ForeignKey("ips.id"))
+    bucket: Mapped[str] = mapped_column(String(10))
+    delta: Mapped[int] = mapped_column(Integer)
+    # LedgerKind; у проводок операций, проведённых после появления ledger_entries, — NULL
+    kind: Mapped[str | None] = mapped_column(String(20), nullable=True)
+    # Как у Transaction: момент записи после блокировки ИП, а не начало транзакции БД
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=func.clock_timestamp(), server_default=func.now())
+
+
+# ── Сверка балансов ───────────────────────────────────────────────────────────
+
+class LedgerTotal(Base):
+    """
+    Суммы проводок по корзинам ИП до отметки последней сверки
+    (reconciliation_runs.last_entry_id). Каждая сверка досчитывает только
+    проводки после отметки и сравнивает итоги с балансами в ips.
+    """
+    __tablename__ = "ledger_totals"
+
+    ip_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    bucket: Mapped[str] = mapped_column(String(10), primary_key=True)
+    amount: Mapped[int] = mapped_column(BigInteger, default=0)
+
+
+class ReconciliationRun(Base):
+    """
+    Прогон сверки: до какой проводки досчитаны итоги и найденные расхождения.
+    is_full — полная сверка по снимку: итоги и отметку она не меняет.
+    """
+    __tablename__ = "reconciliation_runs"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
+    is_full: Mapped[bool] = mapped_column(Boolean, default=False)
+    last_entry_id: Mapped[int] = mapped_column(Integer, default=0)
+    entries_count: Mapped[int] = mapped_column(Integer, default=0)  # проводок обработано в прогоне
+    mismatch_count: Mapped[int] = mapped_column(Integer, default=0)
+    report: Mapped[str | None] = mapped_column(Text, nullable=True)  # расхождения и корректировки, JSON
+
+
 # ── Расходы (журнал расходов) ─────────────────────────────────────────────────
 
 class Expense(Base):
@@ -146,6 +337,14 @@ class Expense(Base):
 
 class IpDebt(Base):
     __tablename__ = "ip_debts"
+    __table_args__ = (
+        # Активные (непогашенные) долги — их единицы, вся история не нужна
+        Index(
+            "ix_ip_debts_unpaid_created",
+            "created_at",
+            postgresql_where=text("is_paid IS false"),
+        ),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     creditor_ip_id: Mapped[int] = mapped_column(Integer, ForeignKey("ips.id"))
@@ -156,3 +355,90 @@ class IpDebt(Base):
 
     creditor_ip: Mapped["IP"] = relationship(foreign_keys=[creditor_ip_id])
     debtor_ip: Mapped["IP"] = relationship(foreign_keys=[debtor_ip_id])
+
+
+# ── Исходящие сообщения Telegram ──────────────────────────────────────────────
+
+class OutboundMessage(Base):
+    """
+    Очередь исходящих сообщений: API кладёт сюда сообщение в своей транзакции,
+    процесс бота забирает и отправляет. Позволяет API работать в нескольких
+    процессах, а боту — оставаться единственным.
+    """
+    __tablename__ = "outbound_messages"
+    __table_args__ = (
+        # Неотправленные — всегда небольшая часть таблицы
+        Index(
+            "ix_outbound_messages_pending",
+            "id",
+            postgresql_where=text("sent_at IS NULL"),
+        ),
+        # Более ранние неотправленные того же чата (порядок в чате при выборке)
+        Index(
+            "ix_outbound_messages_pending_chat",
+            "chat_id",
+            "id",
+            postgresql_where=text("sent_at IS NULL"),
+        ),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    chat_id: Mapped[int] = mapped_column(BigInteger)
+    body: Mapped[str] = mapped_column(Text)
+    parse_mode: Mapped[str | None] = mapped_column(String(20), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
+    sent_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    last_error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    # Не раньше этого момента: аренда взятого отправителем сообщения
+    # или растущая пауза после ошибки отправки
+    next_attempt_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+
+
+# ── Фоновые выгрузки ──────────────────────────────────────────────────────────
+
+class ExportJob(Base):
+    """
+    Задание на выгрузку (services/export_jobs). Хранится в БД, а не в памяти
+    процесса: статус и готовый файл видны любому процессу API (API_WORKERS > 1),
+    а собирает задание тот процесс, который первым его возьмёт.
+    """
+    __tablename__ = "export_jobs"
+    __table_args__ = (
+        # Ждущие и собираемые — небольшая часть таблицы
+        Index(
+            "ix_export_jobs_pending",
+            "created_at",
+            postgresql_where=text("finished_at IS NULL"),
+        ),
+    )
+
+    id: Mapped[str] = mapped_column(String(32), primary_key=True)
+    user_id: Mapped[int] = mapped_column(BigInteger)
+    # Ключ файла (services/export_jobs.ExportKey)
+    ip_id: Mapped[int] = mapped_column(Integer)
+    date_from: Mapped[date | None] = mapped_column(Date, nullable=True)
+    date_to: Mapped[date | None] = mapped_column(Date, nullable=True)
+    fmt: Mapped[str] = mapped_column(String(10))
+    last_tx_id: Mapped[int] = mapped_column(Integer, default=0)
+    filename: Mapped[str] = mapped_column(String(255))  # имя файла для пользователя
+    status: Mapped[str] = mapped_column(String(20), default="queued")  # queued / running / done / failed
+    error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    file_name: Mapped[str | None] = mapped_column(String(255), nullable=True)  # файл в каталоге кэша
+    created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
+    # Не раньше этого момента задание можно взять: аренда собирающего
+    # процесса (если он упадёт, задание возьмёт другой) или пауза перед повтором
+    locked_until: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    finished_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+
+
+class ExportCacheGeneration(Base):
+    """
+    Поколение кэша выгрузок ИП: растёт в транзакции отмены или правки его
+    операций. Файл, собранный при старом поколении, в кэш не кладётся —
+    в каком бы процессе он ни собирался.
+    """
+    __tablename__ = "export_cache_generations"
+
+    ip_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    generation: Mapped[int] = mapped_column(Integer, default=0)
@@ -0,0 +1,99 @@
+"""
+Оповещения между процессами через PostgreSQL LISTEN/NOTIFY.
+
+Кэши в памяти (версия бухгалтерии, пользователи, файлы выгрузок) сбрасываются
+слушателями сессии в том процессе, где прошёл коммит. Когда API работает
+в нескольких процессах (RUN_MODE=api) и бот — в отдельном, остальные
+процессы об этом должны узнать:
+
+- publish_on_commit(session, message) — сообщение уходит через pg_notify
+  в той же транзакции: PostgreSQL доставляет его только после коммита
+  и не доставляет при откате; одинаковые сообщения одной транзакции
+  схлопываются;
+- subscribe(kind, handler) — обработчик сообщений вида "kind" или "kind:arg";
+- listen_forever() — держит отдельное соединение с LISTEN и вызывает обработчики.
+
+В режиме одного процесса (RUN_MODE=single) ничего не публикуется.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Callable
+
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+from backend.config import settings
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "accounting_events"
+_PENDING_KEY = "notify_pending"
+_RECONNECT_DELAY = 5.0
+
+_handlers: dict[str, list[Callable[[str], None]]] = {}
+
+
+def enabled() -> bool:
+    return settings.run_mode != "single"
+
+
+def subscribe(kind: str, handler: Callable[[str], None]) -> None:
+    """handler получает аргумент сообщения ("" для сообщений без аргумента)."""
+    _handlers.setdefault(kind, []).append(handler)
+
+
+def publish_on_commit(session: Session, message: str) -> None:
+    """Запоминает сообщение; отправляется перед коммитом транзакции session."""
+    if enabled():
+        session.info.setdefault(_PENDING_KEY, set()).add(message)
+
+
+@event.listens_for(Session, "before_commit")
+def _before_commit(session) -> None:
+    if not enabled():
+        return
+    # Изменения, которые ещё не сброшены, сбрасываются здесь же —
+    # их слушатели тоже могут добавить сообщения
+    session.flush()
+    messages = session.info.pop(_PENDING_KEY, None)
+    for message in sorted(messages or ()):
+        session.execute(text("SELECT pg_notify(:channel, :message)"), {"channel": CHANNEL, "message": message})
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session) -> None:
+    session.info.pop(_PENDING_KEY, None)
+
+
+def _dispatch(message: str) -> None:
+    kind, _, arg = message.partition(":")
+    for handler in _handlers.get(kind, ()):
+        try:
+            handler(arg)
+        except Exception:
+            logger.exception("Ошибка обработки оповещения %r", message)
+
+
+async def listen_forever() -> None:
+    """Слушает канал; при обрыве соединения переподключается."""
+    from backend.database.session import engine
+
+    while True:
+        try:
+            async with engine.connect() as conn:
+                raw = await conn.get_raw_connection()
+                driver = raw.driver_connection
+                await driver.add_listener(CHANNEL, lambda _c, _pid, _ch, payload: _dispatch(payload))
+                logger.info("Подписка на оповещения %s", CHANNEL)
+                # Пока подписки не было, оповещения могли быть пропущены
+                _dispatch("resync")
+                while not driver.is_closed():
+                    await asyncio.sleep(_RECONNECT_DELAY)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Соединение для оповещений потеряно")
+        await asyncio.sleep(_RECONNECT_DELAY)
@@ -8,7 +8,7 @@ from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 
 from backend.config import settings
-from backend.database.models import Base
+from backend.database.models import BUCKETS, TX_POSTINGS, Base, LedgerKind, TxType
 
 logger = logging.getLogger(__name__)
 
@@ -28,6 +28,54 @@ async_session_factory = async_sessionmaker(
 )
 
 
+def _ensure_indexes(sync_conn) -> None:
+    """
+    CREATE INDEX для каждого индекса из __table_args__ моделей, которого ещё нет.
+    create_all создаёт индексы только вместе с новыми таблицами,
+    поэтому для уже существующих таблиц их нужно добавить отдельно.
+    """
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(sync_conn, checkfirst=True)
+
+
+async def _backfill_ledger(conn) -> None:
+    """
+    Проводки по истории, накопленной до появления ledger_entries.
+    По каждой неотменённой операции — проводки по TX_POSTINGS: ИП операции
+    и, если операция связана с долгом, заёмщика. Вторая сторона несвязанных
+    займов не восстанавливается, поэтому всё, что история не объясняет
+    (начальные остатки и такие займы), переносится одной проводкой остатка
+    на корзину ИП (tx_id = NULL) в момент заполнения: после этого суммы
+    проводок равны балансам в ips. Все проводки заполнения — kind = backfill.
+    Полная сверка сравнивает этот остаток с начальным капиталом ИП.
+    Раньше этого момента история неполная (нет второй стороны части займов,
+    отменённых операций и ручных правок), и балансы на момент по ней не
+    считаются (crud.get_ledger_start).
+    """
+    for tx_type, rules in TX_POSTINGS.items():
+        for side, bucket, sign in rules:
+            bucket_sql = (
+                "CASE WHEN t.destination IN ('bank', 'debit') THEN t.destination ELSE 'cash' END"
+                if bucket == "dest" else f"'{bucket}'"
+            )
+            ip_sql, join_sql = (
+                ("t.ip_id", "") if side == "ip" else ("d.debtor_ip_id", "JOIN ip_debts d ON d.id = t.debt_id ")
+            )
+            await conn.execute(text(
+                "INSERT INTO ledger_entries (tx_id, ip_id, bucket, delta, created_at, kind) "
+                f"SELECT t.id, {ip_sql}, {bucket_sql}, :sign * t.amount, t.created_at, :kind FROM transactions t "
+                f"{join_sql}WHERE t.type = :type AND {ip_sql} IS NOT NULL AND t.is_cancelled IS false"
+            ), {"sign": sign, "type": tx_type, "kind": LedgerKind.BACKFILL})
+    for bucket in BUCKETS:
+        await conn.execute(text(
+            "INSERT INTO ledger_entries (tx_id, ip_id, bucket, delta, created_at, kind) "
+            f"SELECT NULL, ips.id, '{bucket}', ips.{bucket}_balance - COALESCE(SUM(l.delta), 0), now(), :kind "
+            "FROM ips LEFT JOIN ledger_entries l ON l.ip_id = ips.id AND l.bucket = :bucket "
+            f"GROUP BY ips.id HAVING ips.{bucket}_balance - COALESCE(SUM(l.delta), 0) <> 0"
+        ), {"bucket": bucket, "kind": LedgerKind.BACKFILL})
+
+
 async def init_db() -> None:
     """
     Создаёт все таблицы и применяет совместимые миграции.
@@ -62,4 +110,73 @@ async def init_db() -> None:
         ))
         # Создаём все новые таблицы (существующие не трогает)
         await conn.run_sync(Base.metadata.create_all)
+        # Миграции ниже — после create_all: таблица outbound_messages может быть новой
+        # Миграция: подписка на ежедневную сводку
+        await conn.execute(text(
+            "ALTER TABLE users ADD COLUMN IF NOT EXISTS digest_enabled BOOLEAN NOT NULL DEFAULT FALSE"
+        ))
+        # Миграция: пауза между повторными попытками отправки
+        await conn.execute(text(
+            "ALTER TABLE outbound_messages ADD COLUMN IF NOT EXISTS next_attempt_at TIMESTAMP"
+        ))
+        # Миграция: связь операции с долгом (выдача / погашение)
+        await conn.execute(text(
+            "ALTER TABLE transactions ADD COLUMN IF NOT EXISTS debt_id INTEGER REFERENCES ip_debts(id)"
+        ))
+        # У старых погашений номер долга есть только в комментарии
+        await conn.execute(text(
+            "UPDATE transactions t SET debt_id = CAST(substring(t.comment from '^Погашение долга #([0-9]+)$') AS INTEGER) "
+            "WHERE t.type = :type AND t.debt_id IS NULL "
+            "AND EXISTS (SELECT 1 FROM ip_debts d "
+            "WHERE d.id = CAST(substring(t.comment from '^Погашение долга #([0-9]+)$') AS INTEGER) "
+            "AND d.creditor_ip_id = t.ip_id)"
+        ), {"type": TxType.POGASIT})
+        # Старые займы писались вместе с долгом в одной транзакции БД: created_at
+        # (now()) у них совпадает. Связываем, только если пара однозначна
+        await conn.execute(text(
+            "UPDATE transactions t SET debt_id = d.id FROM ip_debts d "
+            "WHERE t.type = :type AND t.debt_id IS NULL "
+            "AND d.creditor_ip_id = t.ip_id AND d.created_at = t.created_at "
+            "AND (SELECT COUNT(*) FROM ip_debts d2 "
+            "WHERE d2.creditor_ip_id = t.ip_id AND d2.created_at = t.created_at) = 1 "
+            "AND (SELECT COUNT(*) FROM transactions t2 "
+            "WHERE t2.type = t.type AND t2.ip_id = t.ip_id AND t2.created_at = t.created_at) = 1"
+        ), {"type": TxType.ODOLZHIT})
+        # Миграция: вид проводок без операции (начальный остаток / корректировка)
+        await conn.execute(text(
+            "ALTER TABLE ledger_entries ADD COLUMN IF NOT EXISTS kind VARCHAR(20)"
+        ))
+        # Миграция: полная сверка по снимку (не сдвигает отметку досчёта)
+        await conn.execute(text(
+            "ALTER TABLE reconciliation_runs ADD COLUMN IF NOT EXISTS is_full BOOLEAN NOT NULL DEFAULT FALSE"
+        ))
+        # Индексы, объявленные в моделях, докатываем и на существующие таблицы
+        await conn.run_sync(_ensure_indexes)
+        # Проводки по существующей истории — один раз, пока таблица пуста
+        # (дальше их пишет services/transaction)
+        if not (await conn.execute(text("SELECT EXISTS (SELECT 1 FROM ledger_entries)"))).scalar():
+            await _backfill_ledger(conn)
+        # Первичное заполнение дневных агрегатов по существующей истории
+        # (только если таблица пуста; дальше её ведёт services/transaction)
+        await conn.execute(text(
+            "INSERT INTO transaction_daily_aggregates "
+            "(day, ip_id, user_id, type, destination, amount_sum, tx_count) "
+            "SELECT CAST(created_at AS DATE), COALESCE(ip_id, 0), user_id, type, "
+            "COALESCE(destination, ''), SUM(amount), COUNT(*) "
+            "FROM transactions "
+            "WHERE is_cancelled IS false "
+            "AND NOT EXISTS (SELECT 1 FROM transaction_daily_aggregates) "
+            "GROUP BY 1, 2, 3, 4, 5 "
+            "ON CONFLICT DO NOTHING"
+        ))
+        # Стартовая контрольная точка (текущие балансы) для ИП, у которых её ещё нет
+        await conn.execute(text(
+            "INSERT INTO ip_balance_checkpoints "
+            "(ip_id, tx_id, as_of, cash_balance, bank_balance, debit_balance) "
+            "SELECT ips.id, "
+            "COALESCE((SELECT MAX(t.id) FROM transactions t WHERE t.ip_id = ips.id), 0), "
+            "now(), ips.cash_balance, ips.bank_balance, ips.debit_balance "
+            "FROM ips "
+            "WHERE NOT EXISTS (SELECT 1 FROM ip_balance_checkpoints c WHERE c.ip_id = ips.id)"
+        ))
     logger.info("База данных инициализирована")
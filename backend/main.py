@@ -1,5 +1,9 @@
 """
-Точка входа: запускает Telegram-бот и FastAPI-сервер параллельно.
+Точка входа. Режим задаётся RUN_MODE:
+- single (по умолчанию) — Telegram-бот и FastAPI-сервер в одном процессе;
+- api — только FastAPI, API_WORKERS процессов uvicorn;
+- bot — только бот и отправка исходящих сообщений (один процесс на всех).
+В режимах api/bot процессы узнают об изменениях друг друга через database/notify.
 """
 
 import asyncio
@@ -14,10 +18,16 @@ from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import BotCommand, BotCommandScopeDefault
 
 from backend.api.app import app as fastapi_app
+from backend.api.routes.webhook import WEBHOOK_PATH
 from backend.bot.handlers import router
 from backend.bot.middleware import DbSessionMiddleware, UserMiddleware
+from backend.bot.outbox import run_outbox
 from backend.config import settings
+from backend.database import notify
 from backend.database.session import init_db
+from backend.services.reconciliation import run_reconcile_scheduler
+from backend.services.summary import run_digest_scheduler
+from backend.services.executor import cpu_executor, loop_lag
 
 logging.basicConfig(
     level=logging.INFO,
@@ -35,26 +45,56 @@ async def setup_bot_commands(bot: Bot) -> None:
     await bot.set_my_commands(commands, scope=BotCommandScopeDefault())
 
 
+def _use_webhook() -> bool:
+    if settings.bot_update_mode != "webhook":
+        return False
+    if settings.run_mode != "single":
+        # Апдейты принимает API, а Dispatcher живёт только в процессе бота
+        logger.warning("Webhook работает только при RUN_MODE=single, используется polling")
+        return False
+    return True
+
+
 async def run_bot() -> None:
-    """Запускает Telegram-бот с long polling."""
+    """
+    Запускает Telegram-бот и отправку очереди сообщений.
+    Апдейты — long polling либо (BOT_UPDATE_MODE=webhook) через эндпоинт API.
+    """
     bot = Bot(
         token=settings.telegram_bot_token,
         default=DefaultBotProperties(parse_mode=ParseMode.HTML),
     )
-    # Делаем бот доступным для FastAPI-роутеров (например, /summary/send)
-    fastapi_app.state.bot = bot
-
     await setup_bot_commands(bot)
+    outbox = asyncio.create_task(run_outbox(bot))
+    # Ежедневные задачи — только в процессе бота, чтобы не выполнить их дважды
+    digest = asyncio.create_task(run_digest_scheduler())
+    reconcile = asyncio.create_task(run_reconcile_scheduler())
 
     dp = Dispatcher(storage=MemoryStorage())
     dp.update.outer_middleware(DbSessionMiddleware())
     dp.update.outer_middleware(UserMiddleware())
     dp.include_router(router)
 
-    logger.info("Бот запущен")
     try:
-        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+        if _use_webhook():
+            fastapi_app.state.bot = bot
+            fastapi_app.state.dispatcher = dp
+            await bot.set_webhook(
+                settings.webapp_url.rstrip("/") + "/api" + WEBHOOK_PATH,
+                secret_token=settings.webhook_secret_token,
+                allowed_updates=dp.resolve_used_update_types(),
+            )
+            logger.info("Бот запущен (webhook)")
+            await outbox
+        else:
+            # Webhook, оставшийся от прошлого запуска, мешает getUpdates
+            await bot.delete_webhook()
+            logger.info("Бот запущен")
+            await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
     finally:
+        outbox.cancel()
+        digest.cancel()
+        reconcile.cancel()
         await bot.session.close()
 
 
@@ -76,9 +116,45 @@ async def run_api() -> None:
 async def main() -> None:
     logger.info("Запуск бота-бухгалтера...")
     await init_db()
-    # Бот и API работают параллельно в одном event loop
+    # Бот и API работают параллельно в одном event loop;
+    # тяжёлая синхронная работа уходит в cpu_executor, loop_lag следит
+    # за задержкой (запускается в lifespan приложения)
     await asyncio.gather(run_bot(), run_api())
 
 
+async def main_bot() -> None:
+    logger.info("Запуск бота-бухгалтера (только бот)...")
+    await init_db()
+    tasks = [run_bot(), loop_lag.run()]
+    if notify.enabled():
+        tasks.append(notify.listen_forever())
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        cpu_executor.shutdown()
+
+
+def main_api() -> None:
+    """
+    Несколько процессов uvicorn; приложение каждый импортирует заново.
+    Общее состояние процессов — в БД (задания выгрузок) и общем каталоге
+    кэша выгрузок, о сбросах кэшей они узнают через database/notify.
+    """
+    logger.info("Запуск API (%d процессов)...", settings.api_workers)
+    asyncio.run(init_db())
+    uvicorn.run(
+        "backend.api.app:app",
+        host="0.0.0.0",
+        port=int(os.environ.get("PORT", settings.port)),
+        workers=settings.api_workers,
+        log_level="info",
+    )
+
+
 if __name__ == "__main__":
-    asyncio.run(main())
+    if settings.run_mode == "api":
+        main_api()
+    elif settings.run_mode == "bot":
+        asyncio.run(main_bot())
+    else:
+        asyncio.run(main())
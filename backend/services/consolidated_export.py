@@ -0,0 +1,154 @@
+"""
+Сводная выгрузка по нескольким ИП: ZIP-архив с книгой на каждое ИП
+(тот же набор листов, что и в обычной выгрузке) и книгой «Итого».
+
+Строки ИП читаются из серверного курсора (iter_statement) и порциями
+складываются во временный файл, итоги ИП копятся по ходу. Книгу по этому
+файлу собирает процесс из пула CPU-задач (run_process): оформление строк и
+сборка XLSX упираются в GIL, и в потоках сводная выгрузка занимала бы одно
+ядро. Процесс пишет книгу в свой временный файл и возвращает путь, архив
+собирается в основном процессе. Несколько ИП идут параллельно, каждое своей
+сессией; память — порции строк, а не вся история и не все книги.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import pickle
+import re
+import tempfile
+import zipfile
+from datetime import date
+from typing import BinaryIO, Optional
+
+from backend.database import crud
+from backend.database.session import async_session_factory
+from backend.services.executor import cpu_executor
+from backend.services.export import (
+    _WRITE_CHUNK,
+    ExcelWriter,
+    IpTotals,
+    TotalsTracker,
+    generate_totals_excel,
+    iter_statement,
+)
+
+# Сколько ИП собирается одновременно (у каждого своё соединение и место в пуле CPU)
+_LOAD_CONCURRENCY = 4
+
+
+def _safe_name(name: str) -> str:
+    return re.sub(r'[\\/:*?"<>|]+', "_", name).strip() or "ИП"
+
+
+class _Archive:
+    """ZIP, в который записи добавляются по одной по мере готовности книг."""
+
+    def __init__(self, fileobj: BinaryIO):
+        # xlsx уже сжат, повторно жать незачем
+        self._zip = zipfile.ZipFile(fileobj, "w", compression=zipfile.ZIP_STORED)
+        self._used: set[str] = set()
+        self._lock = asyncio.Lock()
+
+    def _entry_name(self, name: str) -> str:
+        file_name = _safe_name(name)
+        while file_name in self._used:
+            file_name += "_"
+        self._used.add(file_name)
+        return f"{file_name}.xlsx"
+
+    async def add_path(self, name: str, path: str) -> None:
+        async with self._lock:
+            await cpu_executor.run_thread(self._zip.write, path, self._entry_name(name))
+
+    async def add_bytes(self, entry: str, data: bytes) -> None:
+        async with self._lock:
+            await cpu_executor.run_thread(self._zip.writestr, entry, data)
+
+    def close(self) -> None:
+        self._zip.close()
+
+    def discard(self) -> None:
+        """Закрывает архив после ошибки: запись, прерванная отменой, может быть не дописана."""
+        try:
+            self._zip.close()
+        except (ValueError, OSError):
+            pass
+
+
+def _render_book(rows_path: str, directory: str) -> str:
+    """
+    Выполняется в процессе пула: книга по строкам из rows_path (порции
+    pickle) во временный файл в directory. Возвращает путь к книге.
+    """
+    writer = ExcelWriter()
+    with open(rows_path, "rb") as source:
+        while True:
+            try:
+                writer.append_many(pickle.load(source))
+            except EOFError:
+                break
+    fd, path = tempfile.mkstemp(suffix=".xlsx", dir=directory)
+    with os.fdopen(fd, "wb") as book:
+        writer.save(book)
+    return path
+
+
+async def _render_ip(ip_id: int, date_from, date_to, workdir: str, archive: _Archive, slots: asyncio.Semaphore) -> IpTotals:
+    async with slots:
+        fd, rows_path = tempfile.mkstemp(suffix=".rows", dir=workdir)
+        try:
+            with os.fdopen(fd, "wb") as spool:
+                async with async_session_factory() as session:
+                    ip = await crud.get_ip(session, ip_id)
+                    if ip is None:
+                        raise ValueError(f"ИП {ip_id} не найдено")
+                    opening, rows = await iter_statement(session, ip, date_from, date_to)
+                    tracker = TotalsTracker(ip.name, opening)
+                    chunk = []
+                    async for row in tracker.track(rows):
+                        chunk.append(row)
+                        if len(chunk) >= _WRITE_CHUNK:
+                            pickle.dump(chunk, spool, pickle.HIGHEST_PROTOCOL)
+                            chunk = []
+                    if chunk:
+                        pickle.dump(chunk, spool, pickle.HIGHEST_PROTOCOL)
+            book_path = await cpu_executor.run_process(_render_book, rows_path, workdir)
+        finally:
+            os.unlink(rows_path)
+        try:
+            await archive.add_path(ip.name, book_path)
+        finally:
+            os.unlink(book_path)
+    return tracker.totals()
+
+
+async def write_consolidated(
+    ip_ids: list[int],
+    fileobj: BinaryIO,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+) -> None:
+    """
+    Собирает архив по ИП ip_ids в fileobj. Ошибка по одному ИП (в том числе
+    ExecutorBusyError) отменяет сборку остальных и выбрасывается дальше.
+    """
+    slots = asyncio.Semaphore(_LOAD_CONCURRENCY)
+    archive = _Archive(fileobj)
+    # Строки и книги ИП — во временном каталоге: после ошибки или отмены он удаляется
+    # целиком (процесс пула, чью книгу уже не ждут, может дописывать в него файл)
+    with tempfile.TemporaryDirectory(prefix="consolidated_", ignore_cleanup_errors=True) as workdir:
+        try:
+            async with asyncio.TaskGroup() as group:
+                tasks = [
+                    group.create_task(_render_ip(ip_id, date_from, date_to, workdir, archive, slots))
+                    for ip_id in ip_ids
+                ]
+        except ExceptionGroup as e:
+            # Остальные ИП уже отменены; наружу — первая ошибка, маршрут отвечает по её типу
+            archive.discard()
+            raise e.exceptions[0] from None
+    totals = await cpu_executor.run_thread(generate_totals_excel, [task.result() for task in tasks])
+    await archive.add_bytes("Итого.xlsx", totals)
+    archive.close()
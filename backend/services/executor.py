@@ -0,0 +1,161 @@
+"""
+Вынос CPU-нагрузки из общего event loop.
+
+Бот и API работают в одном asyncio-цикле (см. main.py), поэтому любая
+долгая синхронная работа — сборка Excel, форматирование больших текстов —
+останавливает обработку всех запросов и апдейтов. Такая работа отправляется
+в пул (потоков или процессов, CPU_EXECUTOR), а цикл только ждёт результат.
+
+Пул ограничен: если в работе и в очереди уже CPU_WORKERS + CPU_QUEUE_SIZE
+задач, новая получает ExecutorBusyError — лучше быстро ответить 503,
+чем копить задачи без предела.
+
+LoopLagMonitor измеряет задержку цикла: насколько позже запланированного
+просыпается периодический sleep. Это и есть время, на которое цикл
+был занят чем-то синхронным.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Optional, TypeVar
+
+from backend.config import settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class ExecutorBusyError(RuntimeError):
+    pass
+
+
+class CpuExecutor:
+    """
+    run()        — чистые функции (в режиме process аргументы и результат пиклятся);
+    run_thread() — работа с объектом, живущим между вызовами (например,
+                   потоковая запись книги), всегда в потоке;
+    run_process() — крупные независимые задачи, которым нужны все ядра
+                   (сборка книг по нескольким ИП), всегда в процессах;
+    reserve_thread() — несколько шагов в потоке под одним местом в лимите.
+    Все методы делят один лимит задач.
+    """
+
+    def __init__(self, kind: str, workers: int, queue_size: int):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Неизвестный тип пула: {kind}")
+        self.kind = kind
+        self.workers = workers
+        self.limit = workers + queue_size
+        self._pending = 0
+        self._processes: Optional[ProcessPoolExecutor] = None
+        self._threads: Optional[ThreadPoolExecutor] = None
+
+    def _get_pool(self) -> Executor:
+        return self._get_processes() if self.kind == "process" else self._get_threads()
+
+    def _get_processes(self) -> ProcessPoolExecutor:
+        if self._processes is None:
+            self._processes = ProcessPoolExecutor(max_workers=self.workers)
+        return self._processes
+
+    def _get_threads(self) -> ThreadPoolExecutor:
+        if self._threads is None:
+            self._threads = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="cpu")
+        return self._threads
+
+    def _acquire(self) -> None:
+        if self._pending >= self.limit:
+            raise ExecutorBusyError("Сервер перегружен, повторите запрос позже")
+        self._pending += 1
+
+    async def _submit(self, pool: Executor, fn: Callable[..., T], *args) -> T:
+        self._acquire()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(pool, fn, *args)
+        finally:
+            self._pending -= 1
+
+    @asynccontextmanager
+    async def reserve_thread(self) -> AsyncIterator[Callable[..., Awaitable]]:
+        """
+        Одно место в лимите на всю многошаговую работу (запись книги порциями).
+        ExecutorBusyError возможен только на входе, а не посреди работы:
+        async with cpu_executor.reserve_thread() as run: await run(fn, *args)
+        """
+        self._acquire()
+        pool = self._get_threads()
+        loop = asyncio.get_running_loop()
+
+        async def run(fn: Callable[..., T], *args) -> T:
+            return await loop.run_in_executor(pool, fn, *args)
+
+        try:
+            yield run
+        finally:
+            self._pending -= 1
+
+    async def run(self, fn: Callable[..., T], *args) -> T:
+        return await self._submit(self._get_pool(), fn, *args)
+
+    async def run_thread(self, fn: Callable[..., T], *args) -> T:
+        return await self._submit(self._get_threads(), fn, *args)
+
+    async def run_process(self, fn: Callable[..., T], *args) -> T:
+        return await self._submit(self._get_processes(), fn, *args)
+
+    def stats(self) -> dict:
+        return {
+            "kind": self.kind,
+            "workers": self.workers,
+            "limit": self.limit,
+            "pending": self._pending,
+        }
+
+    def shutdown(self) -> None:
+        for pool in (self._processes, self._threads):
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+        self._processes = self._threads = None
+
+
+class LoopLagMonitor:
+    """Периодически меряет задержку event loop и хранит последние замеры."""
+
+    def __init__(self, interval: float = 0.1, window: int = 600, warn_ms: float = 200):
+        self.interval = interval
+        self.warn_ms = warn_ms
+        self._samples: deque[float] = deque(maxlen=window)
+        self.max_ms = 0.0
+
+    async def run(self) -> None:
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag_ms = max(0.0, (time.perf_counter() - started - self.interval) * 1000)
+            self._samples.append(lag_ms)
+            self.max_ms = max(self.max_ms, lag_ms)
+            if lag_ms > self.warn_ms:
+                logger.warning("Event loop был занят %.0f мс", lag_ms)
+
+    def stats(self) -> dict:
+        samples = sorted(self._samples)
+        if not samples:
+            return {"samples": 0, "last_ms": 0.0, "p50_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+        return {
+            "samples": len(samples),
+            "last_ms": round(self._samples[-1], 1),
+            "p50_ms": round(samples[len(samples) // 2], 1),
+            "p99_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))], 1),
+            "max_ms": round(self.max_ms, 1),
+        }
+
+
+cpu_executor = CpuExecutor(settings.cpu_executor, settings.cpu_workers, settings.cpu_queue_size)
+loop_lag = LoopLagMonitor(warn_ms=settings.loop_lag_warn_ms)
@@ -1,18 +1,37 @@
 """
-Генерация Excel-выгрузки истории операций по ИП.
+Выгрузка истории операций по ИП: Excel, CSV и JSON Lines.
+
+Книга пишется в write-only режиме openpyxl за один проход по строкам:
+каждая строка сразу попадает на лист «Все операции» и на лист своей группы,
+оформление — через общие именованные стили. Строки читаются из БД
+серверным курсором, поэтому память не зависит от длины истории.
+
+В выписку ИП входят и займы / погашения, где оно заёмщик: они находятся
+по связи операции с долгом (transactions.debt_id), изменения — по стороне
+заёмщика в тех же правилах проводок. Старые операции, которые миграция
+не смогла связать с долгом, видны только у кредитора.
+
+CSV и JSON Lines — без оформления, для скриптов сверки и BI: те же колонки
+running balance, строки кодируются и отдаются кусками прямо из курсора.
 """
 
 from __future__ import annotations
 
+import csv
 import io
-from datetime import date, datetime
-from typing import Optional
+import json
+from datetime import date, datetime, time, timedelta
+from typing import AsyncIterator, BinaryIO, Iterable, NamedTuple, Optional
 
 from openpyxl import Workbook
-from openpyxl.styles import Alignment, Font, PatternFill
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Font, NamedStyle, PatternFill
 from openpyxl.utils import get_column_letter
 
+from backend.database import crud
 from backend.database.models import TX_LABELS, TxType
+from backend.services import running_balance
+from backend.services.executor import cpu_executor
 
 
 # Группы операций для отдельных листов
@@ -21,76 +40,192 @@ _EXPENSE_TYPES = {TxType.ZAKUP, TxType.STORONNIE}
 _DEBT_TYPES = {TxType.ODOLZHIT, TxType.POGASIT}
 _TRANSFER_TYPES = {TxType.SNYAT_RS, TxType.SNYAT_DEBIT, TxType.VNESTI_RS}
 
+# Листы книги: (название, типы операций; None — все)
+_SHEETS = [
+    ("Все операции", None),
+    ("Приходы", _INCOME_TYPES),
+    ("Закупы", _EXPENSE_TYPES),
+    ("Займы", _DEBT_TYPES),
+    ("Переводы", _TRANSFER_TYPES),
+]
+
+_HEADERS = [
+    "Дата", "Время", "ИП", "Тип операции", "Кто провёл", "Комментарий",
+    "Изм. Нал", "Изм. Р/С", "Изм. Дебет",
+    "Баланс Нал", "Баланс Р/С", "Баланс Дебет",
+]
+_WIDTHS = [12, 8, 18, 22, 18, 24, 12, 12, 12, 14, 14, 14]
+_FIRST_NUMERIC_COL = 7  # с 7-й колонки — суммы, выравниваются вправо
+
+# Сколько строк за раз передаётся на запись в пул CPU-задач
+_WRITE_CHUNK = 1000
+# Сколько транзакций за раз проводится через running balance (порция курсора)
+_BALANCE_CHUNK = 500
+
 # Цвета шапки
-_HEADER_FILL = PatternFill(start_color="1F4E79", end_color="1F4E79", fill_type="solid")
+_HEADER_FILL = "1F4E79"
 _HEADER_FONT = Font(color="FFFFFF", bold=True)
 
 # Цвета строк
-_GREEN_FILL = PatternFill(start_color="E2EFDA", end_color="E2EFDA", fill_type="solid")
-_RED_FILL = PatternFill(start_color="FCE4D6", end_color="FCE4D6", fill_type="solid")
-
-
-def _get_delta(tx) -> tuple[int, int, int]:
-    """Возвращает (delta_cash, delta_bank, delta_debit) для транзакции."""
-    t = tx.type
-    a = tx.amount
-    dest = tx.destination or "cash"
-
-    if t in (TxType.ZAKUP, TxType.STORONNIE):
-        return (-a, 0, 0)
-    elif t in _INCOME_TYPES:
-        if dest == "bank":
-            return (0, a, 0)
-        elif dest == "debit":
-            return (0, 0, a)
-        else:
-            return (a, 0, 0)
-    elif t == TxType.SNYAT_RS:
-        return (0, -a, a)  # bank → debit
-    elif t == TxType.SNYAT_DEBIT:
-        return (a, 0, -a)
-    elif t == TxType.VNESTI_RS:
-        return (-a, a, 0)
-    elif t in (TxType.ODOLZHIT, TxType.POGASIT):
-        return (-a, 0, 0)
-    return (0, 0, 0)
-
-
-def _compute_rows(ip, all_transactions_asc: list) -> list[tuple]:
+_ROW_FILLS = {"green": "E2EFDA", "red": "FCE4D6", "plain": None}
+
+
+class ExportRow(NamedTuple):
+    """Строка выгрузки: операция + изменения и балансы ИП после неё."""
+    tx_id: int
+    created_at: datetime
+    ip_id: int
+    ip_name: str
+    tx_type: str
+    amount: int
+    destination: Optional[str]
+    user_name: str
+    comment: str
+    delta_cash: int
+    delta_bank: int
+    delta_debit: int
+    cash: int
+    bank: int
+    debit: int
+
+
+class _RunningBalance:
+    """Балансы ИП, которые двигаются вперёд пачками транзакций (services/running_balance)."""
+
+    def __init__(self, start_balances: tuple[int, int, int], ip_id: int, ip_name: str):
+        self.balances = start_balances
+        self.ip_id = ip_id
+        self.ip_name = ip_name
+
+    def steps(self, transactions: list) -> list[ExportRow]:
+        if not transactions:
+            return []
+        columns = running_balance.compute(
+            self.balances,
+            [running_balance.kind_code(tx.type, tx.destination, tx.ip_id != self.ip_id) for tx in transactions],
+            [tx.amount for tx in transactions],
+        )
+        self.balances = (columns.cash[-1], columns.bank[-1], columns.debit[-1])
+        return [
+            ExportRow(
+                tx.id, tx.created_at, self.ip_id, self.ip_name, tx.type, tx.amount, tx.destination,
+                tx.user.display_name if tx.user else "", tx.comment or "", *values,
+            )
+            for tx, *values in zip(transactions, *columns)
+        ]
+
+
+def _compute_rows(start_balances: tuple[int, int, int], ip, transactions_asc: Iterable) -> list[ExportRow]:
+    """Running balance для каждой транзакции, вперёд от балансов до первой из них."""
+    return _RunningBalance(start_balances, ip.id, ip.name).steps(list(transactions_asc))
+
+
+def _sum_deltas(amounts_by_kind: list[tuple[str, Optional[str], bool, int]]) -> tuple[int, int, int]:
+    """Суммарная дельта по агрегату (type, destination, counterparty, sum) — дельты линейны по сумме."""
+    return running_balance.net_delta(
+        [running_balance.kind_code(tx_type, dest, counterparty) for tx_type, dest, counterparty, _ in amounts_by_kind],
+        [total for *_, total in amounts_by_kind],
+    )
+
+
+async def _start_balances(session, ip, start: Optional[datetime], end: Optional[datetime]) -> tuple[int, int, int]:
     """
-    Вычисляет running balance для каждой транзакции.
-    Начинает от текущих балансов ИП и идёт назад.
-    Возвращает список (tx, bal_cash_after, bal_bank_after, bal_debit_after, dc, db, dd).
+    Балансы ИП на момент start (до первой операции периода).
+    - есть контрольная точка до start — она плюс сумма операций между ней и start;
+    - иначе — первая точка после конца периода (или текущие балансы)
+      минус сумма операций от start до неё.
+    Суммы считаются одним GROUP BY, без загрузки транзакций.
     """
-    cash = ip.cash_balance
-    bank = ip.bank_balance
-    debit = ip.debit_balance
+    before = await crud.get_checkpoint_before(session, ip.id, start) if start else None
+    if before is not None:
+        gap = await crud.get_ip_amounts_by_kind(session, ip.id, after=before.key, until=start)
+        return tuple(b + d for b, d in zip(before.balances, _sum_deltas(gap)))
 
-    rows = []
-    for tx in reversed(all_transactions_asc):
-        dc, db, dd = _get_delta(tx)
-        rows.append((tx, cash, bank, debit, dc, db, dd))
-        cash -= dc
-        bank -= db
-        debit -= dd
+    after = await crud.get_checkpoint_after(session, ip.id, end) if end else None
+    if after is not None:
+        anchor = after.balances
+        tail = await crud.get_ip_amounts_by_kind(session, ip.id, since=start, upto=after.key)
+    else:
+        anchor = (ip.cash_balance, ip.bank_balance, ip.debit_balance)
+        tail = await crud.get_ip_amounts_by_kind(session, ip.id, since=start)
+    return tuple(b - d for b, d in zip(anchor, _sum_deltas(tail)))
 
-    rows.reverse()
-    return rows
 
+def _period_bounds(date_from: Optional[date], date_to: Optional[date]) -> tuple[Optional[datetime], Optional[datetime]]:
+    start = datetime.combine(date_from, time.min) if date_from else None
+    end = datetime.combine(date_to + timedelta(days=1), time.min) if date_to else None
+    return start, end
+
+
+async def iter_rows(
+    session,
+    ip,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+) -> AsyncIterator[ExportRow]:
+    """
+    Строки выгрузки (с running balance) за период [date_from, date_to] по порядку.
+    Стартовые балансы берутся от ближайшей контрольной точки, транзакции
+    периода читаются серверным курсором.
+    """
+    if ip is None:
+        raise ValueError("ИП не найдено")
+    start, end = _period_bounds(date_from, date_to)
+    opening = await _start_balances(session, ip, start, end)
+    async for row in _walk(session, ip, opening, start, end):
+        yield row
+
+
+async def _walk(session, ip, opening, start, end) -> AsyncIterator[ExportRow]:
+    balance = _RunningBalance(opening, ip.id, ip.name)
+    chunk = []
+    async for tx in crud.stream_ip_transactions(session, ip.id, since=start, until=end):
+        chunk.append(tx)
+        if len(chunk) >= _BALANCE_CHUNK:
+            for row in balance.steps(chunk):
+                yield row
+            chunk = []
+    for row in balance.steps(chunk):
+        yield row
+
+
+async def load_rows(
+    session,
+    ip,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+) -> list[ExportRow]:
+    """То же, что iter_rows, но списком — для небольших периодов."""
+    return [row async for row in iter_rows(session, ip, date_from, date_to)]
 
-def _style_header(ws, headers: list[str]):
-    """Записывает шапку с форматированием."""
-    ws.append(headers)
-    for cell in ws[1]:
-        cell.font = _HEADER_FONT
-        cell.fill = _HEADER_FILL
-        cell.alignment = Alignment(horizontal="center", wrap_text=True)
 
+async def iter_statement(
+    session,
+    ip,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+) -> tuple[tuple[int, int, int], AsyncIterator[ExportRow]]:
+    """Балансы на начало периода и строки периода (по ходу чтения) — для выписки с итогами."""
+    if ip is None:
+        raise ValueError("ИП не найдено")
+    start, end = _period_bounds(date_from, date_to)
+    opening = await _start_balances(session, ip, start, end)
+    return opening, _walk(session, ip, opening, start, end)
+
+
+async def iter_rows_many(
+    session,
+    ips,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+) -> AsyncIterator[ExportRow]:
+    """Строки по нескольким ИП подряд: сначала вся история первого, затем второго и т.д."""
+    for ip in ips:
+        async for row in iter_rows(session, ip, date_from, date_to):
+            yield row
 
-def _set_column_widths(ws, widths: list[int]):
-    for i, w in enumerate(widths, start=1):
-        ws.column_dimensions[get_column_letter(i)].width = w
 
+# ── Запись книги ──────────────────────────────────────────────────────────────
 
 def _fmt_amount(v: int) -> str:
     if v == 0:
@@ -99,112 +234,239 @@ def _fmt_amount(v: int) -> str:
     return f"{sign}{v:,}".replace(",", " ")
 
 
-def _add_rows_to_sheet(ws, rows: list[tuple], type_filter: Optional[set] = None):
-    """Добавляет строки данных в лист."""
-    headers = [
-        "Дата", "Время", "ИП", "Тип операции", "Кто провёл", "Комментарий",
-        "Изм. Нал", "Изм. Р/С", "Изм. Дебет",
-        "Баланс Нал", "Баланс Р/С", "Баланс Дебет",
-    ]
-    _style_header(ws, headers)
-    _set_column_widths(ws, [12, 8, 18, 22, 18, 24, 12, 12, 12, 14, 14, 14])
-
-    row_num = 2
-    for tx, bal_cash, bal_bank, bal_debit, dc, db, dd in rows:
-        if type_filter is not None and tx.type not in type_filter:
-            continue
-
-        dt: datetime = tx.created_at
-        ip_name = tx.ip.name if tx.ip else ""
-        user_name = tx.user.display_name if tx.user else ""
-        type_label = TX_LABELS.get(tx.type, tx.type)
-
-        row_data = [
-            dt.strftime("%d.%m.%Y"),
-            dt.strftime("%H:%M"),
-            ip_name,
-            type_label,
-            user_name,
-            tx.comment or "",
-            _fmt_amount(dc),
-            _fmt_amount(db),
-            _fmt_amount(dd),
-            f"{bal_cash:,}".replace(",", " "),
-            f"{bal_bank:,}".replace(",", " "),
-            f"{bal_debit:,}".replace(",", " "),
-        ]
-        ws.append(row_data)
+def _style_name(kind: str, align: str) -> str:
+    return f"export_{kind}_{align}"
 
-        # Цветовая подсветка строк
-        total_delta = dc + db + dd
-        fill = _GREEN_FILL if total_delta > 0 else (_RED_FILL if total_delta < 0 else None)
-        if fill:
-            for col in range(1, 13):
-                ws.cell(row=row_num, column=col).fill = fill
 
-        row_num += 1
+def _register_styles(wb: Workbook) -> None:
+    """Именованные стили книги: шапка + (обычная/зелёная/красная) × (слева/справа)."""
+    header = NamedStyle(name="export_header")
+    header.font = _HEADER_FONT
+    header.fill = PatternFill(start_color=_HEADER_FILL, end_color=_HEADER_FILL, fill_type="solid")
+    header.alignment = Alignment(horizontal="center", wrap_text=True)
+    wb.add_named_style(header)
 
-    # Выравнивание числовых колонок по правому краю
-    for r in ws.iter_rows(min_row=2, max_row=ws.max_row, min_col=7, max_col=12):
-        for cell in r:
-            cell.alignment = Alignment(horizontal="right")
+    for kind, color in _ROW_FILLS.items():
+        for align in ("left", "right"):
+            style = NamedStyle(name=_style_name(kind, align))
+            if color:
+                style.fill = PatternFill(start_color=color, end_color=color, fill_type="solid")
+            if align == "right":
+                style.alignment = Alignment(horizontal="right")
+            wb.add_named_style(style)
 
 
-def generate_excel(
-    ip,
-    all_transactions: list,
-    date_from: Optional[date] = None,
-    date_to: Optional[date] = None,
-) -> bytes:
+class ExcelWriter:
+    """
+    Однопроходная запись выгрузки: append(row) сразу пишет строку на все
+    подходящие листы write-only книги, save(fileobj) собирает XLSX.
+    Строки не накапливаются в памяти (openpyxl сбрасывает их во временные файлы).
+    """
+
+    def __init__(self):
+        self._wb = Workbook(write_only=True)
+        _register_styles(self._wb)
+        self._sheets = []
+        for title, types in _SHEETS:
+            ws = self._wb.create_sheet(title)
+            for i, w in enumerate(_WIDTHS, start=1):
+                ws.column_dimensions[get_column_letter(i)].width = w
+            # Заморозить первую строку
+            ws.freeze_panes = "A2"
+            ws.append([self._cell(ws, h, "export_header") for h in _HEADERS])
+            self._sheets.append((ws, types))
+
+    @staticmethod
+    def _cell(ws, value, style: str) -> WriteOnlyCell:
+        cell = WriteOnlyCell(ws, value=value)
+        cell.style = style
+        return cell
+
+    def append(self, row: ExportRow) -> None:
+        # Цветовая подсветка строк
+        total_delta = row.delta_cash + row.delta_bank + row.delta_debit
+        kind = "green" if total_delta > 0 else ("red" if total_delta < 0 else "plain")
+        left, right = _style_name(kind, "left"), _style_name(kind, "right")
+
+        values = [
+            row.created_at.strftime("%d.%m.%Y"),
+            row.created_at.strftime("%H:%M"),
+            row.ip_name,
+            TX_LABELS.get(row.tx_type, row.tx_type),
+            row.user_name,
+            row.comment,
+            _fmt_amount(row.delta_cash),
+            _fmt_amount(row.delta_bank),
+            _fmt_amount(row.delta_debit),
+            f"{row.cash:,}".replace(",", " "),
+            f"{row.bank:,}".replace(",", " "),
+            f"{row.debit:,}".replace(",", " "),
+        ]
+        for ws, types in self._sheets:
+            if types is not None and row.tx_type not in types:
+                continue
+            ws.append([
+                self._cell(ws, v, right if col >= _FIRST_NUMERIC_COL else left)
+                for col, v in enumerate(values, start=1)
+            ])
+
+    def append_many(self, rows: Iterable[ExportRow]) -> None:
+        for row in rows:
+            self.append(row)
+
+    def save(self, fileobj: BinaryIO) -> None:
+        self._wb.save(fileobj)
+
+
+def generate_excel(rows: Iterable[ExportRow]) -> bytes:
+    """Генерирует Excel-файл с 5 листами по готовым строкам (отсортированы по created_at ASC)."""
+    writer = ExcelWriter()
+    for row in rows:
+        writer.append(row)
+    buf = io.BytesIO()
+    writer.save(buf)
+    return buf.getvalue()
+
+
+async def write_excel(rows: AsyncIterator[ExportRow], fileobj: BinaryIO) -> None:
     """
-    Генерирует Excel-файл с 5 листами по операциям ИП.
-    all_transactions — ВСЕ транзакции ИП (отсортированные по created_at ASC) для вычисления running balance.
-    date_from/date_to — фильтр дат для отображения строк (но running balance считается по всем).
+    Пишет книгу в fileobj по мере поступления строк из iter_rows.
+    Оформление строк и сборка XLSX идут в пуле CPU-задач порциями,
+    event loop только читает строки из БД. Место в пуле занимается один раз
+    на всю книгу: при перегрузке ExecutorBusyError будет до первой строки,
+    а не посреди файла.
     """
-    # Сортируем от старого к новому для вычисления балансов
-    sorted_txs = sorted(all_transactions, key=lambda t: t.created_at)
+    async with cpu_executor.reserve_thread() as run:
+        writer = ExcelWriter()
+        chunk = []
+        async for row in rows:
+            chunk.append(row)
+            if len(chunk) >= _WRITE_CHUNK:
+                await run(writer.append_many, chunk)
+                chunk = []
+        if chunk:
+            await run(writer.append_many, chunk)
+        await run(writer.save, fileobj)
+
+
+# ── Итоги по нескольким ИП ────────────────────────────────────────────────────
+
+class IpTotals(NamedTuple):
+    ip_name: str
+    opening: tuple[int, int, int]
+    closing: tuple[int, int, int]
+    income: int
+    expense: int
+    count: int
+
+
+class TotalsTracker:
+    """Итоги ИП, которые копятся по ходу выгрузки: строки не держатся в памяти."""
+
+    def __init__(self, ip_name: str, opening: tuple[int, int, int]):
+        self.ip_name = ip_name
+        self.opening = opening
+        self.closing = opening
+        self.income = self.expense = self.count = 0
+
+    async def track(self, rows: AsyncIterator[ExportRow]) -> AsyncIterator[ExportRow]:
+        async for row in rows:
+            self.closing = (row.cash, row.bank, row.debit)
+            if row.tx_type in _INCOME_TYPES:
+                self.income += row.amount
+            elif row.tx_type in _EXPENSE_TYPES:
+                self.expense += row.amount
+            self.count += 1
+            yield row
+
+    def totals(self) -> IpTotals:
+        return IpTotals(self.ip_name, self.opening, self.closing, self.income, self.expense, self.count)
+
+
+_TOTALS_HEADERS = [
+    "ИП", "Операций", "Приходы", "Закупы",
+    "Нал на начало", "Р/С на начало", "Дебет на начало",
+    "Нал на конец", "Р/С на конец", "Дебет на конец",
+]
+_TOTALS_WIDTHS = [18, 10, 14, 14, 14, 14, 14, 14, 14, 14]
+
+
+def generate_totals_excel(totals: list[IpTotals]) -> bytes:
+    """Книга с одним листом «Итого»: строка на ИП и общая сумма."""
+    wb = Workbook(write_only=True)
+    _register_styles(wb)
+    ws = wb.create_sheet("Итого")
+    for i, w in enumerate(_TOTALS_WIDTHS, start=1):
+        ws.column_dimensions[get_column_letter(i)].width = w
+    ws.freeze_panes = "A2"
+    ws.append([ExcelWriter._cell(ws, h, "export_header") for h in _TOTALS_HEADERS])
 
-    # Вычисляем running balance для каждой транзакции
-    all_rows = _compute_rows(ip, sorted_txs)
+    def _line(values, style_kind):
+        left, right = _style_name(style_kind, "left"), _style_name(style_kind, "right")
+        ws.append([ExcelWriter._cell(ws, v, left if col == 1 else right) for col, v in enumerate(values, start=1)])
 
-    # Применяем фильтр по датам
-    def in_range(tx) -> bool:
-        d = tx.created_at.date()
-        if date_from and d < date_from:
-            return False
-        if date_to and d > date_to:
-            return False
-        return True
+    for t in totals:
+        _line([t.ip_name, t.count, t.income, t.expense, *t.opening, *t.closing], "plain")
+    if totals:
+        sums = [sum(column) for column in zip(*(
+            (t.count, t.income, t.expense, *t.opening, *t.closing) for t in totals
+        ))]
+        _line(["Всего", *sums], "plain")
 
-    filtered_rows = [(tx, c, b, d, dc, db, dd) for (tx, c, b, d, dc, db, dd) in all_rows if in_range(tx)]
+    buf = io.BytesIO()
+    wb.save(buf)
+    return buf.getvalue()
 
-    wb = Workbook()
 
-    # Лист 1 — Все операции
-    ws1 = wb.active
-    ws1.title = "Все операции"
-    _add_rows_to_sheet(ws1, filtered_rows)
+# ── CSV / JSON Lines ──────────────────────────────────────────────────────────
 
-    # Лист 2 — Приходы
-    ws2 = wb.create_sheet("Приходы")
-    _add_rows_to_sheet(ws2, filtered_rows, _INCOME_TYPES)
+# Колонки машиночитаемых форматов — поля ExportRow как есть, суммы числами
+_RECORD_FIELDS = ExportRow._fields
 
-    # Лист 3 — Закупы
-    ws3 = wb.create_sheet("Закупы")
-    _add_rows_to_sheet(ws3, filtered_rows, _EXPENSE_TYPES)
+# Сколько строк кодируется в один кусок ответа
+_TEXT_CHUNK = 500
 
-    # Лист 4 — Займы
-    ws4 = wb.create_sheet("Займы")
-    _add_rows_to_sheet(ws4, filtered_rows, _DEBT_TYPES)
 
-    # Лист 5 — Переводы
-    ws5 = wb.create_sheet("Переводы")
-    _add_rows_to_sheet(ws5, filtered_rows, _TRANSFER_TYPES)
+def _record_values(row: ExportRow) -> tuple:
+    return (row.tx_id, row.created_at.isoformat()) + row[2:]
 
-    # Заморозить первую строку на всех листах
-    for ws in [ws1, ws2, ws3, ws4, ws5]:
-        ws.freeze_panes = "A2"
 
-    buf = io.BytesIO()
-    wb.save(buf)
-    return buf.getvalue()
+async def iter_csv(rows: AsyncIterator[ExportRow]) -> AsyncIterator[str]:
+    """CSV с заголовком; строки отдаются кусками по мере чтения из БД."""
+    buf = io.StringIO()
+    out = csv.writer(buf, lineterminator="\n")
+    out.writerow(_RECORD_FIELDS)
+    n = 0
+    async for row in rows:
+        out.writerow(_record_values(row))
+        n += 1
+        if n % _TEXT_CHUNK == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
+
+
+async def iter_jsonl(rows: AsyncIterator[ExportRow]) -> AsyncIterator[str]:
+    """JSON Lines: по одному объекту на строку."""
+    lines = []
+    async for row in rows:
+        lines.append(json.dumps(dict(zip(_RECORD_FIELDS, _record_values(row))), ensure_ascii=False))
+        if len(lines) >= _TEXT_CHUNK:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+async def _write_text(chunks: AsyncIterator[str], fileobj: BinaryIO) -> None:
+    async for chunk in chunks:
+        fileobj.write(chunk.encode("utf-8"))
+
+
+async def write_csv(rows: AsyncIterator[ExportRow], fileobj: BinaryIO) -> None:
+    await _write_text(iter_csv(rows), fileobj)
+
+
+async def write_jsonl(rows: AsyncIterator[ExportRow], fileobj: BinaryIO) -> None:
+    await _write_text(iter_jsonl(rows), fileobj)
@@ -0,0 +1,80 @@
+"""
+Замер задержки event loop во время выгрузки в Excel.
+
+Запуск: python -m backend.services.export_bench [число строк, по умолчанию 30000]
+
+Книга собирается из синтетических строк (БД не нужна) двумя способами:
+прямо в event loop (generate_excel) и через write_excel — порциями в пуле
+CPU-задач. Параллельно LoopLagMonitor меряет, насколько опаздывает
+периодический sleep; печатаются p50/p99/max задержки и время сборки.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import io
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import AsyncIterator
+
+from backend.database.models import TxType
+from backend.services.executor import LoopLagMonitor, cpu_executor
+from backend.services.export import ExportRow, generate_excel, write_excel
+
+_TYPES = [TxType.PRIHOD_MES, TxType.ZAKUP, TxType.SNYAT_RS, TxType.ODOLZHIT, TxType.VNESTI_RS]
+
+
+def _rows(count: int) -> list[ExportRow]:
+    start = datetime(2024, 1, 1)
+    rows = []
+    for i in range(count):
+        amount = 1000 + i % 5000
+        rows.append(ExportRow(
+            i + 1, start + timedelta(minutes=i), 1, "ИП Замер", _TYPES[i % len(_TYPES)], amount, "cash",
+            "@bench", f"строка {i}", amount, 0, 0, amount * i, 0, 0,
+        ))
+    return rows
+
+
+async def _aiter(rows: list[ExportRow]) -> AsyncIterator[ExportRow]:
+    for i, row in enumerate(rows):
+        # Как серверный курсор: время от времени отдаём управление циклу
+        if i % 500 == 0:
+            await asyncio.sleep(0)
+        yield row
+
+
+async def _measure(label: str, render) -> None:
+    monitor = LoopLagMonitor(interval=0.01, window=100_000, warn_ms=float("inf"))
+    task = asyncio.create_task(monitor.run())
+    await asyncio.sleep(0.05)
+    started = time.perf_counter()
+    await render()
+    elapsed = time.perf_counter() - started
+    await asyncio.sleep(0.05)
+    task.cancel()
+    stats = monitor.stats()
+    print(
+        f"{label:26s} сборка {elapsed:6.2f} с   задержка цикла: "
+        f"p50 {stats['p50_ms']} мс, p99 {stats['p99_ms']} мс, max {stats['max_ms']} мс"
+    )
+
+
+async def main(count: int) -> None:
+    rows = _rows(count)
+    print(f"Строк: {count}")
+
+    async def inline() -> None:
+        generate_excel(rows)
+
+    async def offloaded() -> None:
+        await write_excel(_aiter(rows), io.BytesIO())
+
+    await _measure("в event loop", inline)
+    await _measure("write_excel (пул CPU)", offloaded)
+    cpu_executor.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 30_000))
@@ -0,0 +1,311 @@
+"""
+Фоновые выгрузки и дисковый кэш готовых файлов.
+
+Файл выгрузки однозначно определяется ключом
+(ИП, период, формат, id последней неотменённой операции ИП):
+пока по ИП не проведено новых операций, повторная выгрузка того же периода
+отдаётся из кэша без обращения к истории. Отмена и редактирование меняют
+историю, не меняя последний id, поэтому сбрасывают кэш ИП явно
+(invalidate_on_commit).
+
+Всё общее для процессов API (API_WORKERS > 1) хранится вне памяти процесса:
+задания — в таблице export_jobs, поколения кэша ИП — в export_cache_generations,
+файлы — в общем каталоге кэша (EXPORT_CACHE_DIR). Задания собирают фоновые
+воркеры любого процесса: воркер берёт задание из таблицы (SKIP LOCKED) вместе
+с ждущими заданиями того же файла, поэтому одинаковые задания собираются один раз.
+О новом задании процессы узнают через database/notify, а упавший процесс
+отдаёт задание другим по истечении аренды.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import glob
+import hashlib
+import logging
+import os
+import tempfile
+import uuid
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import event
+
+from backend.config import settings
+from backend.database import crud, notify
+from backend.database.models import ExportJob
+from backend.database.session import async_session_factory
+from backend.services.executor import ExecutorBusyError
+from backend.services.export import iter_rows, write_csv, write_excel, write_jsonl
+
+logger = logging.getLogger(__name__)
+
+# Форматы выгрузки: расширение, MIME-тип, функция записи строк в файл
+FORMATS = {
+    "xlsx": (
+        ".xlsx",
+        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        write_excel,
+    ),
+    "csv": (".csv", "text/csv; charset=utf-8", write_csv),
+    "jsonl": (".jsonl", "application/x-ndjson", write_jsonl),
+}
+
+# Версия содержимого файлов: меняется вместе с колонками или правилами
+# подсчёта, чтобы не отдавать из кэша файлы, собранные по-старому
+_FILE_VERSION = 2
+
+# Сколько хранится информация о завершённом задании
+_JOB_TTL = 60 * 60
+# Аренда взятого задания: после неё задание упавшего процесса возьмёт другой
+_JOB_LEASE = 10 * 60
+# Пауза перед повтором, если пул CPU-задач переполнен
+_BUSY_RETRY_DELAY = 1.0
+# Как часто свободный воркер проверяет очередь без оповещения
+# (задания после паузы или аренды, пропущенные оповещения)
+_POLL_INTERVAL = 2.0
+
+
+@dataclass(frozen=True)
+class ExportKey:
+    ip_id: int
+    date_from: Optional[date]
+    date_to: Optional[date]
+    fmt: str
+    last_tx_id: int
+
+    @property
+    def file_name(self) -> str:
+        raw = f"{_FILE_VERSION}|{self.ip_id}|{self.date_from}|{self.date_to}|{self.fmt}|{self.last_tx_id}"
+        digest = hashlib.sha256(raw.encode()).hexdigest()[:32]
+        return f"{self.ip_id}-{digest}{FORMATS[self.fmt][0]}"
+
+
+async def make_key(session, ip_id: int, date_from: Optional[date], date_to: Optional[date], fmt: str) -> ExportKey:
+    if fmt not in FORMATS:
+        raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+    last_tx_id = await crud.get_latest_ip_transaction_id(session, ip_id)
+    return ExportKey(ip_id, date_from, date_to, fmt, last_tx_id)
+
+
+class ExportCache:
+    """
+    Каталог готовых файлов, ограниченный по размеру.
+    Время изменения файла обновляется при каждом попадании,
+    при переполнении удаляются файлы, которые дольше всех не запрашивали.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def file_path(self, file_name: str) -> str:
+        return os.path.join(self.directory, file_name)
+
+    def _path(self, key: ExportKey) -> str:
+        return self.file_path(key.file_name)
+
+    def get(self, key: ExportKey) -> Optional[str]:
+        path = self._path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def temp_file(self):
+        """Временный файл в каталоге кэша — чтобы put() был атомарным os.replace."""
+        return tempfile.NamedTemporaryFile(dir=self.directory, suffix=".part", delete=False)
+
+    def put(self, key: ExportKey, tmp_path: str) -> str:
+        path = self._path(key)
+        os.replace(tmp_path, path)
+        self._evict(keep=path)
+        return path
+
+    def discard(self, path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def invalidate_ip(self, ip_id: int) -> None:
+        for path in glob.glob(os.path.join(self.directory, f"{ip_id}-*")):
+            self.discard(path)
+
+    def _evict(self, keep: str) -> None:
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.endswith(".part"):
+                st = entry.stat()
+                files.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+async def render(session, cache: ExportCache, key: ExportKey) -> str:
+    """Собирает файл выгрузки в кэш и возвращает путь к нему."""
+    generation = await crud.get_export_generation(session, key.ip_id)
+    ip = await crud.get_ip(session, key.ip_id)
+    if ip is None:
+        raise ValueError("ИП не найдено")
+
+    writer = FORMATS[key.fmt][2]
+    tmp = cache.temp_file()
+    try:
+        await writer(iter_rows(session, ip, key.date_from, key.date_to), tmp)
+    except BaseException:
+        tmp.close()
+        os.remove(tmp.name)
+        raise
+    tmp.close()
+
+    path = cache.put(key, tmp.name)
+    # Поколение проверяется уже после put: если сброс закоммичен позже проверки,
+    # он сам удалит этот файл (invalidate_on_commit); если раньше — удаляем здесь
+    if await crud.get_export_generation(session, key.ip_id) != generation:
+        cache.discard(path)
+        raise ValueError("Операции ИП изменились во время выгрузки, повторите её")
+    return path
+
+
+def _key_of(job: ExportJob) -> ExportKey:
+    return ExportKey(job.ip_id, job.date_from, job.date_to, job.fmt, job.last_tx_id)
+
+
+class ExportJobQueue:
+    """Задания на выгрузку (таблица export_jobs) и пул фоновых воркеров процесса."""
+
+    def __init__(self, cache: ExportCache, workers: int):
+        self.cache = cache
+        self.workers = workers
+        self._wakeup = asyncio.Event()
+        self._tasks: list[asyncio.Task] = []
+
+    async def submit(self, session, user_id: int, key: ExportKey, filename: str) -> ExportJob:
+        """Записывает задание в транзакции session; файл из кэша — сразу готовое задание."""
+        await crud.delete_finished_export_jobs(session, datetime.utcnow() - timedelta(seconds=_JOB_TTL))
+        path = self.cache.get(key)
+        job = await crud.create_export_job(
+            session,
+            id=uuid.uuid4().hex,
+            user_id=user_id,
+            ip_id=key.ip_id,
+            date_from=key.date_from,
+            date_to=key.date_to,
+            fmt=key.fmt,
+            last_tx_id=key.last_tx_id,
+            filename=filename,
+            status="queued" if path is None else "done",
+            file_name=None if path is None else key.file_name,
+            finished_at=None if path is None else datetime.utcnow(),
+        )
+        if path is None:
+            # Своих воркеров будим после коммита, остальные процессы — оповещением
+            event.listen(session.sync_session, "after_commit", lambda _session: self.wake(), once=True)
+            notify.publish_on_commit(session.sync_session, "export_jobs")
+        return job
+
+    async def get(self, session, job_id: str) -> Optional[ExportJob]:
+        return await crud.get_export_job(session, job_id)
+
+    def file_path(self, job: ExportJob) -> str:
+        return self.cache.file_path(job.file_name)
+
+    def wake(self) -> None:
+        self._start_workers()
+        self._wakeup.set()
+
+    def _start_workers(self) -> None:
+        self._tasks = [t for t in self._tasks if not t.done()]
+        while len(self._tasks) < self.workers:
+            self._tasks.append(asyncio.create_task(self._worker()))
+
+    async def _claim(self) -> list[ExportJob]:
+        async with async_session_factory() as session, session.begin():
+            return await crud.claim_export_jobs(session, lease_seconds=_JOB_LEASE)
+
+    async def _finish(self, job_ids: list[str], **result) -> None:
+        async with async_session_factory() as session, session.begin():
+            await crud.finish_export_jobs(session, job_ids, **result)
+
+    async def _worker(self) -> None:
+        while True:
+            # Сброс до выборки: оповещение, пришедшее во время неё, не теряется
+            self._wakeup.clear()
+            try:
+                jobs = await self._claim()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Не удалось взять задание на выгрузку")
+                jobs = []
+            if not jobs:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), _POLL_INTERVAL)
+                except TimeoutError:
+                    pass
+                continue
+
+            key = _key_of(jobs[0])
+            job_ids = [job.id for job in jobs]
+            try:
+                async with async_session_factory() as session:
+                    await render(session, self.cache, key)
+            except asyncio.CancelledError:
+                raise
+            except ExecutorBusyError:
+                # Пул CPU-задач занят — задание ждёт в очереди, а не падает
+                async with async_session_factory() as session, session.begin():
+                    await crud.release_export_jobs(session, job_ids, _BUSY_RETRY_DELAY)
+            except ValueError as e:
+                await self._finish(job_ids, error=str(e))
+            except Exception:
+                logger.exception("Ошибка выгрузки ИП %d", key.ip_id)
+                await self._finish(job_ids, error="Не удалось сформировать выгрузку")
+            else:
+                await self._finish(job_ids, file_name=key.file_name)
+
+
+export_cache = ExportCache(
+    settings.export_cache_dir or os.path.join(tempfile.gettempdir(), "accounting-bot-exports"),
+    settings.export_cache_max_mb * 1024 * 1024,
+)
+export_jobs = ExportJobQueue(export_cache, settings.export_workers)
+
+
+async def invalidate_on_commit(session, *ip_ids) -> None:
+    """
+    Сбрасывает кэш выгрузок ИП в транзакции, изменившей их историю: поколение
+    растёт сразу (файл, собираемый сейчас, в кэш уже не попадёт), файлы
+    удаляются после коммита — здесь и, через оповещение, в других процессах.
+    """
+    ids = {ip_id for ip_id in ip_ids if ip_id is not None}
+    if not ids:
+        return
+    await crud.bump_export_generations(session, ids)
+
+    def _after_commit(_session) -> None:
+        for ip_id in ids:
+            export_cache.invalidate_ip(ip_id)
+
+    event.listen(session.sync_session, "after_commit", _after_commit, once=True)
+    for ip_id in ids:
+        notify.publish_on_commit(session.sync_session, f"export:{ip_id}")
+
+
+notify.subscribe("export", lambda arg: export_cache.invalidate_ip(int(arg)))
+if settings.run_mode != "bot":
+    # Процесс только бота выгрузки не собирает: файлы нужны процессам API
+    notify.subscribe("export_jobs", lambda _arg: export_jobs.wake())
@@ -8,6 +8,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 
 from backend.database import crud
 from backend.database.models import IP
+from backend.services.export_jobs import invalidate_on_commit
 
 logger = logging.getLogger(__name__)
 
@@ -33,5 +34,8 @@ async def update_ip_balances(
 ) -> IP:
     """Устанавливает балансы ИП (корректировка для админа)."""
     ip = await crud.set_ip_balances(session, ip_id, bank_balance, cash_balance)
+    # Новой операции нет, а running balance всей истории после правки другой —
+    # ключ выгрузки (последняя операция ИП) не меняется, кэш сбрасывается явно
+    await invalidate_on_commit(session, ip_id)
     logger.info("ИП id=%d: Р/С=%d ₽, нал=%d ₽", ip_id, bank_balance, cash_balance)
     return ip
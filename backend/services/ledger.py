@@ -0,0 +1,93 @@
+"""
+Проводки по операциям (ledger_entries).
+
+Правила проводок — models.TX_POSTINGS; здесь они разворачиваются в конкретные
+проводки (ИП, корзина, изменение). Балансы ИП меняются только проводками
+(services/transaction._post), а выгрузка считает изменения по тем же правилам.
+Отмена и правка операции не разбирают её тип: это проводки, обратные
+уже записанным, или их пересчёт на новую сумму.
+"""
+
+from __future__ import annotations
+
+from typing import Iterable, NamedTuple, Optional
+
+from backend.database.models import BUCKETS, TX_POSTINGS
+
+
+class Posting(NamedTuple):
+    ip_id: int
+    bucket: str
+    delta: int
+
+
+def _bucket(bucket: str, destination: Optional[str]) -> str:
+    if bucket != "dest":
+        return bucket
+    return destination if destination in BUCKETS else "cash"
+
+
+def postings(
+    op_type: str,
+    amount: int,
+    ip_id: int,
+    destination: Optional[str] = None,
+    counterparty_ip_id: Optional[int] = None,
+) -> list[Posting]:
+    """Проводки операции; без counterparty_ip_id — только по ИП самой операции."""
+    rules = TX_POSTINGS.get(op_type)
+    if rules is None:
+        raise ValueError(f"Неизвестный тип операции: {op_type}")
+    result = []
+    for side, bucket, sign in rules:
+        target = ip_id if side == "ip" else counterparty_ip_id
+        if target is not None:
+            result.append(Posting(target, _bucket(bucket, destination), sign * amount))
+    return result
+
+
+def own_delta(op_type: str, amount: int, destination: Optional[str] = None, *, side: str = "ip") -> tuple[int, int, int]:
+    """
+    (delta_cash, delta_bank, delta_debit) для ИП самой операции — строка его выписки;
+    side="counterparty" — для второго ИП (заёмщика в займе и погашении).
+    """
+    delta = [0, 0, 0]
+    for rule_side, bucket, sign in TX_POSTINGS.get(op_type, ()):
+        if rule_side == side:
+            delta[BUCKETS.index(_bucket(bucket, destination))] += sign * amount
+    return tuple(delta)
+
+
+def combine(entries: Iterable[Posting]) -> list[Posting]:
+    """Сворачивает проводки по (ИП, корзина); нулевые итоги отбрасываются."""
+    totals: dict[tuple[int, str], int] = {}
+    for ip_id, bucket, delta in entries:
+        totals[(ip_id, bucket)] = totals.get((ip_id, bucket), 0) + delta
+    return [Posting(ip_id, bucket, delta) for (ip_id, bucket), delta in totals.items() if delta]
+
+
+def reversal(entries: Iterable[Posting]) -> list[Posting]:
+    """Сторно: проводки, которые в сумме с entries дают ноль."""
+    return [p._replace(delta=-p.delta) for p in combine(entries)]
+
+
+def rescale(entries: Iterable[Posting], old_amount: int, new_amount: int) -> list[Posting]:
+    """
+    Проводки на разницу при смене суммы операции: каждое изменение,
+    которое операция вносит в корзину, равно ± её сумме.
+    """
+    diff = new_amount - old_amount
+    return [p._replace(delta=diff if p.delta > 0 else -diff) for p in combine(entries)]
+
+
+def net_by_ip(entries: Iterable[Posting]) -> dict[int, tuple[int, int, int]]:
+    """Суммарные (cash, bank, debit) по ИП — в порядке возрастания id (порядок блокировок)."""
+    totals: dict[int, list[int]] = {}
+    for ip_id, bucket, delta in entries:
+        totals.setdefault(ip_id, [0, 0, 0])[BUCKETS.index(bucket)] += delta
+    return {ip_id: tuple(totals[ip_id]) for ip_id in sorted(totals)}
+
+
+def rows(tx_id: Optional[int], entries: Iterable[Posting]) -> list[dict]:
+    """Строки для crud.create_ledger_entries."""
+    return [{"tx_id": tx_id, "ip_id": p.ip_id, "bucket": p.bucket, "delta": p.delta} for p in entries]
@@ -0,0 +1,165 @@
+"""
+Кэш чтения для экранов Mini App: список ИП с балансами, итоги балансов,
+активные долги между ИП.
+
+Эти данные меняются только при проведении операций, а читаются при каждом
+открытии приложения. Кэш сверяется с глобальной «версией бухгалтерии»:
+любой коммит, записавший что-то в ips, ip_debts или transactions, увеличивает
+версию (слушатели сессии ниже), и следующее чтение идёт в БД. Отдельно
+сбрасывать кэш в местах записи не нужно — ни в services, ни в crud.
+Другие процессы узнают о коммите через database/notify.
+
+В кэше лежат простые снимки (NamedTuple), а не ORM-объекты: они переживают
+сессию, в которой были загружены.
+"""
+
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Awaitable, Callable, NamedTuple, TypeVar
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from backend.database import crud, notify
+from backend.database.models import IP, IpDebt, LedgerEntry, Transaction
+
+T = TypeVar("T")
+
+_LEDGER_TABLES = frozenset({
+    IP.__tablename__, IpDebt.__tablename__, LedgerEntry.__tablename__, Transaction.__tablename__,
+})
+_DIRTY_KEY = "ledger_dirty"
+
+
+class IpSnapshot(NamedTuple):
+    id: int
+    name: str
+    bank_balance: int
+    debit_balance: int
+    cash_balance: int
+    initial_capital: int
+
+
+class DebtSnapshot(NamedTuple):
+    id: int
+    creditor_ip_id: int
+    creditor_ip_name: str
+    debtor_ip_id: int
+    debtor_ip_name: str
+    amount: int
+    created_at: datetime
+
+
+class BalanceTotals(NamedTuple):
+    bank: int
+    debit: int
+    cash: int
+
+
+class LedgerCache:
+    def __init__(self):
+        self.version = 0
+        self._entries: dict[str, tuple[int, object]] = {}
+
+    def bump(self) -> None:
+        self.version += 1
+
+    async def get(self, session, name: str, loader: Callable[[], Awaitable[T]]) -> T:
+        # Сессия, которая сама уже писала в бухгалтерию, должна видеть свои изменения
+        if session.info.get(_DIRTY_KEY):
+            return await loader()
+        entry = self._entries.get(name)
+        if entry is not None and entry[0] == self.version:
+            return entry[1]
+        # Версия запоминается до загрузки: если во время загрузки кто-то
+        # закоммитит изменения, запись сразу окажется устаревшей
+        version = self.version
+        value = await loader()
+        self._entries[name] = (version, value)
+        return value
+
+
+ledger_cache = LedgerCache()
+
+
+# ── Отслеживание записей ──────────────────────────────────────────────────────
+
+def _mark_dirty(session: Session) -> None:
+    if not session.info.get(_DIRTY_KEY):
+        session.info[_DIRTY_KEY] = True
+        # Остальным процессам (RUN_MODE=api/bot) — через NOTIFY
+        notify.publish_on_commit(session, "ledger")
+
+
+@event.listens_for(Session, "after_flush")
+def _after_flush(session, flush_context) -> None:
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if getattr(obj, "__tablename__", None) in _LEDGER_TABLES:
+            _mark_dirty(session)
+            return
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _on_execute(orm_execute_state) -> None:
+    # Core-запросы через session.execute (условные UPDATE балансов, массовые вставки)
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    table = getattr(orm_execute_state.statement, "table", None)
+    if getattr(table, "name", None) in _LEDGER_TABLES:
+        _mark_dirty(orm_execute_state.session)
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session) -> None:
+    if session.info.pop(_DIRTY_KEY, False):
+        ledger_cache.bump()
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session) -> None:
+    session.info.pop(_DIRTY_KEY, None)
+
+
+notify.subscribe("ledger", lambda _arg: ledger_cache.bump())
+notify.subscribe("resync", lambda _arg: ledger_cache.bump())
+
+
+# ── Чтение ────────────────────────────────────────────────────────────────────
+
+async def _load_ips(session) -> list[IpSnapshot]:
+    return [
+        IpSnapshot(ip.id, ip.name, ip.bank_balance, ip.debit_balance, ip.cash_balance, ip.initial_capital)
+        for ip in await crud.get_all_ips(session)
+    ]
+
+
+async def _load_debts(session) -> list[DebtSnapshot]:
+    return [
+        DebtSnapshot(
+            d.id, d.creditor_ip_id, d.creditor_ip.name, d.debtor_ip_id, d.debtor_ip.name, d.amount, d.created_at
+        )
+        for d in await crud.get_active_ip_debts(session)
+    ]
+
+
+async def get_ips(session) -> list[IpSnapshot]:
+    """Все ИП с балансами."""
+    return await ledger_cache.get(session, "ips", lambda: _load_ips(session))
+
+
+async def get_balance_totals(session) -> BalanceTotals:
+    """Суммарные балансы по всем ИП."""
+    async def _load() -> BalanceTotals:
+        ips = await get_ips(session)
+        return BalanceTotals(
+            bank=sum(ip.bank_balance for ip in ips),
+            debit=sum(ip.debit_balance for ip in ips),
+            cash=sum(ip.cash_balance for ip in ips),
+        )
+    return await ledger_cache.get(session, "balance_totals", _load)
+
+
+async def get_active_debts(session) -> list[DebtSnapshot]:
+    """Непогашенные долги между ИП, новые первыми."""
+    return await ledger_cache.get(session, "active_debts", lambda: _load_debts(session))
@@ -0,0 +1,191 @@
+"""
+Сверка балансов ИП с проводками.
+
+Источник истины — ledger_entries (только добавляются), балансы в ips — кэш.
+Сверка держит суммы проводок по корзинам ИП (ledger_totals) и отметку —
+id последней учтённой проводки. Каждый прогон досчитывает одним GROUP BY
+только проводки после отметки и сравнивает итоги с ips: расхождение значит,
+что баланс меняли в обход проводок. Ручные корректировки балансов
+(проводки без операции, кроме начальных остатков) после отметки тоже
+попадают в отчёт: расхождения они не дают, но администратор их видит.
+
+Досчёт держит ledger_entries в SHARE-блокировке (см. crud.lock_ledger), но
+читает только новые проводки. Полная сверка (full=True) одним запросом, без
+блокировки, сравнивает балансы не только со всеми проводками (их пишет тот же
+_post, что и балансы), но и с пересчётом по самим операциям: начальные
+остатки и корректировки + неотменённые транзакции по TX_POSTINGS. Остаток
+переноса истории (проводки backfill без операции) у ИП, заведённых до
+проводок, должен равняться начальному капиталу — иначе в нём спрятано
+старое расхождение, и оно попадает в отчёт. Итоги с отметкой полная
+сверка не меняет.
+
+Ночной прогон — в RECONCILE_TIME, по запросу — POST /api/admin/reconcile.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+from typing import NamedTuple, Optional
+
+from backend.config import settings
+from backend.database import crud
+from backend.database.models import BUCKETS
+from backend.database.session import async_session_factory
+from backend.services.scheduler import run_daily
+
+logger = logging.getLogger(__name__)
+
+
+class BalanceMismatch(NamedTuple):
+    ip_id: int
+    ip_name: str
+    bucket: str    # корзина; total — все корзины вместе (check=capital)
+    stored: int    # баланс в ips; для capital — начальные остатки по проводкам
+    expected: int  # сумма проводок / пересчёт по операциям / начальный капитал
+    check: str = "ledger"  # ledger, operations или capital (только полная сверка)
+
+
+# Что с чем сравнивалось — для журнала
+_CHECKS = {
+    "ledger": "в ips %d, по проводкам %d",
+    "operations": "в ips %d, по операциям %d",
+    "capital": "начальные остатки %d, начальный капитал %d",
+}
+
+
+class BalanceAdjustment(NamedTuple):
+    """Ручная корректировка баланса — проводка без операции."""
+    entry_id: int
+    ip_id: int
+    ip_name: str
+    bucket: str
+    delta: int
+    created_at: str
+
+
+class ReconciliationReport(NamedTuple):
+    run_id: int
+    full: bool
+    last_entry_id: int
+    entries_count: int
+    ips_checked: int
+    mismatches: list[BalanceMismatch]
+    adjustments: list[BalanceAdjustment]
+
+
+async def reconcile(session, *, full: bool = False) -> ReconciliationReport:
+    """Сверяет балансы ИП с проводками (в транзакции session) и записывает прогон."""
+    if full:
+        return await _reconcile_full(session)
+    await crud.lock_ledger(session)
+    last = await crud.get_last_reconciliation(session, incremental=True)
+    if last is None:
+        await crud.clear_ledger_totals(session)
+    after_id = last.last_entry_id if last is not None else 0
+
+    sums, entries_count, last_entry_id = await crud.get_ledger_sums_after(session, after_id)
+    await crud.add_to_ledger_totals(session, sums)
+    totals = await crud.get_ledger_totals(session)
+    adjustments = [
+        BalanceAdjustment(entry.id, entry.ip_id, ip_name, entry.bucket, entry.delta, entry.created_at.isoformat())
+        for entry, ip_name in await crud.get_unlinked_entries_after(session, after_id)
+    ]
+
+    ips = await crud.get_all_ips(session)
+    mismatches = []
+    for ip in ips:
+        expected = totals.get(ip.id, {})
+        for bucket in BUCKETS:
+            stored = getattr(ip, f"{bucket}_balance")
+            if stored != expected.get(bucket, 0):
+                mismatches.append(BalanceMismatch(ip.id, ip.name, bucket, stored, expected.get(bucket, 0)))
+
+    return await _save(session, False, last_entry_id, entries_count, len(ips), mismatches, adjustments)
+
+
+async def _reconcile_full(session) -> ReconciliationReport:
+    mismatches, entries_count = [], 0
+    rows = await crud.compare_ips_with_ledger(session)
+    for row in rows:
+        entries_count += row.entries
+        for bucket in BUCKETS:
+            stored, expected = getattr(row, f"{bucket}_balance"), getattr(row, bucket)
+            if stored != expected:
+                mismatches.append(BalanceMismatch(row.id, row.name, bucket, stored, expected))
+            # Независимо от проводок операций: что было до них и сами операции
+            recomputed = sum(getattr(row, f"{bucket}_{part}") for part in ("opening", "manual", "residual", "ops"))
+            if stored != recomputed:
+                mismatches.append(BalanceMismatch(row.id, row.name, bucket, stored, recomputed, "operations"))
+        # Начальные остатки: проводками (новые ИП) или остатком переноса истории (старые)
+        opening = sum(getattr(row, f"{bucket}_opening") + getattr(row, f"{bucket}_residual") for bucket in BUCKETS)
+        if opening != row.initial_capital:
+            mismatches.append(BalanceMismatch(row.id, row.name, "total", opening, row.initial_capital, "capital"))
+    return await _save(session, True, 0, entries_count, len(rows), mismatches, [])
+
+
+async def _save(session, full, last_entry_id, entries_count, ips_checked, mismatches, adjustments) -> ReconciliationReport:
+    run = await crud.create_reconciliation_run(
+        session,
+        last_entry_id=last_entry_id,
+        entries_count=entries_count,
+        mismatch_count=len(mismatches),
+        report=json.dumps(
+            {"mismatches": [m._asdict() for m in mismatches], "adjustments": [a._asdict() for a in adjustments]},
+            ensure_ascii=False,
+        ),
+        full=full,
+    )
+    for m in mismatches:
+        logger.warning(
+            "Расхождение баланса ИП «%s» (%s): " + _CHECKS[m.check],
+            m.ip_name, m.bucket, m.stored, m.expected,
+        )
+    for a in adjustments:
+        logger.warning("Ручная корректировка баланса ИП «%s» (%s): %+d", a.ip_name, a.bucket, a.delta)
+    return ReconciliationReport(run.id, full, last_entry_id, entries_count, ips_checked, mismatches, adjustments)
+
+
+def report_to_dict(report: ReconciliationReport) -> dict:
+    return {
+        "run_id": report.run_id,
+        "full": report.full,
+        "last_entry_id": report.last_entry_id,
+        "entries_count": report.entries_count,
+        "ips_checked": report.ips_checked,
+        "mismatches": [m._asdict() for m in report.mismatches],
+        "adjustments": [a._asdict() for a in report.adjustments],
+    }
+
+
+def run_to_dict(run) -> Optional[dict]:
+    """Сохранённый результат прогона (GET /api/admin/reconcile)."""
+    if run is None:
+        return None
+    report = json.loads(run.report or "{}")
+    if isinstance(report, list):
+        # Прогоны, записанные до появления корректировок в отчёте
+        report = {"mismatches": report}
+    return {
+        "run_id": run.id,
+        "created_at": run.created_at.isoformat(),
+        "full": run.is_full,
+        "last_entry_id": run.last_entry_id,
+        "entries_count": run.entries_count,
+        "mismatches": report.get("mismatches", []),
+        "adjustments": report.get("adjustments", []),
+    }
+
+
+async def _nightly_job() -> None:
+    async with async_session_factory() as session, session.begin():
+        report = await reconcile(session)
+    logger.info(
+        "Сверка балансов: проводок %d, ИП %d, расхождений %d, корректировок %d",
+        report.entries_count, report.ips_checked, len(report.mismatches), len(report.adjustments),
+    )
+
+
+async def run_reconcile_scheduler() -> None:
+    """Раз в сутки в RECONCILE_TIME (UTC) сверяет балансы."""
+    await run_daily(settings.reconcile_time, _nightly_job, "сверка балансов")
@@ -4,12 +4,13 @@
 
 from __future__ import annotations
 
-from datetime import datetime, timedelta, timezone
+from datetime import date, datetime, time, timedelta, timezone
 
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from backend.database import crud
 from backend.database.models import EXPENSE_TYPES, INCOME_TYPES
+from backend.services import read_cache
 
 
 PERIOD_LABELS = {
@@ -31,18 +32,94 @@ def _period_start(period: str) -> datetime | None:
     return None
 
 
+def _naive_utc(dt: datetime | None) -> datetime | None:
+    """created_at хранится без часового пояса (UTC)."""
+    if dt is not None and dt.tzinfo is not None:
+        return dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+async def get_ips_at(session: AsyncSession, at: datetime) -> list[read_cache.IpSnapshot]:
+    """
+    ИП с балансами на момент at (по проводкам); ИП, заведённые позже, не входят.
+    Раньше переноса старой истории в проводки балансы не восстановить — ValueError.
+    """
+    at = _naive_utc(at)
+    start = await crud.get_ledger_start(session)
+    if start is not None and at < start:
+        raise ValueError(f"Балансы на момент доступны с {start:%d.%m.%Y %H:%M:%S} UTC")
+    return [
+        read_cache.IpSnapshot(row.id, row.name, row.bank_balance, row.debit_balance, row.cash_balance, row.initial_capital)
+        for row in await crud.get_ip_balances_at(session, at)
+    ]
+
+
+def _ceil_day(dt: datetime) -> date:
+    return dt.date() if dt.time() == time.min else dt.date() + timedelta(days=1)
+
+
+async def get_type_totals(
+    session: AsyncSession,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    *,
+    ip_id: int | None = None,
+    user_id: int | None = None,
+    include_cancelled: bool = False,
+) -> dict[str, tuple[int, int]]:
+    """
+    Суммы и количество операций по типам за [since, until): {type: (sum, count)}.
+    Считается в SQL (GROUP BY), без загрузки транзакций. Полные дни берутся
+    из дневных агрегатов, неполные крайние дни — из transactions.
+    Отменённые операции в агрегатах не хранятся, поэтому с include_cancelled
+    весь диапазон считается по transactions.
+    """
+    since, until = _naive_utc(since), _naive_utc(until)
+    filters = {"ip_id": ip_id, "user_id": user_id}
+    if include_cancelled:
+        return await crud.get_totals_by_type(session, since=since, until=until, include_cancelled=True, **filters)
+
+    day_from = _ceil_day(since) if since is not None else None
+    day_to = until.date() if until is not None else None
+    if day_from is not None and day_to is not None and day_from >= day_to:
+        # Диапазон короче суток — агрегаты не помогут
+        return await crud.get_totals_by_type(session, since=since, until=until, **filters)
+
+    parts = [await crud.get_daily_totals_by_type(session, day_from=day_from, day_to=day_to, **filters)]
+    if since is not None and since.time() != time.min:
+        parts.append(await crud.get_totals_by_type(
+            session, since=since, until=datetime.combine(day_from, time.min), **filters
+        ))
+    if until is not None and until.time() != time.min:
+        parts.append(await crud.get_totals_by_type(
+            session, since=datetime.combine(day_to, time.min), until=until, **filters
+        ))
+
+    totals: dict[str, tuple[int, int]] = {}
+    for part in parts:
+        for tx_type, (amount, count) in part.items():
+            prev_amount, prev_count = totals.get(tx_type, (0, 0))
+            totals[tx_type] = (prev_amount + amount, prev_count + count)
+    return totals
+
+
+def sum_types(totals: dict[str, tuple[int, int]], types) -> int:
+    """Сумма по группе типов из результата get_type_totals."""
+    return sum(totals[t][0] for t in types if t in totals)
+
+
 async def get_personal_report(
     session: AsyncSession, user_id: int, period: str
 ) -> str:
     since = _period_start(period)
     label = PERIOD_LABELS.get(period, period)
 
-    txs = await crud.get_transactions(session, user_id=user_id, since=since)
-    income = sum(t.amount for t in txs if t.type in INCOME_TYPES)
-    expense = sum(t.amount for t in txs if t.type in EXPENSE_TYPES)
+    totals = await get_type_totals(session, since, user_id=user_id)
+    income = sum_types(totals, INCOME_TYPES)
+    expense = sum_types(totals, EXPENSE_TYPES)
 
-    ips = await crud.get_all_ips(session)
-    ip_debts = await crud.get_active_ip_debts(session)
+    ips = await read_cache.get_ips(session)
+    ip_debts = await read_cache.get_active_debts(session)
 
     def fmt(n: int) -> str:
         return f"{n:,}".replace(",", "\u202f") + " \u20bd"
@@ -70,7 +147,7 @@ async def get_personal_report(
     if ip_debts:
         lines += ["", "🔴 <b>Долги между ИП:</b>"]
         for d in ip_debts:
-            lines.append("  \u2022 " + d.debtor_ip.name + " \u2192 " + d.creditor_ip.name + ": " + fmt(d.amount))
+            lines.append("  \u2022 " + d.debtor_ip_name + " \u2192 " + d.creditor_ip_name + ": " + fmt(d.amount))
     else:
         lines += ["", "✅ Долгов между ИП нет"]
 
@@ -0,0 +1,97 @@
+"""
+Running balance по колонкам: изменения и балансы ИП после каждой операции.
+
+Операция сводится к коду вида (тип, корзина назначения, сторона) — строке
+таблицы знаков SIGNS: (cash, bank, debit) ∈ {-1, 0, 1}, построенной из тех же
+правил проводок (models.TX_POSTINGS), что и балансы. Сторона — ИП операции
+или второе ИП (заёмщик в займе и погашении). Изменения по операциям —
+знаки × сумма, балансы — накопленная сумма изменений от начальных балансов.
+
+Считается пачкой: с NumPy — cumsum по массивам, без него — array('q')
+и itertools.accumulate. Результат — обычные списки int, их можно пиклить и писать в книгу.
+"""
+
+from __future__ import annotations
+
+from array import array
+from itertools import accumulate
+from typing import NamedTuple, Optional, Sequence
+
+from backend.database.models import BUCKETS, TX_POSTINGS
+from backend.services.ledger import own_delta
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover — без NumPy работает запасной вариант
+    np = None
+
+
+# Код 0 — неизвестный тип операции: балансы не меняет (как own_delta)
+_KINDS: list[tuple[Optional[str], Optional[str], bool]] = [(None, None, False)]
+_KINDS += [
+    (tx_type, bucket, counterparty)
+    for tx_type in TX_POSTINGS for bucket in BUCKETS for counterparty in (False, True)
+]
+_KIND_CODES = {kind: code for code, kind in enumerate(_KINDS)}
+
+# Строка кода — изменения (cash, bank, debit) на единицу суммы
+SIGNS: list[tuple[int, int, int]] = [(0, 0, 0)] + [
+    own_delta(t, 1, b, side="counterparty" if c else "ip") for t, b, c in _KINDS[1:]
+]
+_SIGN_COLUMNS = [array("q", column) for column in zip(*SIGNS)]
+_SIGN_MATRIX = np.array(SIGNS, dtype=np.int64) if np is not None else None
+
+
+def kind_code(tx_type: str, destination: Optional[str] = None, counterparty: bool = False) -> int:
+    """
+    Код операции для колонки codes; назначение вне BUCKETS — наличные, как в проводках.
+    counterparty=True — строка выписки второго ИП операции.
+    """
+    bucket = destination if destination in BUCKETS else "cash"
+    return _KIND_CODES.get((tx_type, bucket, counterparty), 0)
+
+
+class RunningBalances(NamedTuple):
+    """Колонки по операциям: изменения и балансы после каждой."""
+    delta_cash: list[int]
+    delta_bank: list[int]
+    delta_debit: list[int]
+    cash: list[int]
+    bank: list[int]
+    debit: list[int]
+
+
+def compute(opening: tuple[int, int, int], codes: Sequence[int], amounts: Sequence[int]) -> RunningBalances:
+    """Изменения и балансы для операций по порядку, от балансов opening."""
+    if np is not None:
+        return _compute_numpy(opening, codes, amounts)
+    return _compute_array(opening, codes, amounts)
+
+
+def _deltas_numpy(codes, amounts):
+    """Матрица изменений N×3: строка знаков по коду × сумма."""
+    return _SIGN_MATRIX[np.asarray(codes, dtype=np.intp)] * np.asarray(amounts, dtype=np.int64)[:, None]
+
+
+def _compute_numpy(opening, codes, amounts) -> RunningBalances:
+    deltas = _deltas_numpy(codes, amounts)
+    balances = np.cumsum(deltas, axis=0) + np.asarray(opening, dtype=np.int64)
+    return RunningBalances(*deltas.T.tolist(), *balances.T.tolist())
+
+
+def _compute_array(opening, codes, amounts) -> RunningBalances:
+    columns = [
+        array("q", [signs[code] * amount for code, amount in zip(codes, amounts)])
+        for signs in _SIGN_COLUMNS
+    ]
+    balances = [array("q", accumulate(deltas, initial=start))[1:] for start, deltas in zip(opening, columns)]
+    return RunningBalances(*(column.tolist() for column in columns + balances))
+
+
+def net_delta(codes: Sequence[int], amounts: Sequence[int]) -> tuple[int, int, int]:
+    """Суммарное изменение (cash, bank, debit) по операциям (или по агрегатам сумм)."""
+    if np is not None and len(codes):
+        return tuple(int(v) for v in _deltas_numpy(codes, amounts).sum(axis=0))
+    return tuple(
+        sum(signs[code] * amount for code, amount in zip(codes, amounts)) for signs in _SIGN_COLUMNS
+    )
@@ -0,0 +1,93 @@
+"""
+Замер running balance выгрузки.
+
+Запуск: python -m backend.services.running_balance_bench [число операций, по умолчанию 1000000]
+
+Операции синтетические (БД не нужна). Печатается лучшее из трёх время:
+- compute() — только колонки изменений и балансов (NumPy и запасной array);
+- по строке — own_delta и сложение кортежей на каждую операцию, для сравнения;
+- выгрузка — _RunningBalance.steps порциями курсора (_BALANCE_CHUNK):
+  коды операций, compute() и сборка ExportRow, то есть вся CPU-часть
+  iter_rows / iter_statement без чтения из БД и записи файла.
+"""
+
+from __future__ import annotations
+
+import sys
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from backend.database.models import TxType
+from backend.services import running_balance
+from backend.services.export import _BALANCE_CHUNK, _RunningBalance
+from backend.services.ledger import own_delta
+
+_OPS = [
+    (TxType.PRIHOD_MES, "cash"),
+    (TxType.PRIHOD_MES, "bank"),
+    (TxType.ZAKUP, None),
+    (TxType.SNYAT_RS, None),
+    (TxType.SNYAT_DEBIT, None),
+    (TxType.VNESTI_RS, None),
+    (TxType.ODOLZHIT, None),
+    (TxType.POGASIT, None),
+]
+_OPENING = (10**9, 10**9, 10**9)
+_REPEATS = 3
+
+
+def _transactions(count: int) -> list:
+    start = datetime(2024, 1, 1)
+    user = SimpleNamespace(display_name="@bench")
+    return [
+        SimpleNamespace(
+            id=i + 1, created_at=start + timedelta(seconds=i), type=_OPS[i % len(_OPS)][0],
+            destination=_OPS[i % len(_OPS)][1], amount=1000 + i % 5000, user=user, comment=None,
+            # Каждая пятая — займ / погашение, где ИП выписки — заёмщик
+            ip_id=2 if i % 5 == 0 else 1,
+        )
+        for i in range(count)
+    ]
+
+
+def _best(fn) -> float:
+    best = float("inf")
+    for _ in range(_REPEATS):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def _per_row(transactions) -> None:
+    cash, bank, debit = _OPENING
+    for tx in transactions:
+        side = "ip" if tx.ip_id == 1 else "counterparty"
+        dc, db, dd = own_delta(tx.type, tx.amount, tx.destination, side=side)
+        cash, bank, debit = cash + dc, bank + db, debit + dd
+
+
+def _export(transactions) -> None:
+    balance = _RunningBalance(_OPENING, 1, "ИП Замер")
+    for i in range(0, len(transactions), _BALANCE_CHUNK):
+        balance.steps(transactions[i:i + _BALANCE_CHUNK])
+
+
+def main(count: int) -> None:
+    transactions = _transactions(count)
+    codes = [running_balance.kind_code(tx.type, tx.destination, tx.ip_id != 1) for tx in transactions]
+    amounts = [tx.amount for tx in transactions]
+    print(f"Операций: {count}")
+
+    if running_balance.np is not None:
+        seconds = _best(lambda: running_balance._compute_numpy(_OPENING, codes, amounts))
+        print(f"{'compute (NumPy)':24s} {seconds:6.2f} с")
+    seconds = _best(lambda: running_balance._compute_array(_OPENING, codes, amounts))
+    print(f"{'compute (array)':24s} {seconds:6.2f} с")
+    print(f"{'по строке (own_delta)':24s} {_best(lambda: _per_row(transactions)):6.2f} с")
+    print(f"{'выгрузка (steps)':24s} {_best(lambda: _export(transactions)):6.2f} с")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
@@ -0,0 +1,44 @@
+"""
+Ежедневные фоновые задачи: рассылка сводки, сверка балансов.
+
+Время задаётся строкой ЧЧ:ММ по UTC (пустая строка — задача отключена).
+Задачи запускаются только в процессе бота (main.run_bot), чтобы при
+нескольких процессах API не выполнить их несколько раз.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+
+def _seconds_until(hour: int, minute: int, now: datetime) -> float:
+    target = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if target <= now:
+        target += timedelta(days=1)
+    return (target - now).total_seconds()
+
+
+async def run_daily(at: str, job: Callable[[], Awaitable[None]], name: str) -> None:
+    """Раз в сутки в at (ЧЧ:ММ, UTC) выполняет job; ошибки пишутся в лог."""
+    if not at:
+        return
+    try:
+        hour, minute = (int(part) for part in at.split(":"))
+        datetime(2000, 1, 1, hour, minute)
+    except ValueError:
+        logger.error("Неверное время %r для задачи «%s», ожидается ЧЧ:ММ", at, name)
+        return
+
+    while True:
+        await asyncio.sleep(_seconds_until(hour, minute, datetime.utcnow()))
+        try:
+            await job()
+        except Exception:
+            logger.exception("Ошибка задачи «%s»", name)
+        # Чтобы не выполнить задачу повторно в ту же минуту
+        await asyncio.sleep(60)
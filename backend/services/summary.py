@@ -0,0 +1,92 @@
+"""
+Мини-сводка балансов ИП и долгов для Telegram.
+
+Текст сводки собирается один раз и ставится в очередь исходящих сообщений
+(bot/outbox.py) — по запросу пользователя или ежедневно всем подписчикам
+(users.digest_enabled, время — DIGEST_TIME).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+
+from backend.config import settings
+from backend.database import crud
+from backend.database.session import async_session_factory
+from backend.services import read_cache
+from backend.services.executor import ExecutorBusyError, cpu_executor
+from backend.services.scheduler import run_daily
+
+logger = logging.getLogger(__name__)
+
+# Если пул CPU занят, рассылка повторяется через эту паузу
+_BUSY_RETRY_DELAY = 30.0
+
+
+def _fmt(n: int) -> str:
+    return f"{n:,}".replace(",", "\u202f") + "\u00a0\u20bd"
+
+
+def _build_summary_text(ips, debts) -> str:
+    """
+    ips   — [(name, bank, debit, cash)], debts — [(debtor, creditor, amount)]:
+    только простые данные, чтобы функцию можно было выполнить в пуле процессов.
+    """
+    lines = ["📊 <b>Сводка балансов</b>", ""]
+    if ips:
+        for name, bank, debit, cash in ips:
+            lines.append(f"🏢 <b>{name}</b>")
+            lines.append(f"  Р/С:    {_fmt(bank)}")
+            lines.append(f"  Дебет:  {_fmt(debit)}")
+            lines.append(f"  Нал:    {_fmt(cash)}")
+            lines.append("")
+    else:
+        lines += ["Нет ИП", ""]
+
+    if debts:
+        lines.append("🔴 <b>Долги между ИП:</b>")
+        for debtor, creditor, amount in debts:
+            lines.append(f"  • {debtor} → {creditor}: {_fmt(amount)}")
+    else:
+        lines.append("✅ Долгов между ИП нет")
+
+    return "\n".join(lines)
+
+
+async def render_summary(session) -> str:
+    """Текст сводки. ExecutorBusyError — если пул CPU перегружен."""
+    ips = await read_cache.get_ips(session)
+    debts = await read_cache.get_active_debts(session)
+    return await cpu_executor.run(
+        _build_summary_text,
+        [(ip.name, ip.bank_balance, ip.debit_balance, ip.cash_balance) for ip in ips],
+        [(d.debtor_ip_name, d.creditor_ip_name, d.amount) for d in debts],
+    )
+
+
+async def send_digest() -> int:
+    """Ставит сводку в очередь всем подписчикам; возвращает число получателей."""
+    async with async_session_factory() as session, session.begin():
+        chat_ids = await crud.get_digest_subscribers(session)
+        if not chat_ids:
+            return 0
+        text = await render_summary(session)
+        await crud.enqueue_messages(session, chat_ids, text)
+    return len(chat_ids)
+
+
+async def _digest_job() -> None:
+    while True:
+        try:
+            count = await send_digest()
+        except ExecutorBusyError:
+            await asyncio.sleep(_BUSY_RETRY_DELAY)
+            continue
+        logger.info("Ежедневная сводка поставлена в очередь: %d получателей", count)
+        return
+
+
+async def run_digest_scheduler() -> None:
+    """Раз в сутки в DIGEST_TIME (UTC) рассылает сводку подписчикам."""
+    await run_daily(settings.digest_time, _digest_job, "ежедневная сводка")
@@ -2,7 +2,9 @@ import logging
 from datetime import datetime
 from sqlalchemy.ext.asyncio import AsyncSession
 from backend.database import crud
-from backend.database.models import Transaction, TxType
+from backend.database.models import IP, Transaction, TxType, User
+from backend.services import ledger
+from backend.services.export_jobs import invalidate_on_commit
 
 logger = logging.getLogger(__name__)
 
@@ -11,144 +13,357 @@ class InsufficientFundsError(ValueError):
     pass
 
 
+# Операции над одним ИП (без второго ИП и долга)
+_SINGLE_IP_TYPES: frozenset[str] = frozenset({
+    TxType.ZAKUP,
+    TxType.STORONNIE,
+    TxType.PRIHOD_MES,
+    TxType.PRIHOD_FAST,
+    TxType.PRIHOD_STO,
+    TxType.SNYAT_RS,
+    TxType.SNYAT_DEBIT,
+    TxType.VNESTI_RS,
+})
+
+# Операции, связанные с долгом между ИП (Transaction.debt_id)
+_DEBT_TYPES: frozenset[str] = frozenset({TxType.ODOLZHIT, TxType.POGASIT})
+
+_INSUFFICIENT_MESSAGES = {
+    "cash":  "Недостаточно наличных у ИП.",
+    "bank":  "Недостаточно средств на Р/С.",
+    "debit": "Недостаточно средств на Дебете.",
+}
+
+
+def _check_funds(balances, delta, messages=_INSUFFICIENT_MESSAGES) -> None:
+    """Бросает InsufficientFundsError, если delta уводит какую-либо корзину в минус."""
+    for bucket, change, balance in zip(("cash", "bank", "debit"), delta, balances):
+        if change < 0 and balance < -change:
+            raise InsufficientFundsError(f"{messages[bucket]}\nОстаток: {balance:,} ₽")
+
+
+async def _post(session, tx: Transaction, postings, *, check_funds=True, not_found=None, messages=None):
+    """
+    Единственная точка изменения балансов ИП одной операции (пачки идут
+    через тот же BalanceUnitOfWork): участники блокируются и загружаются
+    одним SELECT ... FOR UPDATE, остатки проверяются в памяти, балансы
+    пишутся одним flush, проводки — в ledger_entries.
+    Новая операция (tx без id) добавляется в сессию после проверки остатков.
+    check_funds=False — без проверки остатка (сторно при отмене и правке).
+    not_found / messages — {ip_id: ...} для ошибок по конкретному ИП.
+    Возвращает суммарные изменения по ИП.
+    """
+    net = ledger.net_by_ip(postings)
+    async with BalanceUnitOfWork.of(session) as uow:
+        await uow.load(*net)
+        for ip_id, delta in net.items():
+            if ip_id not in uow:
+                raise ValueError((not_found or {}).get(ip_id, "ИП не найдено"))
+            uow.apply(
+                ip_id, delta,
+                check_funds=check_funds,
+                messages=(messages or {}).get(ip_id, _INSUFFICIENT_MESSAGES),
+            )
+        await uow.flush()
+    if tx.id is None:
+        session.add(tx)
+        await session.flush()
+    await crud.create_ledger_entries(session, ledger.rows(tx.id, postings))
+    return net
+
+
+class BalanceUnitOfWork:
+    """
+    Балансы ИП в рамках одной операции (unit of work).
+    Каждое ИП загружается один раз — одним SELECT ... FOR UPDATE на всех
+    участников, с populate_existing, — изменения копятся в памяти и пишутся
+    одним flush. Экземпляр живёт в session.info, пока открыт
+    async with BalanceUnitOfWork.of(session), поэтому все шаги одной операции
+    видят одни и те же (заблокированные) строки. Выход из блока — в том числе
+    по ошибке — отвязывает его от сессии: следующая операция начнёт с чистого.
+    """
+
+    _KEY = "balance_uow"
+
+    def __init__(self, session: AsyncSession):
+        self.session = session
+        self._ips: dict[int, IP] = {}
+        self._balances: dict[int, list[int]] = {}
+
+    @classmethod
+    def of(cls, session: AsyncSession) -> "BalanceUnitOfWork":
+        uow = session.info.get(cls._KEY)
+        if uow is None:
+            uow = session.info[cls._KEY] = cls(session)
+        return uow
+
+    async def __aenter__(self) -> "BalanceUnitOfWork":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self.session.info.pop(self._KEY, None)
+
+    async def load(self, *ip_ids: int | None) -> None:
+        """Блокирует и загружает ещё не загруженные ИП (None пропускаются)."""
+        missing = {i for i in ip_ids if i is not None and i not in self._ips}
+        if not missing:
+            return
+        for ip_id, ip in (await crud.lock_ips(self.session, missing)).items():
+            self._ips[ip_id] = ip
+            self._balances[ip_id] = [ip.cash_balance, ip.bank_balance, ip.debit_balance]
+
+    def __contains__(self, ip_id) -> bool:
+        return ip_id in self._ips
+
+    def balances(self, ip_id: int) -> tuple[int, int, int]:
+        """Текущие (cash, bank, debit) с учётом ещё не записанных изменений."""
+        return tuple(self._balances[ip_id])
+
+    def apply(self, ip_id: int, delta, *, check_funds: bool = False, messages=_INSUFFICIENT_MESSAGES) -> None:
+        if ip_id not in self._ips:
+            raise ValueError(f"ИП {ip_id} не найдено")
+        current = self._balances[ip_id]
+        if check_funds:
+            _check_funds(current, delta, messages)
+        for bucket, change in enumerate(delta):
+            current[bucket] += change
+
+    async def flush(self) -> None:
+        """Переносит балансы в ORM-объекты и пишет изменённые ИП одним flush."""
+        for ip_id, (cash, bank, debit) in self._balances.items():
+            ip = self._ips[ip_id]
+            ip.cash_balance, ip.bank_balance, ip.debit_balance = cash, bank, debit
+        await self.session.flush()
+
+
+async def _rollup(session, txs, sign=1, amount=None) -> None:
+    """
+    Переносит транзакции в дневные агрегаты.
+    sign=-1 — вычесть (отмена); amount — разница суммы при редактировании (count не меняется).
+    """
+    await crud.add_to_daily_aggregates(session, [
+        {
+            "day": tx.created_at.date(),
+            "ip_id": tx.ip_id,
+            "user_id": tx.user_id,
+            "type": tx.type,
+            "destination": tx.destination,
+            "amount": sign * tx.amount if amount is None else amount,
+            "count": sign if amount is None else 0,
+        }
+        for tx in txs
+    ])
+
+
+async def _record_posted(session, tx: Transaction, net) -> None:
+    """
+    Учитывает новую транзакцию в дневных агрегатах и контрольных точках
+    балансов — всех ИП из её проводок (net от _post), включая заёмщика.
+    """
+    await _rollup(session, [tx])
+    for ip_id in net:
+        await crud.create_day_checkpoint(session, ip_id, tx.id, tx.created_at)
+
+
 async def process_operation(session, user_id, op_type, amount, ip_id=None, target_ip_id=None, comment=None, destination=None):
-    user = await crud.get_user(session, user_id)
+    # session.get берёт пользователя из identity map, если он уже загружен в этой сессии
+    user = await session.get(User, user_id)
     if user is None:
         raise ValueError(f"Пользователь {user_id} не найден")
 
-    if op_type == TxType.ZAKUP:
+    tx = Transaction(user_id=user_id, ip_id=ip_id, type=op_type, amount=amount, comment=comment, destination=destination)
+    if op_type in _SINGLE_IP_TYPES:
         if ip_id is None:
             raise ValueError("Не указано ИП")
-        ip = await crud.get_ip(session, ip_id)
-        if ip is None:
-            raise ValueError("ИП не найдено")
-        if ip.cash_balance < amount:
-            raise InsufficientFundsError(f"Недостаточно наличных у ИП.\nОстаток: {ip.cash_balance:,} ₽")
-        await crud.update_ip_cash(session, ip_id, -amount)
+        net = await _post(session, tx, ledger.postings(op_type, amount, ip_id, destination))
 
-    elif op_type == TxType.STORONNIE:
+    elif op_type == TxType.ODOLZHIT:
         if ip_id is None:
-            raise ValueError("Не указано ИП")
-        ip = await crud.get_ip(session, ip_id)
-        if ip is None:
-            raise ValueError("ИП не найдено")
-        if ip.cash_balance < amount:
-            raise InsufficientFundsError(f"Недостаточно наличных у ИП.\nОстаток: {ip.cash_balance:,} ₽")
-        await crud.update_ip_cash(session, ip_id, -amount)
+            raise ValueError("Не указано ИП-кредитор")
+        if target_ip_id is None:
+            raise ValueError("Не указано ИП-заёмщик")
+        net = await _post(
+            session, tx, ledger.postings(op_type, amount, ip_id, counterparty_ip_id=target_ip_id),
+            not_found={ip_id: "ИП-кредитор не найдено", target_ip_id: "ИП-заёмщик не найдено"},
+        )
+        debt = await crud.create_ip_debt(session, ip_id, target_ip_id, amount)
+        tx.debt_id = debt.id
 
-    elif op_type in (TxType.PRIHOD_MES, TxType.PRIHOD_FAST, TxType.PRIHOD_STO):
-        if ip_id is None:
-            raise ValueError("Не указано ИП")
-        dest = destination or "cash"
-        if dest == "bank":
-            await crud.update_ip_bank(session, ip_id, +amount)
-        elif dest == "debit":
-            await crud.update_ip_debit(session, ip_id, +amount)
-        else:
-            await crud.update_ip_cash(session, ip_id, +amount)
-
-    elif op_type == TxType.SNYAT_RS:
-        if ip_id is None:
-            raise ValueError("Не указано ИП")
-        ip = await crud.get_ip(session, ip_id)
-        if ip is None:
-            raise ValueError("ИП не найдено")
-        if ip.bank_balance < amount:
-            raise InsufficientFundsError(f"Недостаточно средств на Р/С.\nОстаток: {ip.bank_balance:,} ₽")
-        await crud.update_ip_bank(session, ip_id, -amount)
-        await crud.update_ip_debit(session, ip_id, +amount)
+    else:
+        raise ValueError(f"Неизвестный тип операции: {op_type}")
+
+    await _record_posted(session, tx, net)
+    logger.info("Операция [%s] user=%d amount=%d ip=%s", op_type, user_id, amount, ip_id)
+    return tx
 
-    elif op_type == TxType.SNYAT_DEBIT:
-        if ip_id is None:
-            raise ValueError("Не указано ИП")
-        ip = await crud.get_ip(session, ip_id)
-        if ip is None:
-            raise ValueError("ИП не найдено")
-        if ip.debit_balance < amount:
-            raise InsufficientFundsError(f"Недостаточно средств на Дебете.\nОстаток: {ip.debit_balance:,} ₽")
-        await crud.update_ip_debit(session, ip_id, -amount)
-        await crud.update_ip_cash(session, ip_id, +amount)
 
-    elif op_type == TxType.VNESTI_RS:
+def _plan_operation(op_type, amount, ip_id, target_ip_id, destination, uow: BalanceUnitOfWork) -> list[ledger.Posting]:
+    """
+    Проверяет операцию против балансов единицы работы
+    по тем же правилам, что process_operation. Возвращает её проводки.
+    """
+    if amount <= 0:
+        raise ValueError("Сумма должна быть больше нуля")
+    if op_type in _SINGLE_IP_TYPES:
         if ip_id is None:
             raise ValueError("Не указано ИП")
-        ip = await crud.get_ip(session, ip_id)
-        if ip is None:
+        if ip_id not in uow:
             raise ValueError("ИП не найдено")
-        if ip.cash_balance < amount:
-            raise InsufficientFundsError(f"Недостаточно наличных у ИП.\nОстаток: {ip.cash_balance:,} ₽")
-        await crud.update_ip_cash(session, ip_id, -amount)
-        await crud.update_ip_bank(session, ip_id, +amount)
-
+        postings = ledger.postings(op_type, amount, ip_id, destination)
     elif op_type == TxType.ODOLZHIT:
         if ip_id is None:
             raise ValueError("Не указано ИП-кредитор")
         if target_ip_id is None:
             raise ValueError("Не указано ИП-заёмщик")
-        creditor_ip = await crud.get_ip(session, ip_id)
-        if creditor_ip is None:
+        if ip_id not in uow:
             raise ValueError("ИП-кредитор не найдено")
-        if creditor_ip.cash_balance < amount:
-            raise InsufficientFundsError(f"Недостаточно наличных у ИП.\nОстаток: {creditor_ip.cash_balance:,} ₽")
-        await crud.update_ip_cash(session, ip_id, -amount)
-        await crud.update_ip_cash(session, target_ip_id, +amount)
-        await crud.create_ip_debt(session, ip_id, target_ip_id, amount)
-
+        if target_ip_id not in uow:
+            raise ValueError("ИП-заёмщик не найдено")
+        postings = ledger.postings(op_type, amount, ip_id, counterparty_ip_id=target_ip_id)
     else:
         raise ValueError(f"Неизвестный тип операции: {op_type}")
 
-    tx = await crud.create_transaction(session, user_id=user_id, tx_type=op_type, amount=amount, ip_id=ip_id, comment=comment, destination=destination)
-    logger.info("Операция [%s] user=%d amount=%d ip=%s", op_type, user_id, amount, ip_id)
-    return tx
+    for change_ip_id, delta in ledger.net_by_ip(postings).items():
+        _check_funds(uow.balances(change_ip_id), delta)
+    return postings
+
+
+async def process_operations_batch(session, user_id, items, *, atomic=True) -> list[dict]:
+    """
+    Проводит пачку операций за один заход в БД.
+    items — словари с аргументами process_operation
+    (op_type, amount, ip_id, target_ip_id, comment, destination).
+
+    Все затронутые ИП блокируются одним SELECT ... FOR UPDATE (BalanceUnitOfWork), операции
+    проверяются по очереди в памяти (как если бы шли подряд через
+    process_operation), итоговые балансы пишутся одним flush, а транзакции
+    и долги — массовой вставкой.
+
+    atomic=True — первая ошибка отменяет всю пачку (исключение с номером позиции).
+    atomic=False — ошибочные позиции пропускаются, остальные проводятся.
+    Возвращает [{"index", "success", "transaction_id" | "error"}] в порядке items.
+    """
+    user = await session.get(User, user_id)
+    if user is None:
+        raise ValueError(f"Пользователь {user_id} не найден")
+
+    async with BalanceUnitOfWork.of(session) as uow:
+        await uow.load(*(i for item in items for i in (item.get("ip_id"), item.get("target_ip_id"))))
+
+        results: list[dict] = []
+        tx_rows: list[dict] = []
+        tx_postings: list[list[ledger.Posting]] = []
+        debt_rows: list[dict] = []
+        # ИП -> (номер в tx_rows, балансы) после последней операции, затронувшей ИП
+        last_by_ip: dict[int, tuple[int, tuple[int, int, int]]] = {}
+        for index, item in enumerate(items):
+            op_type = item.get("op_type")
+            amount = item.get("amount", 0)
+            ip_id = item.get("ip_id")
+            target_ip_id = item.get("target_ip_id")
+            try:
+                postings = _plan_operation(op_type, amount, ip_id, target_ip_id, item.get("destination"), uow)
+            except ValueError as e:
+                if atomic:
+                    raise type(e)(f"Операция {index + 1}: {e}") from e
+                results.append({"index": index, "success": False, "error": str(e)})
+                continue
+
+            for change_ip_id, delta in ledger.net_by_ip(postings).items():
+                uow.apply(change_ip_id, delta)
+                last_by_ip[change_ip_id] = (len(tx_rows), uow.balances(change_ip_id))
+            tx_postings.append(postings)
+            if op_type == TxType.ODOLZHIT:
+                debt_rows.append({"creditor_ip_id": ip_id, "debtor_ip_id": target_ip_id, "amount": amount})
+            tx_rows.append({
+                "user_id": user_id,
+                "ip_id": ip_id,
+                "type": op_type,
+                "amount": amount,
+                "comment": item.get("comment"),
+                "destination": item.get("destination"),
+                # Пока — номер в debt_rows; id проставляется после вставки долгов
+                "debt_id": len(debt_rows) - 1 if op_type == TxType.ODOLZHIT else None,
+            })
+            results.append({"index": index, "success": True})
+
+        await uow.flush()
+    debt_ids = await crud.create_ip_debts_bulk(session, debt_rows)
+    for row in tx_rows:
+        if row["debt_id"] is not None:
+            row["debt_id"] = debt_ids[row["debt_id"]]
+    inserted = await crud.create_transactions_bulk(session, tx_rows)
+    await crud.create_ledger_entries(session, [
+        row for (tx_id, _), postings in zip(inserted, tx_postings) for row in ledger.rows(tx_id, postings)
+    ])
+    await crud.add_to_daily_aggregates(session, [
+        {**row, "day": created_at.date(), "count": 1}
+        for row, (_, created_at) in zip(tx_rows, inserted)
+    ])
+    # Контрольная точка — после последней операции пачки, затронувшей ИП
+    # (своей или второй стороной займа), с балансами на тот момент
+    for ip_id, (position, balances) in last_by_ip.items():
+        tx_id, created_at = inserted[position]
+        await crud.create_day_checkpoint(session, ip_id, tx_id, created_at, balances)
+    tx_ids = iter(tx_id for tx_id, _ in inserted)
+    for result in results:
+        if result["success"]:
+            result["transaction_id"] = next(tx_ids)
+
+    logger.info("Пачка операций user=%d: проведено %d из %d", user_id, len(tx_rows), len(items))
+    return results
 
 
 async def repay_ip_debt_operation(session, debt_id, amount, user_id):
-    debt = await crud.get_ip_debt_by_id(session, debt_id)
+    debt = await crud.get_ip_debt_by_id(session, debt_id, for_update=True)
     if debt is None:
         raise ValueError("Долг не найден")
     if debt.is_paid:
         raise ValueError("Долг уже погашен")
     if amount > debt.amount:
         raise ValueError(f"Сумма превышает остаток долга: {debt.amount:,} ₽")
-    debtor_ip = await crud.get_ip(session, debt.debtor_ip_id)
-    if debtor_ip.cash_balance < amount:
-        raise InsufficientFundsError(f"Недостаточно наличных у ИП-заёмщика.\nОстаток: {debtor_ip.cash_balance:,} ₽")
-    await crud.update_ip_cash(session, debt.debtor_ip_id, -amount)
-    await crud.update_ip_cash(session, debt.creditor_ip_id, +amount)
+    tx = Transaction(user_id=user_id, ip_id=debt.creditor_ip_id, type=TxType.POGASIT, amount=amount, debt_id=debt_id, comment=f"Погашение долга #{debt_id}")
+    net = await _post(
+        session, tx, ledger.postings(TxType.POGASIT, amount, debt.creditor_ip_id, counterparty_ip_id=debt.debtor_ip_id),
+        messages={debt.debtor_ip_id: {"cash": "Недостаточно наличных у ИП-заёмщика."}},
+    )
     await crud.repay_ip_debt(session, debt_id, amount)
-    tx = await crud.create_transaction(session, user_id=user_id, tx_type=TxType.POGASIT, amount=amount, ip_id=debt.creditor_ip_id, comment=f"Погашение долга #{debt_id}")
+    await _record_posted(session, tx, net)
     logger.info("Долг ИП #%d погашен на %d ₽", debt_id, amount)
     return tx
 
 
-def _get_balance_delta(tx: Transaction) -> tuple[int, int, int]:
-    """Возвращает (delta_cash, delta_bank, delta_debit) для транзакции."""
-    t = tx.type
-    a = tx.amount
-    dest = tx.destination or "cash"
-
-    if t in (TxType.ZAKUP, TxType.STORONNIE, TxType.EXPENSE_WRITEOFF):
-        src = dest if t == TxType.EXPENSE_WRITEOFF else "cash"
-        if src == "bank":
-            return (0, -a, 0)
-        elif src == "debit":
-            return (0, 0, -a)
-        return (-a, 0, 0)
-    elif t in (TxType.PRIHOD_MES, TxType.PRIHOD_FAST, TxType.PRIHOD_STO):
-        if dest == "bank":
-            return (0, a, 0)
-        elif dest == "debit":
-            return (0, 0, a)
-        return (a, 0, 0)
-    elif t == TxType.SNYAT_RS:
-        return (0, -a, a)
-    elif t == TxType.SNYAT_DEBIT:
-        return (a, 0, -a)
-    elif t == TxType.VNESTI_RS:
-        return (-a, a, 0)
-    elif t in (TxType.ODOLZHIT, TxType.POGASIT):
-        return (-a, 0, 0)
-    return (0, 0, 0)
+async def _linked_debt(session, tx: Transaction):
+    """
+    Долг операции «Одолжить» / «Погасить» по tx.debt_id; строка долга
+    блокируется до конца транзакции. Если связи нет (старая операция,
+    которую миграция не смогла однозначно связать), какой долг она меняла,
+    не установить — такую операцию не трогаем.
+    """
+    if tx.debt_id is None:
+        raise ValueError("Операция не связана с долгом, изменить её нельзя")
+    return await crud.get_ip_debt_by_id(session, tx.debt_id, for_update=True)
+
+
+async def _tx_postings(session, tx: Transaction, debt=None) -> list[ledger.Posting]:
+    """
+    Проводки операции. У займов и погашений, проведённых до появления
+    проводок, записана только сторона кредитора — сторона заёмщика
+    восстанавливается по долгу.
+    """
+    postings = [ledger.Posting(*row) for row in await crud.get_ledger_entries(session, tx.id)]
+    if debt is not None and all(p.ip_id == tx.ip_id for p in postings):
+        full = ledger.postings(tx.type, tx.amount, tx.ip_id, counterparty_ip_id=debt.debtor_ip_id)
+        postings += [p for p in full if p.ip_id != tx.ip_id]
+    return postings
+
+
+async def _shift_checkpoints(session, tx: Transaction, net) -> None:
+    # Контрольные точки после этой операции должны учитывать поправку
+    position = (tx.created_at, tx.id)
+    for ip_id, delta in net.items():
+        await crud.shift_checkpoints(session, ip_id, position, delta)
+    await invalidate_on_commit(session, *net)
 
 
 async def cancel_operation(session, tx_id: int, admin_id: int) -> Transaction:
@@ -158,33 +373,23 @@ async def cancel_operation(session, tx_id: int, admin_id: int) -> Transaction:
     if tx.is_cancelled:
         raise ValueError("Операция уже отменена")
 
-    if tx.ip_id is not None:
-        dc, db, dd = _get_balance_delta(tx)
-        # Reversal: apply negative of the original delta
-        if dc != 0:
-            await crud.update_ip_cash(session, tx.ip_id, -dc)
-        if db != 0:
-            await crud.update_ip_bank(session, tx.ip_id, -db)
-        if dd != 0:
-            await crud.update_ip_debit(session, tx.ip_id, -dd)
-
-        # For ODOLZHIT: also reverse the target IP's balance
-        if tx.type == TxType.ODOLZHIT:
-            # The target_ip received +amount cash; find associated debt for the target ip
-            from sqlalchemy import select
-            from backend.database.models import IpDebt
-            from sqlalchemy.orm import selectinload
-            result = await session.execute(
-                select(IpDebt).where(
-                    IpDebt.creditor_ip_id == tx.ip_id,
-                    IpDebt.is_paid.is_(False),
-                ).order_by(IpDebt.created_at.desc()).limit(1)
-            )
-            debt = result.scalar_one_or_none()
-            if debt is not None:
-                await crud.update_ip_cash(session, debt.debtor_ip_id, -tx.amount)
-                debt.is_paid = True
-
+    debt = None
+    if tx.type in _DEBT_TYPES:
+        debt = await _linked_debt(session, tx)
+        # Сторно всей суммы займа верно, только пока по нему ничего не погашено
+        if tx.type == TxType.ODOLZHIT and (debt.is_paid or debt.amount < tx.amount):
+            raise ValueError("По долгу есть погашения — сначала отмените их")
+    postings = await _tx_postings(session, tx, debt)
+    # Сторно: проводки, обратные уже записанным по операции, — для любого типа
+    net = await _post(session, tx, ledger.reversal(postings), check_funds=False)
+    if tx.type == TxType.ODOLZHIT:
+        debt.is_paid = True
+    elif tx.type == TxType.POGASIT:
+        debt.amount += tx.amount
+        debt.is_paid = False
+    await _shift_checkpoints(session, tx, net)
+
+    await _rollup(session, [tx], sign=-1)
     tx.is_cancelled = True
     tx.cancelled_at = datetime.utcnow()
     tx.cancelled_by_id = admin_id
@@ -202,29 +407,30 @@ async def edit_operation(session, tx_id: int, admin_id: int, new_amount: int | N
     if new_amount is not None and new_amount != tx.amount:
         if new_amount <= 0:
             raise ValueError("Сумма должна быть больше нуля")
-        if tx.ip_id is not None:
-            old_dc, old_db, old_dd = _get_balance_delta(tx)
-            # temporarily update tx.amount for delta calculation
-            old_amount = tx.amount
-            tx.amount = new_amount
-            new_dc, new_db, new_dd = _get_balance_delta(tx)
-            tx.amount = old_amount
-
-            diff_dc = new_dc - old_dc
-            diff_db = new_db - old_db
-            diff_dd = new_dd - old_dd
-            if diff_dc != 0:
-                await crud.update_ip_cash(session, tx.ip_id, diff_dc)
-            if diff_db != 0:
-                await crud.update_ip_bank(session, tx.ip_id, diff_db)
-            if diff_dd != 0:
-                await crud.update_ip_debit(session, tx.ip_id, diff_dd)
-
+        debt = None
+        if tx.type in _DEBT_TYPES:
+            debt = await _linked_debt(session, tx)
+            # Займ больше — остаток долга больше; погашение больше — меньше
+            diff = new_amount - tx.amount if tx.type == TxType.ODOLZHIT else tx.amount - new_amount
+            if debt.amount + diff < 0:
+                if tx.type == TxType.ODOLZHIT:
+                    raise ValueError(f"По долгу уже погашено {tx.amount - debt.amount:,} ₽")
+                raise ValueError(f"Сумма превышает остаток долга: {debt.amount + tx.amount:,} ₽")
+        postings = await _tx_postings(session, tx, debt)
+        net = await _post(session, tx, ledger.rescale(postings, tx.amount, new_amount), check_funds=False)
+        if debt is not None:
+            debt.amount += diff
+            debt.is_paid = debt.amount == 0
+        await _shift_checkpoints(session, tx, net)
+
+        await _rollup(session, [tx], amount=new_amount - tx.amount)
         tx.amount = new_amount
 
     if new_comment is not None:
         tx.comment = new_comment.strip() or None
 
+    await invalidate_on_commit(session, tx.ip_id)
+
     logger.info("Операция #%d отредактирована администратором %d", tx_id, admin_id)
     return tx
 
@@ -233,25 +439,9 @@ async def write_off_expense(session, expense_id: int, ip_id: int, amount: int, s
     expense = await crud.get_expense(session, expense_id)
     if expense is None:
         raise ValueError("Расход не найден")
-    ip = await crud.get_ip(session, ip_id)
-    if ip is None:
-        raise ValueError("ИП не найдено")
     if amount <= 0:
         raise ValueError("Сумма должна быть больше нуля")
 
-    if source == "bank":
-        if ip.bank_balance < amount:
-            raise InsufficientFundsError(f"Недостаточно средств на Р/С. Остаток: {ip.bank_balance:,} ₽")
-        await crud.update_ip_bank(session, ip_id, -amount)
-    elif source == "debit":
-        if ip.debit_balance < amount:
-            raise InsufficientFundsError(f"Недостаточно средств на Дебете. Остаток: {ip.debit_balance:,} ₽")
-        await crud.update_ip_debit(session, ip_id, -amount)
-    else:  # cash
-        if ip.cash_balance < amount:
-            raise InsufficientFundsError(f"Недостаточно наличных у ИП. Остаток: {ip.cash_balance:,} ₽")
-        await crud.update_ip_cash(session, ip_id, -amount)
-
     tx = Transaction(
         user_id=user_id,
         ip_id=ip_id,
@@ -261,7 +451,7 @@ async def write_off_expense(session, expense_id: int, ip_id: int, amount: int, s
         destination=source,
         expense_id=expense_id,
     )
-    session.add(tx)
-    await session.flush()
+    net = await _post(session, tx, ledger.postings(TxType.EXPENSE_WRITEOFF, amount, ip_id, source))
+    await _record_posted(session, tx, net)
     logger.info("Расход #%d списан с ИП #%d на %d ₽ (%s)", expense_id, ip_id, amount, source)
     return tx
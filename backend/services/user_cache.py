@@ -0,0 +1,151 @@
+"""
+Кэш пользователей для авторизации запросов Mini App.
+
+get_current_user вызывается на каждый запрос, а пользователь и его роль
+меняются редко. Пользователь загружается из БД при первом обращении,
+дальше роль и данные берутся из памяти:
+- любое изменение строки users через ORM (set_user_role, /start с кодом
+  администратора, reset_all_data) сбрасывает запись после коммита —
+  слушатели сессии ниже, вызывать сброс вручную не нужно;
+- смена username в Telegram не требует записи в рамках запроса:
+  новые имена копятся и пишутся в БД пачкой в фоне (write-behind).
+Другие процессы узнают о сбросе через database/notify; записи к тому же
+живут не дольше _TTL.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from sqlalchemy import bindparam, event, update
+from sqlalchemy.orm import Session
+
+from backend.database import crud, notify
+from backend.database.models import User
+from backend.database.session import async_session_factory
+
+logger = logging.getLogger(__name__)
+
+_TTL = 300
+# Как часто фоновая задача пишет накопленные username
+_FLUSH_INTERVAL = 5.0
+_CHANGED_KEY = "changed_user_ids"
+
+# user_id → (отсоединённая копия пользователя, момент устаревания).
+# Записи не меняются на месте: вызывающие получают свою копию, а новое
+# значение заменяет запись целиком
+_users: dict[int, tuple[User, float]] = {}
+# user_id → username, который ещё не записан в БД
+_pending_usernames: dict[int, Optional[str]] = {}
+_flusher: Optional[asyncio.Task] = None
+
+
+def _snapshot(user: User) -> User:
+    """Копия без привязки к сессии: переживает закрытие сессии запроса."""
+    return User(
+        id=user.id,
+        username=user.username,
+        role=user.role,
+        cash_balance=user.cash_balance,
+        digest_enabled=user.digest_enabled,
+        created_at=user.created_at,
+    )
+
+
+def _remember(user: User) -> None:
+    _users[user.id] = (_snapshot(user), time.monotonic() + _TTL)
+
+
+def invalidate(user_id: int) -> None:
+    _users.pop(user_id, None)
+
+
+async def get_user(session, user_id: int, username: Optional[str], admin_ids=None) -> User:
+    """
+    Пользователь по Telegram ID; новый регистрируется (как get_or_create_user).
+    Возвращает копию, не привязанную к сессии и не общую с другими
+    запросами: её можно менять, кэш от этого не меняется.
+    """
+    cached = _users.get(user_id)
+    if cached is not None and time.monotonic() < cached[1]:
+        user = _snapshot(cached[0])
+        if user.username != username:
+            user.username = username
+            _users[user_id] = (_snapshot(user), cached[1])
+            _pending_usernames[user_id] = username
+            _ensure_flusher()
+        return user
+
+    user = await crud.get_user(session, user_id)
+    if user is not None:
+        if user.username != username:
+            user.username = username
+        _remember(user)
+        return user
+
+    user = await crud.get_or_create_user(session, user_id, username, admin_ids)
+    # Новый пользователь попадает в кэш только после коммита:
+    # при откате запроса его строки в БД не будет
+    event.listen(session.sync_session, "after_commit", lambda _s: _remember(user), once=True)
+    return user
+
+
+# ── Сброс по изменениям ───────────────────────────────────────────────────────
+
+@event.listens_for(Session, "after_flush")
+def _after_flush(session, flush_context) -> None:
+    changed = {obj.id for obj in (*session.dirty, *session.deleted) if isinstance(obj, User)}
+    if changed:
+        session.info.setdefault(_CHANGED_KEY, set()).update(changed)
+        for user_id in changed:
+            notify.publish_on_commit(session, f"user:{user_id}")
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session) -> None:
+    for user_id in session.info.pop(_CHANGED_KEY, ()):
+        invalidate(user_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session) -> None:
+    session.info.pop(_CHANGED_KEY, None)
+
+
+notify.subscribe("user", lambda arg: invalidate(int(arg)))
+notify.subscribe("resync", lambda _arg: _users.clear())
+
+
+# ── Отложенная запись username ────────────────────────────────────────────────
+
+def _ensure_flusher() -> None:
+    global _flusher
+    if _flusher is None or _flusher.done():
+        _flusher = asyncio.create_task(_flush_loop())
+
+
+async def _flush_loop() -> None:
+    while _pending_usernames:
+        await asyncio.sleep(_FLUSH_INTERVAL)
+        await flush_usernames()
+
+
+async def flush_usernames() -> None:
+    """Пишет накопленные username одним executemany UPDATE."""
+    if not _pending_usernames:
+        return
+    batch = [{"uid": uid, "uname": name} for uid, name in _pending_usernames.items()]
+    _pending_usernames.clear()
+    table = User.__table__
+    # Core UPDATE, а не ORM: не помечает пользователей изменёнными и не сбрасывает кэш
+    stmt = update(table).where(table.c.id == bindparam("uid")).values(username=bindparam("uname"))
+    try:
+        async with async_session_factory() as session, session.begin():
+            await session.execute(stmt, batch)
+    except Exception:
+        logger.exception("Не удалось записать username (%d шт.)", len(batch))
+        for row in batch:
+            _pending_usernames.setdefault(row["uid"], row["uname"])
@@ -0,0 +1,60 @@
+"""
+Общие фикстуры тестов.
+
+Тесты с БД идут на SQLite (aiosqlite) во временном файле: схема — из моделей
+(create_all), функции PostgreSQL, которые используют модели и crud
+(clock_timestamp, now), подставлены. Без aiosqlite такие тесты пропускаются.
+"""
+
+import os
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+import pytest
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123:test")
+
+
+@pytest.fixture
+def sqlite_db(tmp_path, monkeypatch):
+    """
+    Фабрика БД: async with sqlite_db() as session_factory — пустая схема,
+    пользователь-администратор 1 и ИП 1 «А» (нал 100, Р/С 50) и 2 «Б» (нули).
+    """
+    pytest.importorskip("aiosqlite")
+    from sqlalchemy import event
+    from sqlalchemy.dialects import sqlite
+    from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+    from backend.database import crud
+    from backend.database.models import IP, Base, User
+
+    # ON CONFLICT у SQLite тот же, что у PostgreSQL
+    monkeypatch.setattr(crud, "pg_insert", sqlite.insert)
+
+    @asynccontextmanager
+    async def make():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'test.db'}")
+
+        @event.listens_for(engine.sync_engine, "connect")
+        def _connect(dbapi_conn, _record):
+            now = lambda: datetime.utcnow().isoformat(" ")  # noqa: E731
+            dbapi_conn.create_function("clock_timestamp", 0, now)
+            dbapi_conn.create_function("now", 0, now)
+            dbapi_conn.execute("PRAGMA foreign_keys = ON")
+
+        try:
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+            factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+            async with factory() as session, session.begin():
+                session.add(User(id=1, username="admin", role="admin"))
+                session.add_all([
+                    IP(name="А", cash_balance=100, bank_balance=50, debit_balance=0, initial_capital=150),
+                    IP(name="Б", cash_balance=0, bank_balance=0, debit_balance=0, initial_capital=0),
+                ])
+            yield factory
+        finally:
+            await engine.dispose()
+
+    return make
@@ -0,0 +1,35 @@
+"""Сводная выгрузка (services/consolidated_export): книги ИП собираются в процессах пула."""
+
+import asyncio
+import io
+import zipfile
+
+from openpyxl import load_workbook
+
+from backend.database.models import TxType
+from backend.services import consolidated_export, transaction
+from backend.services.executor import cpu_executor
+
+
+def test_consolidated_archive(sqlite_db, monkeypatch):
+    async def run():
+        async with sqlite_db() as factory:
+            monkeypatch.setattr(consolidated_export, "async_session_factory", factory)
+            async with factory() as session, session.begin():
+                await transaction.process_operation(session, 1, TxType.ZAKUP, 30, ip_id=1)
+                await transaction.process_operation(session, 1, TxType.ODOLZHIT, 20, ip_id=1, target_ip_id=2)
+
+            buf = io.BytesIO()
+            try:
+                await consolidated_export.write_consolidated([1, 2], buf)
+            finally:
+                cpu_executor.shutdown()
+            return buf
+
+    with zipfile.ZipFile(asyncio.run(run())) as archive:
+        assert sorted(archive.namelist()) == ["А.xlsx", "Б.xlsx", "Итого.xlsx"]
+        book = load_workbook(io.BytesIO(archive.read("А.xlsx")), read_only=True)
+        # Шапка + две операции ИП «А» на первом листе
+        assert len(list(book.worksheets[0].iter_rows())) == 3
+        book = load_workbook(io.BytesIO(archive.read("Б.xlsx")), read_only=True)
+        assert len(list(book.worksheets[0].iter_rows())) == 2
@@ -0,0 +1,67 @@
+"""Фоновые выгрузки (services/export_jobs): задания в БД, общие для процессов API."""
+
+import asyncio
+
+from backend.database import crud
+from backend.database.models import TxType
+from backend.services import export_jobs as jobs_module
+from backend.services import transaction
+from backend.services.export_jobs import ExportCache, ExportJobQueue, make_key, render
+
+
+def test_job_is_visible_to_another_process(sqlite_db, tmp_path, monkeypatch):
+    async def run():
+        async with sqlite_db() as factory:
+            monkeypatch.setattr(jobs_module, "async_session_factory", factory)
+            cache = ExportCache(str(tmp_path / "cache"), 10 * 1024 * 1024)
+            # Два «процесса» API: общий каталог кэша и БД, своя очередь в памяти
+            first, second = ExportJobQueue(cache, workers=1), ExportJobQueue(cache, workers=1)
+
+            async with factory() as session, session.begin():
+                await transaction.process_operation(session, 1, TxType.ZAKUP, 30, ip_id=1)
+            async with factory() as session, session.begin():
+                key = await make_key(session, 1, None, None, "csv")
+                job = await first.submit(session, 1, key, "А.csv")
+                # То же задание, пришедшее одновременно, — собирается вместе с первым
+                twin = await first.submit(session, 1, key, "А.csv")
+
+            for _ in range(100):
+                async with factory() as session:
+                    seen = await second.get(session, job.id)
+                    seen_twin = await second.get(session, twin.id)
+                if seen.status == "done" and seen_twin.status == "done":
+                    break
+                await asyncio.sleep(0.05)
+            for task in first._tasks:
+                task.cancel()
+
+            assert (seen.status, seen.error) == ("done", None)
+            assert seen_twin.file_name == seen.file_name
+            with open(second.file_path(seen), encoding="utf-8") as f:
+                assert "30" in f.read()
+
+    asyncio.run(run())
+
+
+def test_cancel_invalidates_cache(sqlite_db, tmp_path, monkeypatch):
+    async def run():
+        async with sqlite_db() as factory:
+            cache = ExportCache(str(tmp_path / "cache"), 10 * 1024 * 1024)
+            monkeypatch.setattr(jobs_module, "export_cache", cache)
+            async with factory() as session, session.begin():
+                tx = await transaction.process_operation(session, 1, TxType.ZAKUP, 30, ip_id=1)
+                await transaction.process_operation(session, 1, TxType.ZAKUP, 10, ip_id=1)
+            async with factory() as session:
+                key = await make_key(session, 1, None, None, "csv")
+                path = await render(session, cache, key)
+            assert cache.get(key) == path
+
+            async with factory() as session, session.begin():
+                await transaction.cancel_operation(session, tx.id, 1)
+                assert await crud.get_export_generation(session, 1) == 1
+            # Последняя операция та же (отмена не меняет ключ), но файл сброшен
+            async with factory() as session:
+                assert await make_key(session, 1, None, None, "csv") == key
+            assert cache.get(key) is None
+
+    asyncio.run(run())
@@ -0,0 +1,124 @@
+"""
+Отправка очереди сообщений (bot/outbox.py) с подставным ботом, без БД и Telegram.
+
+Запуск: python -m pytest tests/test_outbox.py
+"""
+
+import asyncio
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123:test")
+
+from aiogram.exceptions import TelegramRetryAfter  # noqa: E402
+from aiogram.methods import SendMessage  # noqa: E402
+
+from backend.bot import outbox  # noqa: E402
+
+
+class FakeBot:
+    """Записывает отправки; fail — {(chat_id, text): исключение} для первой попытки."""
+
+    def __init__(self, fail=None):
+        self.sent: list[tuple[float, int, str]] = []
+        self.fail = dict(fail or {})
+
+    async def send_message(self, chat_id, text, parse_mode=None):
+        error = self.fail.pop((chat_id, text), None)
+        if error is not None:
+            raise error
+        self.sent.append((time.monotonic(), chat_id, text))
+
+    def times(self, chat_id=None) -> list[float]:
+        return [t for t, chat, _ in self.sent if chat_id is None or chat == chat_id]
+
+    def texts(self, chat_id) -> list[str]:
+        return [text for _, chat, text in self.sent if chat == chat_id]
+
+
+@pytest.fixture
+def records(monkeypatch):
+    """Вместо записи в БД — список вызовов (имя функции crud, аргументы)."""
+    calls = []
+
+    async def record(fn, *args):
+        calls.append((fn.__name__, *args))
+
+    monkeypatch.setattr(outbox, "_record", record)
+    return calls
+
+
+def _messages(chats: int, per_chat: int) -> list[list]:
+    return [
+        [
+            SimpleNamespace(id=chat * per_chat + i, chat_id=chat, body=f"{chat}:{i}", parse_mode=None, attempts=0)
+            for i in range(per_chat)
+        ]
+        for chat in range(chats)
+    ]
+
+
+def _send(bot, limiter, chats) -> None:
+    async def send():
+        await asyncio.gather(*(outbox._send_chat(bot, limiter, messages) for messages in chats))
+
+    asyncio.run(send())
+
+
+def _max_in_window(times, window=1.0) -> int:
+    times = sorted(times)
+    best, start = 0, 0
+    for end in range(len(times)):
+        while times[end] - times[start] >= window:
+            start += 1
+        best = max(best, end - start + 1)
+    return best
+
+
+def test_global_and_chat_rate(records):
+    bot = FakeBot()
+    _send(bot, outbox.RateLimiter(rate=20, chat_rate=2), _messages(chats=15, per_chat=3))
+
+    assert len(bot.sent) == 45
+    # Ведро ёмкостью 1: в любой секунде не больше rate + 1 отправок
+    assert _max_in_window(bot.times()) <= 21
+    for chat in range(15):
+        times = bot.times(chat)
+        assert all(b - a >= 0.45 for a, b in zip(times, times[1:]))
+    assert sum(1 for name, *_ in records if name == "mark_outbound_sent") == 45
+
+
+def test_retry_after_pauses_all_chats(records):
+    error = TelegramRetryAfter(method=SendMessage(chat_id=0, text="0:0"), message="Too Many Requests", retry_after=1)
+    bot = FakeBot(fail={(0, "0:1"): error})
+    started = time.monotonic()
+    _send(bot, outbox.RateLimiter(rate=5, chat_rate=5), _messages(chats=3, per_chat=3))
+
+    assert len(bot.sent) == 9
+    assert bot.texts(0) == ["0:0", "0:1", "0:2"]
+    # После RetryAfter отправка стоит у всех чатов, не только у того, где пришёл ответ
+    resumed = bot.times(0)[1]
+    assert resumed - started >= 1.0
+    before_pause = [t for t in bot.times() if t < resumed - 0.9]
+    assert len(before_pause) < 9
+    assert not any(name == "mark_outbound_failed" for name, *_ in records)
+
+
+def test_failure_stops_the_chat(records):
+    bot = FakeBot(fail={(0, "0:1"): RuntimeError("boom")})
+    _send(bot, outbox.RateLimiter(rate=100, chat_rate=100), _messages(chats=2, per_chat=4))
+
+    assert bot.texts(0) == ["0:0"]
+    assert bot.texts(1) == ["1:0", "1:1", "1:2", "1:3"]
+    failed = [call for call in records if call[0] == "mark_outbound_failed"]
+    assert len(failed) == 1
+    _, message_id, attempts, error, next_attempt_at = failed[0]
+    assert (message_id, attempts, error) == (1, 1, "boom")
+    assert next_attempt_at is not None
+    # Следующие сообщения чата возвращены в очередь и уйдут после неудачного
+    assert ("release_outbound_messages", [2, 3]) in records
+    sent = [call[1] for call in records if call[0] == "mark_outbound_sent"]
+    assert sorted(sent) == [0, 4, 5, 6, 7]
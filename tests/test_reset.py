@@ -0,0 +1,27 @@
+"""Сброс данных (crud.reset_all_data) после займов и погашений."""
+
+import asyncio
+
+from sqlalchemy import func, select
+
+from backend.database import crud
+from backend.database.models import IP, IpDebt, LedgerEntry, Transaction, TxType
+from backend.services import transaction
+
+
+def test_reset_after_loan_and_repayment(sqlite_db):
+    async def run():
+        async with sqlite_db() as factory:
+            async with factory() as session, session.begin():
+                loan = await transaction.process_operation(session, 1, TxType.ODOLZHIT, 40, ip_id=1, target_ip_id=2)
+            async with factory() as session, session.begin():
+                await transaction.repay_ip_debt_operation(session, loan.debt_id, 10, 1)
+
+            async with factory() as session, session.begin():
+                await crud.reset_all_data(session)
+
+            async with factory() as session:
+                for model in (Transaction, IpDebt, LedgerEntry, IP):
+                    assert await session.scalar(select(func.count()).select_from(model)) == 0
+
+    asyncio.run(run())
@@ -0,0 +1,97 @@
+"""Проведение, отмена и правка операций (services/transaction)."""
+
+import asyncio
+
+import pytest
+from sqlalchemy import func, select
+
+from backend.database.models import IP, IpBalanceCheckpoint, LedgerEntry, TxType
+from backend.services import transaction
+
+
+async def _balances(session, ip_id):
+    ip = await session.get(IP, ip_id, populate_existing=True)
+    return ip.cash_balance, ip.bank_balance, ip.debit_balance
+
+
+async def _ledger_sum(session, ip_id):
+    return await session.scalar(select(func.coalesce(func.sum(LedgerEntry.delta), 0)).where(LedgerEntry.ip_id == ip_id))
+
+
+def test_single_operations_keep_balances_and_ledger(sqlite_db):
+    async def run():
+        async with sqlite_db() as factory:
+            async with factory() as session, session.begin():
+                await transaction.process_operation(session, 1, TxType.ZAKUP, 30, ip_id=1)
+                loan = await transaction.process_operation(session, 1, TxType.ODOLZHIT, 50, ip_id=1, target_ip_id=2)
+            async with factory() as session, session.begin():
+                await transaction.edit_operation(session, loan.id, 1, new_amount=20)
+            async with factory() as session, session.begin():
+                await transaction.cancel_operation(session, loan.id, 1)
+
+            async with factory() as session:
+                assert await _balances(session, 1) == (70, 50, 0)
+                assert await _balances(session, 2) == (0, 0, 0)
+                # Проводки есть только у операций, поэтому сумма — только их изменения
+                assert await _ledger_sum(session, 1) == -30
+                assert await _ledger_sum(session, 2) == 0
+
+    asyncio.run(run())
+
+
+def test_single_operation_errors(sqlite_db):
+    async def run():
+        async with sqlite_db() as factory:
+            async with factory() as session, session.begin():
+                with pytest.raises(transaction.InsufficientFundsError, match="Недостаточно наличных"):
+                    await transaction.process_operation(session, 1, TxType.ZAKUP, 101, ip_id=1)
+                with pytest.raises(ValueError, match="ИП-заёмщик не найдено"):
+                    await transaction.process_operation(session, 1, TxType.ODOLZHIT, 10, ip_id=1, target_ip_id=99)
+                with pytest.raises(ValueError, match="ИП не найдено"):
+                    await transaction.process_operation(session, 1, TxType.ZAKUP, 10, ip_id=99)
+                # После ошибки единица работы отвязана от сессии — следующая операция проходит
+                await transaction.process_operation(session, 1, TxType.ZAKUP, 100, ip_id=1)
+                assert await _balances(session, 1) == (0, 50, 0)
+
+    asyncio.run(run())
+
+
+async def _checkpoints(session):
+    rows = await session.execute(select(
+        IpBalanceCheckpoint.ip_id, IpBalanceCheckpoint.tx_id,
+        IpBalanceCheckpoint.cash_balance, IpBalanceCheckpoint.bank_balance, IpBalanceCheckpoint.debit_balance,
+    ).order_by(IpBalanceCheckpoint.ip_id))
+    return [tuple(row) for row in rows]
+
+
+def test_batch_checkpoints_after_last_posting_of_each_ip(sqlite_db):
+    async def run():
+        async with sqlite_db() as factory:
+            async with factory() as session, session.begin():
+                results = await transaction.process_operations_batch(session, 1, [
+                    {"op_type": TxType.PRIHOD_MES, "amount": 5, "ip_id": 2, "destination": "cash"},
+                    {"op_type": TxType.ODOLZHIT, "amount": 20, "ip_id": 1, "target_ip_id": 2},
+                    {"op_type": TxType.ZAKUP, "amount": 10, "ip_id": 1},
+                ])
+            tx_ids = [r["transaction_id"] for r in results]
+
+            async with factory() as session:
+                # Б — после займа (вторая сторона), а не после своего прихода
+                assert await _checkpoints(session) == [
+                    (1, tx_ids[2], 70, 50, 0),
+                    (2, tx_ids[1], 25, 0, 0),
+                ]
+
+    asyncio.run(run())
+
+
+def test_loan_checkpoints_borrower(sqlite_db):
+    async def run():
+        async with sqlite_db() as factory:
+            async with factory() as session, session.begin():
+                loan = await transaction.process_operation(session, 1, TxType.ODOLZHIT, 40, ip_id=1, target_ip_id=2)
+
+            async with factory() as session:
+                assert await _checkpoints(session) == [(1, loan.id, 60, 50, 0), (2, loan.id, 40, 0, 0)]
+
+    asyncio.run(run())
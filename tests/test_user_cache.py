@@ -0,0 +1,32 @@
+"""Кэш пользователей (services/user_cache): вызывающие получают свои копии."""
+
+import asyncio
+
+from backend.services import user_cache
+
+
+def test_cached_user_is_not_shared(sqlite_db, monkeypatch):
+    monkeypatch.setattr(user_cache, "_users", {})
+    monkeypatch.setattr(user_cache, "_pending_usernames", {})
+    monkeypatch.setattr(user_cache, "_ensure_flusher", lambda: None)
+
+    async def run():
+        async with sqlite_db() as factory:
+            async with factory() as session, session.begin():
+                await user_cache.get_user(session, 1, "admin")
+
+            async with factory() as session:
+                first = await user_cache.get_user(session, 1, "admin")
+                first.role = "user"
+                second = await user_cache.get_user(session, 1, "admin")
+                assert second is not first
+                assert second.role == "admin"
+
+                renamed = await user_cache.get_user(session, 1, "new_name")
+                assert renamed.username == "new_name"
+                # Ранее выданная копия не меняется, запись в кэше заменена
+                assert second.username == "admin"
+                assert user_cache._users[1][0].username == "new_name"
+                assert user_cache._pending_usernames == {1: "new_name"}
+
+    asyncio.run(run())